@@ -0,0 +1,156 @@
+#    Copyright 2014 Helios Taraba
+#
+#    This file provides the luminance adaptive timelapse interval
+#
+#    adaptive.py is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    adaptive.py is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with adaptive.py.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Luminance adaptive timelapse interval. The scene brightness is measured
+either from the viewfinder frames (mean luma from a histogram of a strided
+subsample) or from the exposure the camera's auto exposure settled on, and
+is mapped onto an interval between min_interval (bright) and max_interval
+(dark). The interval is interpolated geometrically so dusk and dawn get a
+smooth transition instead of a jump.
+
+ScheduleLog records when each timelapse picture was taken and with which
+interval so the video can be retimed afterwards.
+"""
+import csv
+import datetime as dt
+import math
+import time
+try:
+  import numpy
+except ImportError:
+  numpy = None
+#------------------------------------------------------------------------------#
+# histogram: 256 bin luma histogram of a strided subsample of an rgb buffer   #
+#                                                                              #
+# Parameters: rgb   bytearray with w*h*3 bytes (or more)                       #
+#             size  (w, h)                                                     #
+#             step  subsample factor in both directions                        #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def histogram(rgb, size, step=8):
+  w, h  = size
+  frame = numpy.frombuffer(rgb, numpy.uint8, w * h * 3).reshape(h, w, 3)
+  sub   = frame[::step, ::step].astype(numpy.uint16)
+  luma  = (sub[..., 0] * 77 + sub[..., 1] * 150 + sub[..., 2] * 29) >> 8
+  return numpy.bincount(luma.ravel(), minlength=256)
+#------------------------------------------------------------------------------#
+# meanLuma: mean of a luma histogram                                           #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def meanLuma(hist):
+  return float(numpy.dot(hist, numpy.arange(256))) / max(1, int(hist.sum()))
+#------------------------------------------------------------------------------#
+# exposureValue: scene brightness in EV like units (log2) from the exposure    #
+#                the camera chose: the shorter the exposure and the lower the  #
+#                gain the brighter the scene.                                  #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def exposureValue(camera):
+  exposure = max(1, camera.exposure_speed) # microseconds
+  gain     = float(camera.analog_gain) * float(camera.digital_gain)
+  return math.log(1e6 / (exposure * max(gain, 0.01)), 2)
+#------------------------------------------------------------------------------#
+# AdaptiveInterval: keeps a smoothed brightness level and converts it to an    #
+#                   interval                                                   #
+#                                                                              #
+# Parameters: minInterval interval in seconds at or above level bright         #
+#             maxInterval interval in seconds at or below level dark           #
+#             dark, bright brightness levels, mean luma (0..255) for source    #
+#                         'preview', EV for source 'exposure'                  #
+#             source      'preview' or 'exposure'                              #
+#             smoothing   weight of a new measurement (0..1)                   #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class AdaptiveInterval(object):
+  EXPOSURE_PERIOD = 1.0 # seconds between reading the camera's exposure
+
+  def __init__(self, minInterval=10, maxInterval=600, dark=20, bright=100, source='preview', smoothing=0.1):
+    if source == 'preview' and numpy is None:
+      raise ImportError('adaptive interval from preview frames requires numpy')
+    self.minInterval = float(minInterval)
+    self.maxInterval = float(maxInterval)
+    self.dark        = float(dark)
+    self.bright      = float(bright)
+    self.source      = source
+    self.smoothing   = smoothing
+    self.level       = None
+    self.lastRead    = 0
+
+  def feed(self, value):
+    if self.level is None:
+      self.level = value
+    else:
+      self.level += self.smoothing * (value - self.level)
+
+  def feedPreview(self, rgb, size):
+    if self.source == 'preview':
+      self.feed(meanLuma(histogram(rgb, size)))
+
+  def feedExposure(self, camera, now=None):
+    """Read the camera's exposure, at most once per EXPOSURE_PERIOD."""
+    now = time.time() if now is None else now
+    if self.source == 'exposure' and now - self.lastRead >= self.EXPOSURE_PERIOD:
+      self.lastRead = now
+      self.feed(exposureValue(camera))
+
+  def interval(self):
+    if self.level is None:
+      return self.minInterval
+    t = (self.level - self.dark) / max(1e-6, self.bright - self.dark)
+    t = min(1.0, max(0.0, t))
+    # geometric interpolation: maxInterval when dark, minInterval when bright
+    return self.maxInterval * (self.minInterval / self.maxInterval) ** t
+#------------------------------------------------------------------------------#
+# ScheduleLog: csv file with one line per timelapse picture                    #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class ScheduleLog(object):
+  def __init__(self, filename):
+    self.filename = filename
+    self.file     = open(filename, 'a')
+    self.writer   = csv.writer(self.file)
+    self.count    = 0
+    self.previous = None
+    self.writer.writerow(['frame', 'file', 'time', 'epoch', 'delta', 'interval', 'level'])
+
+  def record(self, filename, interval, level):
+    now = time.time()
+    self.count += 1
+    delta = '' if self.previous is None else '%.3f' % (now - self.previous)
+    self.previous = now
+    self.writer.writerow([self.count, filename,
+                          dt.datetime.fromtimestamp(now).strftime('%Y-%m-%d %H:%M:%S.%f'),
+                          '%.3f' % now, delta, '%.1f' % interval,
+                          '' if level is None else '%.2f' % level])
+    self.file.flush()
+
+  def close(self):
+    self.file.close()
@@ -0,0 +1,225 @@
+#    Copyright 2014 Helios Taraba
+#
+#    This file provides a small http/json control api for the camera
+#
+#    api.py is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    api.py is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with api.py.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Local http/json control api.
+
+  GET  /status           timelapse state, settings and the latest capture
+  GET  /latest.jpg       last picture taken, served from memory, supports
+                         ETag / If-None-Match (304 Not Modified)
+  GET  /trace.json       timeline of the last operations as Chrome trace
+                         events, while [TRACE] is enabled (see tracing.py)
+  POST /timelapse/start  start the timelapse
+  POST /timelapse/stop   stop the timelapse
+  POST /capture          take a picture
+  POST /settings         json body, e.g. {"interval": 60, "images": 500}
+
+The request handlers never touch the camera or the display. Actions are
+queued and executed by the main loop of cam.py (see ControlApi.process),
+status is gathered through a callback which only reads globals.
+"""
+import email.utils
+import json
+import logging
+import threading
+import time
+try:
+  import queue
+except ImportError:
+  import Queue as queue
+try:
+  from http import server as httpserver
+except ImportError:
+  import BaseHTTPServer as httpserver
+
+import mjpeg
+import tracing
+
+logger = logging.getLogger('WEBCAM.api')
+#------------------------------------------------------------------------------#
+# LatestFrame: in memory copy of the last picture taken and its ETag           #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class LatestFrame(object):
+  def __init__(self):
+    self.lock     = threading.Lock()
+    self.data     = None
+    self.name     = None
+    self.etag     = None
+    self.modified = None
+    self.count    = 0
+
+  def set(self, data, name=None):
+    now = time.time()
+    with self.lock:
+      self.count   += 1
+      self.data     = data
+      self.name     = name
+      self.modified = now
+      # unique per capture and per run, no need to hash megabytes of jpeg
+      self.etag     = '"%x-%x-%x"' % (int(now * 1000), self.count, len(data))
+
+  def get(self):
+    with self.lock:
+      return self.data, self.etag, self.modified, self.name
+#------------------------------------------------------------------------------#
+# ControlApi: http server plus the queue of actions for the main loop          #
+#                                                                              #
+# Parameters: port      tcp port of the http server                            #
+#             actions   dictionary of action name -> function, executed by    #
+#                       process() on the main loop                             #
+#             status    function returning a dictionary with the status       #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class ControlApi(object):
+  def __init__(self, port, actions, status):
+    self.port     = port
+    self.actions  = actions
+    self.status   = status
+    self.latest   = LatestFrame()
+    self.requests = queue.Queue(16)
+    self.server   = None
+
+  def start(self):
+    self.server = mjpeg.StreamServer(('', self.port), ApiHandler)
+    self.server.api = self
+    t = threading.Thread(target=self.server.serve_forever, name='API_SERVER')
+    t.daemon = True
+    t.start()
+    logger.info('control api on port ' + str(self.port))
+
+  def stop(self):
+    if self.server is not None:
+      self.server.shutdown()
+      self.server.server_close()
+      self.server = None
+
+  def submit(self, action, *args):
+    """Queue an action for the main loop, False when the queue is full."""
+    try:
+      self.requests.put_nowait((action, args))
+      return True
+    except queue.Full:
+      return False
+
+  def process(self):
+    """Execute queued actions, called from the main loop of cam.py."""
+    while True:
+      try:
+        action, args = self.requests.get_nowait()
+      except queue.Empty:
+        return
+      try:
+        self.actions[action](*args)
+      except Exception:
+        logger.error('api action ' + action + ' failed', exc_info=True)
+
+  def getStatus(self):
+    d = self.status()
+    data, etag, modified, name = self.latest.get()
+    if data is not None:
+      d['latest'] = { 'name': name, 'etag': etag, 'bytes': len(data), 'time': modified }
+    return d
+#------------------------------------------------------------------------------#
+# ApiHandler: http request handler of the control api                          #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class ApiHandler(httpserver.BaseHTTPRequestHandler):
+  def do_GET(self):
+    if self.path == '/status':
+      self.sendJson(200, self.server.api.getStatus())
+    elif self.path == '/latest.jpg':
+      self.sendLatest()
+    elif self.path == '/trace.json' and tracing.enabled:
+      self.sendJson(200, tracing.chromeTrace())
+    else:
+      self.sendJson(404, {'error': 'not found'})
+
+  def do_HEAD(self):
+    if self.path == '/latest.jpg':
+      self.sendLatest(body=False)
+    else:
+      self.sendJson(404, {'error': 'not found'})
+
+  def do_POST(self):
+    if self.path == '/timelapse/start':
+      self.queue('timelapse', True)
+    elif self.path == '/timelapse/stop':
+      self.queue('timelapse', False)
+    elif self.path == '/capture':
+      self.queue('capture')
+    elif self.path == '/settings':
+      try:
+        length = int(self.headers.get('Content-Length', 0))
+        values = json.loads(self.rfile.read(length).decode('utf-8'))
+        values = dict((k, int(values[k])) for k in ('interval', 'images') if k in values)
+      except (ValueError, TypeError, AttributeError):
+        self.sendJson(400, {'error': 'expected json object with integer interval and/or images'})
+        return
+      if not values or min(values.values()) < 1 or values.get('images', 1) > 9999:
+        self.sendJson(400, {'error': 'interval must be >= 1, images 1..9999'})
+        return
+      self.queue('settings', values)
+    else:
+      self.sendJson(404, {'error': 'not found'})
+
+  def queue(self, action, *args):
+    if self.server.api.submit(action, *args):
+      self.sendJson(202, {'queued': action})
+    else:
+      self.sendJson(503, {'error': 'busy, try again'})
+
+  def sendLatest(self, body=True):
+    data, etag, modified, name = self.server.api.latest.get()
+    if data is None:
+      self.sendJson(404, {'error': 'no picture taken yet'})
+      return
+    match = self.headers.get('If-None-Match')
+    if match and (match.strip() == '*' or etag in [m.strip() for m in match.split(',')]):
+      self.send_response(304)
+      self.send_header('ETag', etag)
+      self.end_headers()
+      return
+    self.send_response(200)
+    self.send_header('Content-Type', 'image/jpeg')
+    self.send_header('Content-Length', str(len(data)))
+    self.send_header('ETag', etag)
+    self.send_header('Last-Modified', email.utils.formatdate(modified, usegmt=True))
+    self.send_header('Cache-Control', 'no-cache')
+    self.end_headers()
+    if body:
+      self.wfile.write(data)
+
+  def sendJson(self, code, d):
+    content = json.dumps(d, sort_keys=True).encode('utf-8')
+    self.send_response(code)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(content)))
+    self.end_headers()
+    self.wfile.write(content)
+
+  def log_message(self, format, *args):
+    logger.debug('api ' + str(self.client_address[0]) + ' ' + (format % args))
@@ -0,0 +1,261 @@
+#    Copyright 2014 Helios Taraba
+#
+#    This file provides the incremental timelapse video writer
+#
+#    avi.py is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    avi.py is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with avi.py.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Motion jpeg AVI files built while the timelapse runs. The pictures are
+jpegs already, every frame is appended as it is, without decoding or
+encoding.
+
+After every frame the index (idx1) is written behind the new frame and the
+sizes and frame counts in the header are updated, so the file on the card
+is a complete, playable video after every frame. A file cut short by a
+power failure while a frame was written is fixed with
+
+  python avi.py repair TIMELAPSE_20141208_101500.avi
+
+which keeps every complete frame and rebuilds the index. AVI 1.0 files are
+limited to 1 GB, a timelapse that grows beyond that or changes picture size
+continues in a new file (..._2.avi, ..._3.avi, ...).
+"""
+from __future__ import print_function
+
+import argparse
+import logging
+import os
+import struct
+import sys
+import threading
+
+logger     = logging.getLogger('WEBCAM.avi')
+MAX_BYTES  = 1000 * 1000 * 1000 # AVI 1.0 files, some players stop at 1 GB
+AVIF_HASINDEX   = 0x10
+AVIIF_KEYFRAME  = 0x10
+# offsets of the fields updated after every frame, see AviWriter.header
+RIFF_SIZE       = 4
+AVIH_MAX_BPS    = 36
+AVIH_FRAMES     = 48
+AVIH_BUFFER     = 60
+STRH_LENGTH     = 140
+STRH_BUFFER     = 144
+MOVI_SIZE       = 216
+MOVI_START      = 220  # 'movi', index offsets are relative to it
+FRAMES_START    = 224
+#------------------------------------------------------------------------------#
+# jpegSize: (width, height) from the start of frame marker of a jpeg           #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def jpegSize(data):
+  i = 2
+  while i + 9 <= len(data):
+    marker, length = struct.unpack('>xBH', data[i:i + 4])
+    if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+      h, w = struct.unpack('>HH', data[i + 5:i + 9])
+      return w, h
+    i += 2 + length
+  raise ValueError('no jpeg frame size found')
+#------------------------------------------------------------------------------#
+# AviWriter: motion jpeg AVI that is valid after every frame                   #
+#                                                                              #
+# Parameters: filename file to write, an existing file is replaced            #
+#             size     (width, height) of the frames                           #
+#             fps      frame rate of the video                                 #
+#             sync     fsync after every frame                                 #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class AviWriter(object):
+  def __init__(self, filename, size, fps=25, sync=True):
+    self.filename = filename
+    self.size     = size
+    self.fps      = fps
+    self.sync     = sync
+    self.frames   = 0
+    self.largest  = 0
+    self.index    = bytearray() # idx1 entries, 16 bytes per frame
+    self.moviEnd  = FRAMES_START
+    self.file     = open(filename, 'w+b')
+    self.file.write(self.header())
+    self.writeIndex()
+
+  def header(self):
+    w, h = self.size
+    avih = struct.pack('<14I', 1000000 // self.fps, 0, 0, AVIF_HASINDEX, 0, 0, 1, 0, w, h, 0, 0, 0, 0)
+    strh = struct.pack('<4s4sIHHIIIIIIiI4h', b'vids', b'MJPG', 0, 0, 0, 0, 1, self.fps, 0, 0, 0, -1, 0, 0, 0, w, h)
+    strf = struct.pack('<IiiHH4sIiiII', 40, w, h, 1, 24, b'MJPG', w * h * 3, 0, 0, 0, 0)
+    strl = b'strl' + b'strh' + struct.pack('<I', len(strh)) + strh + b'strf' + struct.pack('<I', len(strf)) + strf
+    hdrl = b'hdrl' + b'avih' + struct.pack('<I', len(avih)) + avih + b'LIST' + struct.pack('<I', len(strl)) + strl
+    return (b'RIFF' + struct.pack('<I', 0) + b'AVI ' + b'LIST' + struct.pack('<I', len(hdrl)) + hdrl +
+            b'LIST' + struct.pack('<I', 4) + b'movi')
+
+  def fits(self, data, size):
+    """True when a frame of size with data still goes into this file."""
+    return size == self.size and self.moviEnd + len(self.index) + len(data) + 64 < MAX_BYTES
+
+  def add(self, data):
+    """Append a jpeg frame and bring index and header up to date."""
+    f = self.file
+    f.seek(self.moviEnd)
+    f.write(b'00dc' + struct.pack('<I', len(data)))
+    f.write(data)
+    if len(data) % 2:
+      f.write(b'\0') # chunks are word aligned
+    self.index += struct.pack('<4sIII', b'00dc', AVIIF_KEYFRAME, self.moviEnd - MOVI_START, len(data))
+    self.moviEnd = f.tell()
+    self.frames += 1
+    self.largest = max(self.largest, len(data))
+    self.writeIndex()
+
+  def writeIndex(self):
+    f = self.file
+    # index first, then the header pointing to it, a frame written only
+    # halfway leaves the header describing the previous frames
+    f.seek(self.moviEnd)
+    f.write(b'idx1' + struct.pack('<I', len(self.index)))
+    f.write(self.index)
+    end = f.tell()
+    f.truncate()
+    self.flush()
+    for offset, value in ((RIFF_SIZE,    end - 8),
+                          (AVIH_MAX_BPS, self.largest * self.fps),
+                          (AVIH_FRAMES,  self.frames),
+                          (AVIH_BUFFER,  self.largest),
+                          (STRH_LENGTH,  self.frames),
+                          (STRH_BUFFER,  self.largest),
+                          (MOVI_SIZE,    self.moviEnd - MOVI_SIZE - 4)):
+      f.seek(offset)
+      f.write(struct.pack('<I', value))
+    self.flush()
+
+  def flush(self):
+    self.file.flush()
+    if self.sync:
+      os.fsync(self.file.fileno())
+
+  def close(self):
+    self.file.close()
+#------------------------------------------------------------------------------#
+# repair: keep the complete frames of an AVI written by AviWriter and rebuild  #
+#         its index and header, returns the number of frames                   #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def repair(filename):
+  with open(filename, 'r+b') as f:
+    f.seek(0, 2)
+    length = f.tell()
+    f.seek(0)
+    head = f.read(FRAMES_START)
+    if head[0:4] != b'RIFF' or head[MOVI_START:MOVI_START + 4] != b'movi':
+      raise ValueError(filename + ' is not an AVI written by avi.py')
+    fps      = struct.unpack('<I', head[132:136])[0] # strh dwRate
+    frames   = []
+    position = FRAMES_START
+    while position + 8 <= length:
+      f.seek(position)
+      fourcc, size = struct.unpack('<4sI', f.read(8))
+      if fourcc != b'00dc' or position + 8 + size > length:
+        break
+      data = f.read(size)
+      if data[:2] != b'\xff\xd8' or data.rstrip(b'\0')[-2:] != b'\xff\xd9':
+        break # frame only partly written
+      frames.append((position, size))
+      position += 8 + size + size % 2
+  # rewrite the file in place: header and frames stay where they are
+  w = AviWriter.__new__(AviWriter)
+  w.filename, w.fps, w.sync = filename, fps, True
+  w.file    = open(filename, 'r+b')
+  w.frames  = len(frames)
+  w.largest = max([s for p, s in frames] or [0])
+  w.index   = bytearray()
+  for p, s in frames:
+    w.index += struct.pack('<4sIII', b'00dc', AVIIF_KEYFRAME, p - MOVI_START, s)
+  w.moviEnd = position
+  w.writeIndex()
+  w.close()
+  return len(frames)
+#------------------------------------------------------------------------------#
+# VideoBackend: storage backend appending every picture it is handed to the    #
+#               timelapse video, use with a single worker so frames stay in    #
+#               order                                                          #
+#                                                                              #
+# Parameters: base  file name without .avi                                    #
+#             fps   frame rate of the video                                    #
+#             sync  fsync after every frame                                    #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class VideoBackend(object):
+  metered = False
+
+  def __init__(self, base, fps=25, sync=True):
+    self.base   = base
+    self.fps    = fps
+    self.sync   = sync
+    self.writer = None
+    self.parts  = 0
+    self.lock   = threading.Lock()
+
+  def put(self, remote, data):
+    size = jpegSize(data)
+    with self.lock:
+      if self.writer is None or not self.writer.fits(data, size):
+        if self.writer:
+          self.writer.close()
+        self.parts += 1
+        name = self.base + ('' if self.parts == 1 else '_' + str(self.parts)) + '.avi'
+        self.writer = AviWriter(name, size, self.fps, self.sync)
+        logger.info('timelapse video ' + name + ' ' + str(size[0]) + 'x' + str(size[1]))
+      self.writer.add(data)
+
+  def close(self):
+    with self.lock:
+      if self.writer:
+        self.writer.close()
+        self.writer = None
+#------------------------------------------------------------------------------#
+# main: repair or describe AVI files from the command line                     #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='timelapse AVI files written by cam.py')
+  parser.add_argument('command', choices=['repair', 'info'])
+  parser.add_argument('files', nargs='+')
+  args = parser.parse_args(argv)
+  for filename in args.files:
+    if args.command == 'repair':
+      print('%s: %d frames' % (filename, repair(filename)))
+    else:
+      with open(filename, 'rb') as f:
+        head = f.read(FRAMES_START)
+      w, h   = struct.unpack('<II', head[64:72])
+      frames = struct.unpack('<I', head[AVIH_FRAMES:AVIH_FRAMES + 4])[0]
+      fps    = struct.unpack('<I', head[132:136])[0]
+      print('%s: %dx%d, %d frames at %d fps' % (filename, w, h, frames, fps))
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,598 @@
+#    Copyright 2014 Helios Taraba
+#
+#    This file provides a micro benchmark suite for the helpers in cam.py
+#
+#    bench.py is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    bench.py is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with bench.py.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Micro benchmarks for the functions cam.py hits constantly: imgRange,
+showNextImage, Button hit-testing and icon lookups, the viewfinder
+buffer to surface conversion with and without the histogram overlay,
+motion detection, playback decode (single
+pictures and sequence playback), grid screen thumbnails, the settings
+pickle, a tracing span and raw development. On the Pi, --camera adds the
+shutter lag of a still per size mode, with and without warm capture, and
+viewfinder frames from the camera with and without the histogram.
+
+The definitions are taken straight from cam.py (everything declared before
+its initialization section) so the benchmark always measures the code that
+ships, without opening the camera or the framebuffer. Run it from the src
+folder with the same interpreter used for cam.py:
+
+  python bench.py --output before.json
+  python bench.py --compare before.json
+
+Results are written as JSON with sorted keys, timings are per call in
+microseconds. Cases that need pygame are skipped when it is not installed.
+"""
+from __future__ import print_function
+
+import ast
+import copy
+import datetime as dt
+import errno
+import fnmatch
+import gc
+import io
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import traceback
+
+try:
+  import cPickle as pickle
+except ImportError:
+  import pickle
+
+try:
+  import pygame
+except ImportError:
+  pygame = None
+
+import histogram
+import memory
+import motion
+import playback
+import raw
+import thumbs
+import tracing
+
+CAM_SOURCE = 'cam.py'
+INIT_MARKER= '# Initialization ----'
+DATASETS   = [ # name, number of files, index stride
+  ('dense-100'   ,   100,   1),
+  ('dense-1000'  ,  1000,   1),
+  ('dense-10000' , 10000,   1),
+  ('sparse-100'  ,   100, 100),
+  ('sparse-1000' ,  1000,  10)]
+#------------------------------------------------------------------------------#
+# CameraSettings: receives the attributes cam.py sets on the camera (effect,   #
+#                 iso, resolution...) so settings related helpers can run      #
+#                 without the camera module being opened.                      #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class CameraSettings(object):
+  pass
+#------------------------------------------------------------------------------#
+# load_cam: compile the class, function and global definitions of cam.py      #
+#           found before its initialization section into a namespace.         #
+#                                                                              #
+# Parameters: path  location of cam.py                                         #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def load_cam(path=CAM_SOURCE):
+  with open(path) as f:
+    source = f.read()
+  end  = source[:source.index(INIT_MARKER)].count('\n') + 1
+  tree = ast.parse(source, path)
+  body = []
+  for node in tree.body:
+    if node.lineno >= end:
+      break
+    if isinstance(node, (ast.ClassDef, ast.FunctionDef)):
+      body.append(node)
+    elif isinstance(node, ast.Assign):
+      #skip assignments which talk to other modules (logger etc.)
+      if isinstance(node.value, ast.Call) and isinstance(node.value.func, ast.Attribute):
+        continue
+      body.append(node)
+  module      = ast.parse('')
+  module.body = body
+  logger      = logging.getLogger('BENCH')
+  logger.addHandler(logging.NullHandler())
+  namespace = { '__name__': 'cam', 'os': os, 'io': io, 'stat': stat,
+                'errno': errno, 'fnmatch': fnmatch, 'logging': logging,
+                'traceback': traceback, 'threading': threading,
+                'time': time, 'dt': dt, 'pickle': pickle, 'pygame': pygame,
+                'logger': logger, 'camera': CameraSettings(), 'tracing': tracing,
+                'playback': playback }
+  exec(compile(module, path, 'exec'), namespace)
+  return namespace
+#------------------------------------------------------------------------------#
+# measure: time a callable and return per call statistics in microseconds     #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def measure(func, number, repeat):
+  timings = []
+  gcEnabled = gc.isenabled()
+  gc.disable()
+  try:
+    for r in range(repeat):
+      start = timeit.default_timer()
+      for n in range(number):
+        func()
+      timings.append((timeit.default_timer() - start) * 1e6 / number)
+  finally:
+    if gcEnabled:
+      gc.enable()
+  timings.sort()
+  return { 'number'   : number,
+           'repeat'   : repeat,
+           'min_us'   : round(timings[0], 3),
+           'median_us': round(timings[len(timings) // 2], 3),
+           'max_us'   : round(timings[-1], 3) }
+#------------------------------------------------------------------------------#
+# make_jpeg: write a synthetic JPEG of the given size. Content is a smoothly   #
+#            scaled random tile, seeded so every run encodes the same image.   #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def make_jpeg(filename, size, seed=0):
+  rnd  = random.Random(seed)
+  tile = bytearray(rnd.randint(0, 255) for i in range(32 * 24 * 3))
+  img  = pygame.image.frombuffer(bytes(tile), (32, 24), 'RGB')
+  pygame.image.save(pygame.transform.smoothscale(img, size), filename)
+#------------------------------------------------------------------------------#
+# make_dataset: populate a folder with IMG_XXXX.JPG files. All files are hard  #
+#               links (or copies) of one template, names follow cam.py.        #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def make_dataset(path, count, stride, template):
+  os.makedirs(path)
+  for i in range(count):
+    filename = os.path.join(path, 'IMG_' + '%04d' % ((i * stride) % 10000) + '.JPG')
+    if template is None:
+      open(filename, 'wb').close()
+      continue
+    try:
+      os.link(template, filename)
+    except (OSError, AttributeError):
+      shutil.copyfile(template, filename)
+#------------------------------------------------------------------------------#
+# Suite: builds the synthetic data sets and runs the individual cases         #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class Suite(object):
+  def __init__(self, cam, workdir, scale=1, only=None, camera=False):
+    self.cam     = cam
+    self.workdir = workdir
+    self.scale   = scale
+    self.only    = only
+    self.camera  = camera
+    self.results = {}
+    self.skipped = []
+
+  def wanted(self, name):
+    return self.only is None or any(o in name for o in self.only)
+
+  def run(self, name, func, number, repeat=5, per=1):
+    if not self.wanted(name):
+      return
+    number = max(1, int(number * self.scale))
+    self.results[name] = measure(func, number, repeat)
+    for k in ('min_us', 'median_us', 'max_us'): # per item when a call does several
+      self.results[name][k] = round(self.results[name][k] / per, 3)
+    print('%-40s %12.1f us' % (name, self.results[name]['median_us']), file=sys.stderr)
+
+  def skip(self, name, reason):
+    if self.wanted(name):
+      self.skipped.append(name + ': ' + reason)
+
+  def setup(self):
+    cam = self.cam
+    self.template = None
+    if pygame is not None:
+      os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+      pygame.init()
+      cam['screen'] = pygame.display.set_mode((320, 240))
+      self.jpegs = []
+      for i, s in enumerate(cam['sizeData']):
+        filename = os.path.join(self.workdir, 'size-%d.jpg' % i)
+        make_jpeg(filename, s[0], seed=i)
+        self.jpegs.append(filename)
+      self.template = self.jpegs[0]
+    for f in os.listdir(cam['iconPath']):
+      if fnmatch.fnmatch(f, '*.png'):
+        cam['icons'].append(cam['Icon'](f.split('.')[0]))
+    for s in cam['buttons']:
+      for b in s:
+        b.setBg(b.bg)
+        b.setFg(b.fg)
+    self.datasets = {}
+    for name, count, stride in DATASETS:
+      path = os.path.join(self.workdir, name)
+      make_dataset(path, count, stride, self.template)
+      self.datasets[name] = path
+
+  def bench_imgRange(self):
+    for name, count, stride in DATASETS:
+      path = self.datasets[name]
+      self.run('imgRange/' + name, lambda: self.cam['imgRange'](path), 2000 // (count // 100 + 1) + 1)
+
+  def bench_showNextImage(self):
+    cam = self.cam
+    for name, count, stride in DATASETS:
+      case = 'showNextImage/' + name
+      if pygame is None:
+        self.skip(case, 'pygame not installed')
+        continue
+      cam['pathData'][cam['storeMode']] = self.datasets[name]
+      cam['loadIdx'] = 0
+      self.run(case, lambda: cam['showNextImage'](1), 3, repeat=3)
+
+  def bench_selected(self):
+    # hit-test a grid of taps the way the main loop does, callbacks replaced
+    # by a no-op (passive buttons keep None so taps fall through as in cam.py)
+    taps = [(x, y) for x in range(0, 320, 8) for y in range(0, 240, 8)]
+    noop = lambda *args: None
+    for i, s in enumerate(self.cam['buttons']):
+      screen = []
+      for b in s:
+        b = copy.copy(b)
+        if b.callback: b.callback = noop
+        screen.append(b)
+      def sweep(screen=screen):
+        for pos in taps:
+          for b in screen:
+            if b.selected(pos): break
+      self.run('Button.selected/screen-%02d' % i, sweep, 20)
+
+  def bench_setIcon(self):
+    icons  = self.cam['icons']
+    button = self.cam['Button']((0, 0, 320, 240))
+    names  = { 'first'  : icons[0].name,
+               'middle' : icons[len(icons) // 2].name,
+               'last'   : icons[-1].name,
+               'missing': 'no-such-icon' }
+    for key in sorted(names):
+      n = names[key]
+      self.run('Button.setBg/' + key, lambda: button.setBg(n), 20000)
+      self.run('Button.setFg/' + key, lambda: button.setFg(n), 20000)
+
+  def bench_viewfinder(self):
+    # same statements as the viewfinder branch of the main loop
+    rgb = bytearray(320 * 240 * 3)
+    for i, s in enumerate(self.cam['sizeData']):
+      case = 'viewfinder/size-%d' % i
+      if pygame is None:
+        self.skip(case, 'pygame not installed')
+        continue
+      frame  = os.urandom(s[1][0] * s[1][1] * 3)
+      output = memory.FrameBuffer(rgb)
+      def convert(frame=frame, size=s[1]):
+        output.rewind()
+        output.write(frame) # as the camera does during capture
+        return pygame.image.frombuffer(rgb[0:(size[0] * size[1] * 3)], size, 'RGB')
+      self.run(case, convert, 200)
+
+  def bench_histogram(self):
+    # one recompute of the overlay, and a viewfinder frame drawn as the main
+    # loop does it, without (off) and with the overlay recomputed every 5th
+    # frame
+    for i, s in enumerate(self.cam['sizeData']):
+      cases = ['viewfinder+histogram/off/size-%d' % i]
+      for mode in histogram.MODES:
+        cases += ['histogram.render/%s/size-%d' % (mode, i), 'viewfinder+histogram/%s/size-%d' % (mode, i)]
+      if pygame is None or histogram.numpy is None:
+        for case in cases:
+          self.skip(case, 'pygame or numpy not installed')
+        continue
+      rgb    = bytearray(os.urandom(s[1][0] * s[1][1] * 3))
+      screen = self.cam['screen']
+      def frame(overlay=None, rgb=rgb, size=s[1]):
+        img = pygame.image.frombuffer(rgb[0:(size[0] * size[1] * 3)], size, 'RGB')
+        if overlay: overlay.update(rgb, size)
+        screen.blit(img, (0, 0))
+        if overlay: overlay.draw(screen, (188, 4))
+      self.run(cases[0], frame, 500)
+      for mode in histogram.MODES:
+        overlay = histogram.HistogramOverlay(mode, every=5)
+        def render(overlay=overlay, rgb=rgb, size=s[1]):
+          overlay.render(*histogram.histograms(rgb, size, overlay.mode, overlay.step))
+        self.run('histogram.render/%s/size-%d' % (mode, i), render, 100)
+        self.run('viewfinder+histogram/%s/size-%d' % (mode, i), lambda overlay=overlay: frame(overlay), 500)
+    self.bench_histogramCamera()
+
+  def bench_histogramCamera(self):
+    # whole viewfinder frames as the main loop takes them, captured from the
+    # camera and put on the display, without and with the overlay: the frame
+    # rate the viewfinder reaches is 1e6 / median_us
+    cam   = self.cam
+    modes = ('off',) + histogram.MODES
+    cases = ['viewfinder-camera/%s/size-%d' % (m, i) for m in modes for i in range(len(cam['sizeData']))]
+    if not self.camera:
+      for case in cases:
+        self.skip(case, 'needs --camera')
+      return
+    if pygame is None or histogram.numpy is None:
+      for case in cases:
+        self.skip(case, 'pygame or numpy not installed')
+      return
+    import picamera
+    camera = picamera.PiCamera()
+    screen = cam['screen']
+    try:
+      for i, s in enumerate(cam['sizeData']):
+        size   = s[1]
+        rgb    = bytearray(320 * 240 * 3)
+        buf    = memory.FrameBuffer(rgb)
+        camera.resolution = size
+        time.sleep(2) # let exposure settle
+        for mode in modes:
+          overlay = None if mode == 'off' else histogram.HistogramOverlay(mode, every=5)
+          def frame(overlay=overlay, buf=buf, rgb=rgb, size=size):
+            buf.rewind()
+            camera.capture(buf, use_video_port=True, format='rgb')
+            img = pygame.image.frombuffer(rgb[0:(size[0] * size[1] * 3)], size, 'RGB')
+            if overlay: overlay.update(rgb, size)
+            screen.blit(img, (0, 0))
+            if overlay: overlay.draw(screen, (188, 4))
+            pygame.display.update()
+          self.run('viewfinder-camera/%s/size-%d' % (mode, i), frame, 30, repeat=3)
+    finally:
+      camera.close()
+
+  def bench_motion(self):
+    for i, s in enumerate(self.cam['sizeData']):
+      case = 'motion/size-%d' % i
+      if motion.numpy is None:
+        self.skip(case, 'numpy not installed')
+        continue
+      frames   = [bytearray(os.urandom(s[1][0] * s[1][1] * 3)) for n in range(2)]
+      detector = motion.MotionDetector(cooldown=0)
+      def detect(frames=frames, size=s[1]):
+        frames.reverse()
+        detector.update(frames[0], size)
+      self.run(case, detect, 500)
+
+  def bench_decode(self):
+    for i, s in enumerate(self.cam['sizeData']):
+      case = 'decode+scale/size-%d' % i
+      if pygame is None:
+        self.skip(case, 'pygame not installed')
+        continue
+      filename = self.jpegs[i]
+      def decode(filename=filename, size=s[1]):
+        return pygame.transform.scale(pygame.image.load(filename), size)
+      self.run(case, decode, 3)
+
+  def bench_playback(self):
+    # decoding one frame of sequence playback, draft mode with PIL
+    for i, s in enumerate(self.cam['sizeData']):
+      case = 'playback.loadScaled/size-%d' % i
+      if pygame is None:
+        self.skip(case, 'pygame not installed')
+        continue
+      filename = self.jpegs[i]
+      self.run(case, lambda filename=filename, size=s[1]: playback.loadScaled(filename, size), 3)
+
+  def bench_thumbs(self):
+    # one 4x4 page of the grid screen, thumbnails read from disk and from memory
+    for case in ('ThumbnailStore.page/disk', 'ThumbnailStore.page/memory'):
+      if pygame is None:
+        self.skip(case, 'pygame not installed')
+    if pygame is None:
+      return
+    store = thumbs.ThumbnailStore(self.datasets['dense-1000'])
+    page  = playback.sequence(store.path)[:16]
+    for f in page:
+      store.make(f, store.lookup(f)[0])
+    def disk():
+      store.cache.clear()
+      for f in page:
+        store.get(f)
+    def memory():
+      for f in page:
+        store.get(f)
+    self.run('ThumbnailStore.page/disk', disk, 20)
+    self.run('ThumbnailStore.page/memory', memory, 200)
+    store.stop()
+
+  def bench_shutter(self):
+    # a still through captureStill as takePicture does it, classic switches
+    # resolution and crop around every capture, warm keeps them
+    cam   = self.cam
+    cases = ['shutter/%s/size-%d' % (m, i) for m in ('classic', 'warm') for i in range(len(cam['sizeData']))]
+    if not self.camera:
+      for case in cases:
+        self.skip(case, 'needs --camera')
+      return
+    import picamera
+    camera = picamera.PiCamera()
+    saved  = cam['camera'], cam['sizeMode'], cam['warmCapture']
+    cam['camera'] = camera
+    try:
+      for warm in (False, True):
+        cam['warmCapture'] = warm
+        if warm: camera.framerate = 15
+        for i in range(len(cam['sizeData'])):
+          cam['sizeMode'] = i
+          cam['configureCamera']()
+          time.sleep(2) # let exposure settle, the first still is not typical
+          self.run('shutter/%s/size-%d' % ('warm' if warm else 'classic', i),
+                   lambda: cam['captureStill'](io.BytesIO()), 3, repeat=3)
+    finally:
+      camera.close()
+      cam['camera'], cam['sizeMode'], cam['warmCapture'] = saved
+
+  def bench_raw(self):
+    # development of a synthetic OV5647 raw picture cropped to every size
+    # mode, in this process, and through the worker pool per picture with
+    # all workers busy (throughput)
+    cam   = self.cam
+    cases = ['raw.%s/%s/size-%d' % (k, f, i) for k in ('develop', 'pool') for f in raw.FORMATS
+             for i in range(len(cam['sizeData']))]
+    if not any(self.wanted(c) for c in cases):
+      return
+    if raw.numpy is None:
+      for case in cases:
+        self.skip(case, 'numpy not installed')
+      return
+    numpy = raw.numpy
+    h, w  = 1944, 2592
+    yy, xx = numpy.mgrid[0:h, 0:w]
+    block  = raw.pack(((yy * 7 + xx * 3) % 900 + 64).astype(numpy.uint16))
+    for form in raw.FORMATS:
+      developer = raw.RawDeveloper(form=form, maxQueued=1000, nice=0)
+      frames    = 2 * developer.workers
+      try:
+        for i, s in enumerate(cam['sizeData']):
+          target = os.path.join(self.workdir, 'raw-%d' % i + developer.extension())
+          job    = (block, None, target, form, s[2], (1.5, 1.2), 90)
+          self.run('raw.develop/%s/size-%d' % (form, i), lambda job=job: raw.develop(job), 3, repeat=3)
+          def batch(target=target, window=s[2]):
+            for n in range(frames):
+              developer.submit(block, target + str(n), window, (1.5, 1.2))
+            developer.wait()
+          self.run('raw.pool/%s/size-%d' % (form, i), batch, 1, repeat=3, per=frames)
+      finally:
+        developer.close()
+
+  def bench_settings(self):
+    cam = self.cam
+    cwd = os.getcwd()
+    os.chdir(self.workdir)
+    try:
+      cam['saveSettings']()
+      self.run('saveSettings', cam['saveSettings'], 200)
+      self.run('loadSettings', cam['loadSettings'], 200)
+    finally:
+      os.chdir(cwd)
+
+  def bench_tracing(self):
+    # cost of a traced block while tracing is off and on, the ring is a new
+    # one per case so a full ring (overwriting) is measured as well
+    def block():
+      with tracing.span('bench', 'bench', n=1):
+        pass
+    self.run('tracing.span/off', block, 20000)
+    tracing.enable(1000)
+    try:
+      self.run('tracing.span/on', block, 20000)
+      self.run('tracing.chromeTrace/1000', tracing.chromeTrace, 20)
+    finally:
+      tracing.disable()
+
+  def all(self):
+    self.setup()
+    self.bench_imgRange()
+    self.bench_showNextImage()
+    self.bench_selected()
+    self.bench_setIcon()
+    self.bench_viewfinder()
+    self.bench_histogram()
+    self.bench_motion()
+    self.bench_decode()
+    self.bench_playback()
+    self.bench_thumbs()
+    self.bench_shutter()
+    self.bench_raw()
+    self.bench_settings()
+    self.bench_tracing()
+#------------------------------------------------------------------------------#
+# compare: print the ratio of current against earlier results, returns the     #
+#          names of the cases which got slower than the allowed tolerance      #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def compare(baseline, current, tolerance):
+  regressions = []
+  for name in sorted(current):
+    if name not in baseline:
+      continue
+    before = baseline[name]['median_us']
+    after  = current[name]['median_us']
+    ratio  = after / before if before else 1.0
+    flag   = ''
+    if ratio > 1.0 + tolerance:
+      flag = '  REGRESSION'
+      regressions.append(name)
+    print('%-40s %12.1f -> %12.1f us  x%.2f%s' % (name, before, after, ratio, flag))
+  return regressions
+
+def main(argv=None):
+  import argparse
+  parser = argparse.ArgumentParser(description='cam.py micro benchmarks')
+  parser.add_argument('--output',   help='write JSON results to this file (default stdout)')
+  parser.add_argument('--compare',  help='JSON results of an earlier run to compare against')
+  parser.add_argument('--tolerance',type=float, default=0.15, help='allowed slow down before a case counts as regression (default 0.15)')
+  parser.add_argument('--scale',    type=float, default=1.0, help='multiply the number of calls per case')
+  parser.add_argument('--only',     action='append', help='run only cases containing this text, may be repeated')
+  parser.add_argument('--camera',   action='store_true', help='also time stills (shutter lag) and viewfinder frames with the camera, Pi only')
+  args = parser.parse_args(argv)
+
+  cam     = load_cam()
+  workdir = tempfile.mkdtemp(prefix='cambench-')
+  suite   = Suite(cam, workdir, args.scale, args.only, args.camera)
+  try:
+    suite.all()
+  finally:
+    shutil.rmtree(workdir, ignore_errors=True)
+
+  report = { 'meta'   : { 'python'  : platform.python_version(),
+                          'machine' : platform.machine(),
+                          'pygame'  : getattr(pygame, 'ver', None) },
+             'results': suite.results,
+             'skipped': sorted(suite.skipped) }
+  text = json.dumps(report, indent=2, sort_keys=True)
+  if args.output:
+    with open(args.output, 'w') as f:
+      f.write(text + '\n')
+  else:
+    print(text)
+
+  if args.compare:
+    with open(args.compare) as f:
+      baseline = json.load(f)['results']
+    if compare(baseline, suite.results, args.tolerance):
+      return 1
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
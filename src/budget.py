@@ -0,0 +1,266 @@
+#    Copyright 2014 Helios Taraba
+#
+#    This file provides the upload byte budget
+#
+#    budget.py is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    budget.py is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with budget.py.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Upload byte budget for metered connections. Every upload gets at most
+target bytes, all uploads of one day together at most daily bytes.
+
+Jpeg size is estimated as pixels * bytes per pixel, where bytes per pixel
+follows a simple curve over the quality multiplied by a scene complexity
+factor learned from every encode. The estimate picks the resolution and a
+starting quality, a short binary search over the quality on the real image
+then converges on the target (needs PIL, without it pygame encodes at its
+fixed quality and only the resolution is adapted).
+
+Once less than reserve of the daily budget is left the per upload target
+shrinks with the remaining budget, lower quality first, then smaller
+pictures, finally uploads are skipped until the next day.
+"""
+import datetime as dt
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+try:
+  from PIL import Image
+except ImportError:
+  Image = None
+try:
+  import pygame
+except ImportError:
+  pygame = None
+
+logger = logging.getLogger('WEBCAM.budget')
+SCALES = [1.0, 0.75, 0.5, 0.35, 0.25] # resolutions tried, largest first
+#------------------------------------------------------------------------------#
+# encodeJpeg: encode a pygame surface as jpeg, returns the bytes               #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def encodeJpeg(surface, quality):
+  if Image is not None:
+    img = Image.frombytes('RGB', surface.get_size(), pygame.image.tostring(surface, 'RGB'))
+    out = io.BytesIO()
+    img.save(out, 'JPEG', quality=int(quality))
+    return out.getvalue()
+  # pygame only writes files and has no quality setting
+  fd, name = tempfile.mkstemp(suffix='.jpg')
+  os.close(fd)
+  try:
+    pygame.image.save(surface, name)
+    with open(name, 'rb') as f:
+      return f.read()
+  finally:
+    os.remove(name)
+#------------------------------------------------------------------------------#
+# jpegSize: (w, h) of a jpeg, from its header with PIL                         #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def jpegSize(data):
+  if Image is not None:
+    return Image.open(io.BytesIO(data)).size
+  return pygame.image.load(io.BytesIO(data), 'upload.jpg').get_size()
+#------------------------------------------------------------------------------#
+# UploadBudget: picks jpeg quality and resolution per upload and keeps track   #
+#               of the bytes uploaded per day                                  #
+#                                                                              #
+# Parameters: target     bytes per upload                                      #
+#             daily      bytes per day, 0 for no daily limit                   #
+#             minQuality lowest jpeg quality before reducing resolution        #
+#             maxQuality highest jpeg quality used                             #
+#             reserve    fraction of the daily budget at which uploads start   #
+#                        to shrink                                             #
+#             stateFile  json file keeping the counters across restarts        #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class UploadBudget(object):
+  def __init__(self, target=50000, daily=0, minQuality=20, maxQuality=90, reserve=0.2, stateFile='budget.json'):
+    self.target     = target
+    self.daily      = daily
+    self.minQuality = minQuality
+    self.maxQuality = maxQuality
+    self.reserve    = reserve
+    self.stateFile  = stateFile
+    self.lock       = threading.Lock()
+    self.complexity = 1.0   # learned factor on the bytes per pixel curve
+    self.day        = None
+    self.sent       = 0     # bytes uploaded today
+    self.uploads    = 0     # uploads today
+    self.skipped    = 0     # uploads skipped today
+    self.total      = 0     # bytes uploaded since the state file was created
+    self.load()
+
+  @staticmethod
+  def bytesPerPixel(quality):
+    # rough curve for photographs, scaled by the learned complexity
+    return 0.02 + 0.002 * quality
+
+  def estimate(self, pixels, quality):
+    return pixels * self.bytesPerPixel(quality) * self.complexity
+
+  def learn(self, pixels, quality, nbytes):
+    ratio = nbytes / max(1.0, pixels * self.bytesPerPixel(quality))
+    self.complexity += 0.3 * (ratio - self.complexity)
+
+  def rollover(self):
+    today = dt.date.today().isoformat()
+    if today != self.day:
+      self.day     = today
+      self.sent    = 0
+      self.uploads = 0
+      self.skipped = 0
+
+  def allowance(self):
+    """Bytes the next upload may use, 0 means skip."""
+    with self.lock:
+      self.rollover()
+      if not self.daily:
+        return self.target
+      remaining = self.daily - self.sent
+      if remaining <= 0:
+        return 0
+      low = self.reserve * self.daily
+      if remaining >= low:
+        return min(self.target, remaining)
+      # running out: shrink uploads with the remaining budget
+      return min(remaining, int(self.target * remaining / low))
+
+  def captureQuality(self, size):
+    """Quality to hand to camera.capture for a picture of size (w,h) so it
+    fits the allowance without re-encoding, None when it cannot fit."""
+    allowance = self.allowance()
+    pixels    = size[0] * size[1]
+    for q in range(self.maxQuality, self.minQuality - 1, -5):
+      if self.estimate(pixels, q) <= allowance:
+        return q
+    return None
+
+  def prepare(self, data, surface=None, quality=None):
+    """Return the jpeg to upload: data itself when it fits, otherwise the
+    surface (the decoded picture, decoded from data here when None)
+    re-encoded to fit, data may be None. Returns None when the budget is
+    exhausted and the upload is skipped. Slow, call it from an upload
+    worker rather than the main loop."""
+    allowance = self.allowance()
+    if data is not None and quality is not None:
+      w, h = surface.get_size() if surface is not None else jpegSize(data)
+      self.learn(w * h, quality, len(data))
+    if allowance <= 0:
+      self.skip()
+      return None
+    if data is not None and len(data) <= allowance:
+      return data
+    if surface is None:
+      surface = pygame.image.load(io.BytesIO(data), 'upload.jpg')
+    w, h = surface.get_size()
+    for scale in SCALES:
+      size   = (max(1, int(w * scale)), max(1, int(h * scale)))
+      pixels = size[0] * size[1]
+      if self.estimate(pixels, self.minQuality) > allowance and scale != SCALES[-1]:
+        continue
+      scaled = surface if scale == 1.0 else pygame.transform.smoothscale(surface, size)
+      best   = self.search(scaled, pixels, allowance)
+      if best is not None:
+        return best
+    self.skip()
+    return None
+
+  def search(self, surface, pixels, allowance):
+    """Binary search for the highest quality that fits allowance."""
+    if Image is None:
+      data = encodeJpeg(surface, None)
+      return data if len(data) <= allowance else None
+    lo, hi = self.minQuality, self.maxQuality
+    best   = None
+    # start from the estimate rather than the middle, usually right first time
+    q = self.minQuality
+    for q in range(self.maxQuality, self.minQuality - 1, -1):
+      if self.estimate(pixels, q) <= allowance:
+        break
+    while lo <= hi:
+      data = encodeJpeg(surface, q)
+      self.learn(pixels, q, len(data))
+      if len(data) <= allowance:
+        best = data
+        lo   = q + 1
+      else:
+        hi   = q - 1
+      q = (lo + hi) // 2
+      if hi - lo < 3 and best is not None:
+        break
+    return best
+
+  def record(self, nbytes):
+    """Account for an upload of nbytes."""
+    with self.lock:
+      self.rollover()
+      self.sent    += nbytes
+      self.total   += nbytes
+      self.uploads += 1
+      self.save()
+
+  def skip(self):
+    with self.lock:
+      self.rollover()
+      self.skipped += 1
+      self.save()
+    logger.info('upload budget exhausted, upload skipped')
+
+  def stats(self):
+    with self.lock:
+      self.rollover()
+      return { 'day'       : self.day,
+               'sent'      : self.sent,
+               'uploads'   : self.uploads,
+               'skipped'   : self.skipped,
+               'total'     : self.total,
+               'daily'     : self.daily,
+               'target'    : self.target,
+               'complexity': round(self.complexity, 3) }
+
+  def load(self):
+    try:
+      with open(self.stateFile) as f:
+        d = json.load(f)
+      self.day        = d.get('day')
+      self.sent       = d.get('sent', 0)
+      self.uploads    = d.get('uploads', 0)
+      self.skipped    = d.get('skipped', 0)
+      self.total      = d.get('total', 0)
+      self.complexity = d.get('complexity', 1.0)
+    except (IOError, OSError, ValueError):
+      pass
+    self.rollover()
+
+  def save(self):
+    try:
+      with open(self.stateFile, 'w') as f:
+        json.dump({ 'day': self.day, 'sent': self.sent, 'uploads': self.uploads,
+                    'skipped': self.skipped, 'total': self.total,
+                    'complexity': self.complexity }, f)
+    except (IOError, OSError):
+      logger.error('cannot save upload budget', exc_info=True)
@@ -0,0 +1,163 @@
+#    Copyright 2014 Helios Taraba
+#
+#    This file provides the video port burst capture
+#
+#    burst.py is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    burst.py is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with burst.py.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+High rate timelapse (burst) through capture_sequence on the video port.
+The camera stays at one resolution for the whole burst, there is no mode
+switch per frame as with still captures, so intervals well below a second
+are possible.
+
+capture_sequence is fed from a generator which paces the frames and hands
+every finished jpeg to a writer thread through a bounded queue. When the
+writer cannot keep up, frames are dropped instead of slowing the capture
+down. stats() reports the sustained frame rate, dropped and late frames
+and how far the writer is behind (back pressure).
+"""
+import io
+import logging
+import threading
+import time
+try:
+  import queue
+except ImportError:
+  import Queue as queue
+
+logger = logging.getLogger('WEBCAM.burst')
+#------------------------------------------------------------------------------#
+# Burst: captures count frames, one every interval seconds                     #
+#                                                                              #
+# Parameters: camera       picamera.PiCamera                                   #
+#             sink         callable(index, time, jpeg) run on the writer thread#
+#             count        frames to capture                                   #
+#             interval     seconds between frames, 0 as fast as possible       #
+#             resize       (w, h) of the frames, None for camera.resolution    #
+#             quality      jpeg quality                                        #
+#             splitterPort video port splitter output used (0 is the          #
+#                          viewfinder, 2 the mjpeg stream)                     #
+#             queueSize    frames waiting for the writer before frames drop   #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class Burst(object):
+  STOP = None # sentinel for the writer thread
+
+  def __init__(self, camera, sink, count, interval=0.0, resize=None, quality=85, splitterPort=1, queueSize=16):
+    self.camera       = camera
+    self.sink         = sink
+    self.count        = count
+    self.interval     = interval
+    self.resize       = resize
+    self.quality      = quality
+    self.splitterPort = splitterPort
+    self.queue        = queue.Queue(queueSize)
+    self.stopping     = threading.Event()
+    self.started      = None
+    self.finished     = None
+    self.last         = None  # time of the last frame captured
+    self.captured     = 0
+    self.written      = 0
+    self.dropped      = 0  # queue full, writer behind
+    self.late         = 0  # captured after their time
+    self.failed       = 0  # sink raised
+    self.bytes        = 0
+    self.maxQueued    = 0
+    self.writeTime    = 0.0
+    self.thread       = threading.Thread(target=self.run,   name='BURST')
+    self.writer       = threading.Thread(target=self.write, name='BURST_WRITER')
+    self.thread.daemon = self.writer.daemon = True
+
+  def start(self):
+    self.started = time.time()
+    self.writer.start()
+    self.thread.start()
+
+  def stop(self):
+    """Stop after the frame being captured, frames queued are written."""
+    self.stopping.set()
+
+  def running(self):
+    return self.started is not None and self.finished is None
+
+  def outputs(self):
+    for i in range(self.count):
+      delay = self.started + i * self.interval - time.time()
+      if delay > 0:
+        if self.stopping.wait(delay):
+          return
+      elif self.stopping.is_set():
+        return
+      elif i and self.interval and delay < -self.interval / 2:
+        self.late += 1
+      stream = io.BytesIO()
+      yield stream
+      # picamera wrote the frame into stream before asking for the next one
+      self.captured += 1
+      self.last      = time.time()
+      try:
+        self.queue.put_nowait((i, self.last, stream.getvalue()))
+      except queue.Full:
+        self.dropped += 1
+      self.maxQueued = max(self.maxQueued, self.queue.qsize())
+
+  def run(self):
+    try:
+      self.camera.capture_sequence(self.outputs(), format='jpeg', use_video_port=True,
+                                   resize=self.resize, splitter_port=self.splitterPort,
+                                   quality=self.quality)
+    except Exception:
+      logger.error('burst failed after ' + str(self.captured) + ' frames', exc_info=True)
+    finally:
+      self.queue.put(self.STOP)
+      self.writer.join()
+      self.finished = time.time()
+      logger.info('burst done ' + repr(self.stats()))
+
+  def write(self):
+    while True:
+      item = self.queue.get()
+      if item is self.STOP:
+        return
+      i, when, data = item
+      start = time.time()
+      try:
+        self.sink(i, when, data)
+        self.written += 1
+        self.bytes   += len(data)
+      except Exception:
+        self.failed += 1
+        logger.error('burst frame ' + str(i) + ' not written', exc_info=True)
+      self.writeTime += time.time() - start
+
+  def stats(self):
+    # sustained rate up to the last frame, not counting the writer catching up
+    end     = self.last if self.finished else time.time()
+    elapsed = max(1e-6, end - self.started) if self.started and end else 0
+    return { 'count'     : self.count,
+             'captured'  : self.captured,
+             'written'   : self.written,
+             'dropped'   : self.dropped,
+             'late'      : self.late,
+             'failed'    : self.failed,
+             'bytes'     : self.bytes,
+             'fps'       : round(self.captured / elapsed, 2) if elapsed else 0.0,
+             # back pressure: frames waiting, most ever waiting, writer speed
+             'queued'    : self.queue.qsize(),
+             'maxQueued' : self.maxQueued,
+             'writeFps'  : round(self.written / self.writeTime, 2) if self.writeTime else 0.0,
+             'running'   : self.running() }
@@ -27,7 +27,7 @@
 
 import atexit
 import cPickle as pickle
-import errno, logging, traceback
+import errno, logging
 import fnmatch
 import io
 import os
@@ -40,8 +40,27 @@ import time
 import datetime as dt
 import timers
 import sys
-import dropbox
 import configuration
+import mjpeg
+import api
+import motion
+import adaptive
+import budget
+import storage
+import playback
+import thumbs
+import avi
+import segments
+import burst
+import metering
+import stack
+import deflicker
+import idle
+import histogram
+import tracing
+import memory
+import raw
+import jobs
 from pygame.locals import *
 from subprocess import call  
 
@@ -73,7 +92,8 @@ class Icon:
 #  - optional single callback function
 #  - optional single value passed to callback
 # Occasionally Buttons are used as a convenience for positioning Icons
-# but the taps are ignored.  Stacking order is important; when Buttons
+# but the taps are ignored (they fall through to the Buttons below them,
+# e.g. the 'Working' label on the playback screen).  Stacking order is important; when Buttons
 # overlap, lowest/first Button in list takes precedence when processing
 # input, and highest/last Button is drawn atop prior Button(s).  This is
 # used, for example, to center an Icon by creating a passive Button the
@@ -106,11 +126,12 @@ class Button:
     x2 = x1 + self.rect[2] - 1
     y2 = y1 + self.rect[3] - 1
     if ((pos[0] >= x1) and (pos[0] <= x2) and (pos[1] >= y1) and (pos[1] <= y2)):
-      if self.callback:
-        if self.value is None: 
-          self.callback()
-        else:
-          self.callback(self.value)
+      if self.callback is None:
+        return False # passive button, tap falls through
+      if self.value is None: 
+        self.callback()
+      else:
+        self.callback(self.value)
       return True
     return False
       
@@ -155,8 +176,8 @@ def isoCallback(n): # Pass 1 (next ISO) or -1 (prev ISO)
 def settingCallback(n): # Pass 1 (next setting) or -1 (prev setting)
   global screenMode
   screenMode += n
-  if screenMode < 4:               screenMode = len(buttons) - 1
-  elif screenMode >= len(buttons): screenMode = 4
+  if screenMode < 4:                 screenMode = lastSettingMode
+  elif screenMode > lastSettingMode: screenMode = 4
   
 def fxCallback(n): # Pass 1 (next effect) or -1 (prev effect)
   global fxMode
@@ -190,6 +211,7 @@ def viewCallback(n): # Viewfinder buttons
       
 def doneCallback(): # Exit settings
   global screenMode, settingMode
+  if player: stopPlayback()
   if screenMode > 3:
     settingMode = screenMode
     saveSettings()
@@ -197,11 +219,72 @@ def doneCallback(): # Exit settings
     
 def imageCallback(n): # Pass 1 (next image), -1 (prev image) or 0 (delete)
   global screenMode
+  if player and n is not 0: # prev/next change the speed while playing
+    steps = playback.FPS_STEPS
+    i     = min(range(len(steps)), key=lambda i: abs(steps[i] - player.fps))
+    player.setFps(steps[min(len(steps) - 1, max(0, i + n))])
+    return
+  if player: stopPlayback() # delete the picture on screen
   if n is 0:
     screenMode = 1 # Delete confirmation
   else:
     showNextImage(n)
+
+def playCallback(): # Tap on the picture: play from here to the last picture
+  global player
+  if player:
+    stopPlayback()
+    return
+  size   = sizeData[sizeMode][1]
+  reader = None
+  if config.getboolean('SEGMENTS', 'enabled', fallback=False):
+    reader = segments.SegmentReader(pathData[storeMode] + '/segments')
+  if reader and len(reader) > 1: # timelapse frames stored in segments
+    items = range(len(reader))
+    load  = lambda i: playback.loadScaled(reader.open(i), size)
+  else:
+    items = playback.sequence(pathData[storeMode], max(0, loadIdx))
+    load  = lambda f: playback.loadScaled(f, size)
+  if len(items) < 2:
+    return
+  player = playback.SequencePlayer(items, load,
+                                   fps     = config.getint('PLAYBACK', 'fps',     fallback=10),
+                                   ahead   = config.getint('PLAYBACK', 'buffer',  fallback=8),
+                                   workers = config.getint('PLAYBACK', 'workers', fallback=2),
+                                   loop    = config.getboolean('PLAYBACK', 'loop', fallback=False))
+
+def stopPlayback(): # Stop playing, the frame on screen becomes the current picture
+  global player, loadIdx, scaled, screenModePrior
+  p, player = player, None
+  p.stop()
+  if p.current and p.current[1] is not None:
+    scaled = p.current[1]
+    if not isinstance(p.currentItem(), int): # a picture file, not a segment frame
+      loadIdx = int(os.path.basename(p.currentItem())[4:8])
+  screenModePrior = -1 # Force screen refresh
     
+def gridOpenCallback(): # Grid button on the playback screen
+  global gridItems, gridPage, screenMode
+  if player: stopPlayback()
+  gridItems = playback.sequence(pathData[storeMode])
+  current   = pathData[storeMode] + '/IMG_' + '%04d' % loadIdx + '.JPG'
+  perPage   = gridSize * gridSize
+  gridPage  = gridItems.index(current) // perPage if current in gridItems else 0
+  screenMode = 12 # Thumbnail grid
+
+def gridCallback(n): # Grid screen: -1/1 page, 0 done, 10+ thumbnail tapped
+  global gridPage, screenMode, screenModePrior
+  perPage = gridSize * gridSize
+  pages   = max(1, (len(gridItems) + perPage - 1) // perPage)
+  if n is 0:
+    screenMode = 0 # Back to playback
+  elif n < 10:
+    gridPage = (gridPage + n) % pages
+    screenModePrior = -1 # Force screen refresh
+  elif gridPage * perPage + n - 10 < len(gridItems):
+    f = gridItems[gridPage * perPage + n - 10]
+    showImage(int(os.path.basename(f)[4:8]))
+
 def deleteCallback(n): # Delete confirmation
   global loadIdx, scaled, screenMode, storeMode
   screenMode      =  0
@@ -237,8 +320,10 @@ def sizeModeCallback(n): # Radio buttons on size settings screen
   buttons[5][sizeMode + 3].setBg('radio3-0')
   sizeMode = n
   buttons[5][sizeMode + 3].setBg('radio3-1')
-  camera.resolution = sizeData[sizeMode][1]
-  #  camera.crop       = sizeData[sizeMode][2]
+  if burstCapture: return # resolution is fixed while a burst runs
+  if streamer: streamer.pause()
+  configureCamera()
+  if streamer: streamer.resume()
   
 def valuesCallback(n): # Pass 1 (next setting) or -1 (prev setting)
   global screenMode
@@ -320,8 +405,10 @@ def timelapseCallback(n): # start or stop timelapse
   global timelapseTimerThread
   global doTimelapsePicture
   global timelapsePicturesTaken
+  global timelapseSchedule
   if n==1 and timelapseStarted:
     camera.awb_mode = 'auto'
+    if meter: meter.release()
     #stop timelapse
     try:
       timelapseTimerThread.cancel()
@@ -329,6 +416,42 @@ def timelapseCallback(n): # start or stop timelapse
       pass
     timelapseStarted=False
     timelapsePicturesTaken=0
+    if jobScheduler:
+      jobScheduler.stop()
+    if timelapseSchedule:
+      timelapseSchedule.close()
+      timelapseSchedule = None
+    if burstCapture:
+      stopBurst() # the main loop finishes it and closes the video
+    else:
+      stopTimelapseVideo()
+  elif n==1 and not timelapseStarted and burstCapture:
+    #the last burst is still writing its frames
+    logger.warning('timelapse not started, the last burst is not finished')
+  elif n==1 and not timelapseStarted and jobScheduler:
+    #several timelapse jobs on their own schedules, taken by the main loop
+    jobScheduler.start(time.time(), pathData[storeMode])
+    timelapseStarted = True
+    if meter: meter.start()
+  elif n==1 and not timelapseStarted and config.getboolean('BURST', 'enabled', fallback=False):
+    #high rate timelapse on the video port instead of still pictures
+    startTimelapseVideo()
+    if meter: meter.start()
+    startBurst()
+    timelapseStarted = True
+  elif n==1 and not timelapseStarted and adaptiveInterval:
+    #start timelapse with an interval following the scene brightness,
+    #record the effective schedule next to the pictures
+    timelapseTimerThread = timers.AdaptiveRepeatingTimer(adaptiveInterval.interval(), function=timelapseCallback, args=(['2']))
+    try:
+      timelapseSchedule = adaptive.ScheduleLog(pathData[storeMode] + '/TIMELAPSE_' + dt.datetime.now().strftime('%Y%m%d_%H%M%S') + '.csv')
+    except IOError:
+      logger.error('cannot write timelapse schedule', exc_info=True)
+    timelapseTimerThread.name = 'TIMELAPSE_TIMER'
+    timelapseTimerThread.start()
+    timelapseStarted = True
+    startTimelapseVideo()
+    if meter: meter.start()
   elif n==1 and not timelapseStarted:
     #start timelapse
     #start repeating weather timer using the interval set 
@@ -336,22 +459,147 @@ def timelapseCallback(n): # start or stop timelapse
     timelapseTimerThread.name = 'TIMELAPSE_TIMER'
     timelapseTimerThread.start()
     timelapseStarted = True
+    startTimelapseVideo()
     # fix automatic white balance and exposure mode so that pictures in sequence
-    # look the same from a brightness, contrast and color perspective
-    # Give the camera's auto-exposure and auto-white-balance algorithms
-    # some time to measure the scene and determine appropriate values
-    #time.sleep(2)
-    # Now fix the values
-    #camera.shutter_speed = camera.exposure_speed
-    #camera.exposure_mode = 'off'
+    # look the same from a brightness, contrast and color perspective:
+    # the meter lets auto exposure and auto white balance settle on the
+    # viewfinder and then fixes the values, without waiting here
     #29.07.2015 setting awb_mode to auto. Perhaps one day I will have time
     #to add a menu so user can set awb
-    #g = camera.awb_gains
     camera.awb_mode = 'auto'
-    #camera.awb_gains = g    
+    if meter: meter.start()
   elif n=='2':
     #take a photo
     doTimelapsePicture = True
+
+def startTimelapseVideo(): # Video of the timelapse, built frame by frame
+  global timelapseVideo
+  if not config.getboolean('VIDEO', 'enabled', fallback=False):
+    return
+  backend = avi.VideoBackend(pathData[storeMode] + '/TIMELAPSE_' + dt.datetime.now().strftime('%Y%m%d_%H%M%S'),
+                             fps  = config.getint(    'VIDEO', 'fps',  fallback=25),
+                             sync = config.getboolean('VIDEO', 'sync', fallback=True))
+  if config.getboolean('DEFLICKER', 'enabled', fallback=False):
+    #frames are corrected on the video's worker thread, pictures stay as taken
+    try:
+      backend = deflicker.DeflickerBackend(backend, deflicker.Deflicker(
+                  window  = config.getint(  'DEFLICKER', 'window',   fallback=15),
+                  maxGain = config.getfloat('DEFLICKER', 'max_gain', fallback=1.5),
+                  quality = config.getint(  'DEFLICKER', 'quality',  fallback=90)))
+    except ImportError:
+      logger.error('deflicker disabled', exc_info=True)
+  #one worker keeps the frames in order, a frame is never appended twice
+  timelapseVideo = storage.Destination('video', backend, kinds=['timelapse'], workers=1,
+                                       queueSize=config.getint('VIDEO', 'queue', fallback=16), retries=0)
+
+def stopTimelapseVideo(wait=False): # Let the frames in the queue be written, close the file
+  global timelapseVideo
+  if timelapseVideo:
+    #the queue drains on a thread of its own, the touchscreen stays responsive
+    video, timelapseVideo = timelapseVideo, None
+    t = threading.Thread(target=closeTimelapseVideo, args=(video,), name='VIDEO_CLOSE')
+    t.start()
+    if wait: t.join()
+
+def closeTimelapseVideo(video):
+  try:
+    video.stop()
+    video.backend.close()
+  except Exception:
+    logger.error('timelapse video not closed', exc_info=True)
+
+def startBurst(): # v['images'] frames from the video port at a fixed resolution
+  global burstCapture
+  folder = pathData[storeMode] + '/BURST_' + dt.datetime.now().strftime('%Y%m%d_%H%M%S')
+  #set the resolution once for the whole burst, the viewfinder is resized
+  if streamer: streamer.pause()
+  camera.resolution = (config.getint('BURST', 'width',  fallback=1920),
+                       config.getint('BURST', 'height', fallback=1080))
+  camera.crop       = (0.0, 0.0, 1.0, 1.0)
+  if streamer: streamer.resume()
+  sink, writer = burstSink(folder)
+  burstCapture = burst.Burst(camera, sink, v['images'],
+                             interval  = config.getfloat('BURST', 'interval', fallback=0.2),
+                             quality   = config.getint(  'BURST', 'quality',  fallback=85),
+                             queueSize = config.getint(  'BURST', 'queue',    fallback=16))
+  burstCapture.segments = writer # segments of this burst only, closed by finishBurst
+  burstCapture.start()
+
+def burstSink(folder): # Writer for the burst frames, runs on the burst's writer thread
+  writer = None
+  if config.getboolean('SEGMENTS', 'enabled', fallback=False):
+    writer = newSegmentWriter(folder)
+    store  = lambda name, i, when, data: writer.add(data, i + 1, when)
+  else:
+    os.makedirs(folder)
+    def store(name, i, when, data):
+      with open(folder + '/' + name, 'wb') as f:
+        f.write(data)
+  def sink(i, when, data):
+    name = 'IMG_' + '%04d' % (i + 1) + '.JPG'
+    store(name, i, when, data)
+    video = timelapseVideo
+    if video: video.submit(name, data)
+  return sink, writer
+
+def stopBurst(): # Stop capturing, the frames queued are still written
+  burstCapture.stop()
+
+def finishBurst(): # From the main loop once the burst has written its frames, back to the viewfinder resolution
+  global burstCapture, lastBurst
+  burstCapture.thread.join()
+  if burstCapture.segments:
+    burstCapture.segments.close()
+  lastBurst    = burstCapture.stats()
+  burstCapture = None
+  if streamer: streamer.pause()
+  configureCamera()
+  if streamer: streamer.resume()
+  stopTimelapseVideo()
+
+def adaptTimelapseInterval(): # Follow scene brightness, adaptive mode only
+  adaptiveInterval.feedExposure(camera)
+  interval = adaptiveInterval.interval()
+  if abs(interval - timelapseTimerThread.interval) > 0.05 * timelapseTimerThread.interval:
+    timelapseTimerThread.setInterval(interval)
+
+# Http control api actions, executed on the main loop ---------------------
+
+def apiTimelapse(start): # True: start, False: stop timelapse
+  if start != timelapseStarted:
+    timelapseCallback(1)
+
+def apiSettings(values): # Dictionary with new interval and/or images
+  for key in values:
+    v[key] = values[key]
+  if timelapseStarted and not (adaptiveInterval or jobScheduler or burstCapture) and timelapseTimerThread:
+    timelapseTimerThread.interval = v['interval'] # only the classic timer follows the setting
+  saveSettings()
+
+def apiStatus(): # Called from the api's http threads, read only!
+  return { 'timelapseStarted'      : timelapseStarted,
+           'timelapsePicturesTaken': timelapsePicturesTaken,
+           'v'                     : dict(v),
+           'screenMode'            : screenMode,
+           'storeMode'             : storeMode,
+           'sizeMode'              : sizeMode,
+           'webcamMode'            : webcamMode,
+           'upload'                : uploadBudget.stats() if uploadBudget else None,
+           'storage'               : dict((d.name, d.stats()) for d in destinations + [dropboxDestination] if d),
+           'logging'               : configuration.log_stats(),
+           'video'                 : timelapseVideo.stats() if timelapseVideo else None,
+           'burst'                 : burstCapture.stats() if burstCapture else lastBurst,
+           'metering'              : meter.stats() if meter else None,
+           'stack'                 : lastStack,
+           'idle'                  : idleMonitor.stats() if idleMonitor else None,
+           'memory'                : memoryMonitor.stats() if memoryMonitor else None,
+           'raw'                   : rawDeveloper.stats() if rawDeveloper else None,
+           'jobs'                  : dict(jobScheduler.stats(time.time()), worker=jobWorker.stats()) if jobScheduler else None,
+           'capture'               : { 'warm'      : warmCapture,
+                                       # average and last shutter lag in ms per size mode
+                                       'shutterLag': dict(('%s-%d' % ('warm' if k[0] else 'classic', k[1]),
+                                                           { 'captures': c, 'avgMs': round(t * 1000 / c, 1), 'lastMs': round(l * 1000, 1) })
+                                                          for k, (c, t, l) in list(shutterLag.items())) } }
     
 # Global stuff -------------------------------------------------------------
     
@@ -381,6 +629,41 @@ webcamMode            = True       # upload file to dropbox always with same nam
 webcamImageOnly       = True       # only take small size pic. for upload to dropbox.
 webcamModeAnnotation  = True       # Annotate image when in webcame mode
 dropboxAccessToken    = None       # dropbox access token
+streamer              = None       # mjpeg live stream (mjpeg.Streamer)
+controlApi            = None       # http control api (api.ControlApi)
+motionDetector        = None       # motion detection (motion.MotionDetector)
+motionGate            = False      # timelapse pictures only after motion
+motionSeen            = False      # motion since the last picture
+doMotionPicture       = False      # motion detected, take a picture
+adaptiveInterval      = None       # brightness adaptive interval (adaptive.AdaptiveInterval)
+timelapseSchedule     = None       # effective timelapse schedule (adaptive.ScheduleLog)
+uploadBudget          = None       # upload byte budget (budget.UploadBudget)
+player                = None       # sequence playback on screen 0 (playback.SequencePlayer)
+timelapseVideo        = None       # video of the running timelapse (storage.Destination with avi.VideoBackend)
+thumbStores           = {}         # thumbnails per storage path (thumbs.ThumbnailStore)
+segmentWriters        = {}         # timelapse segments per storage path (segments.SegmentWriter)
+lastPicture           = None       # jpeg of the last picture taken
+burstCapture          = None       # high rate timelapse running (burst.Burst)
+lastBurst             = None       # statistics of the last burst
+gridSize              = 3          # thumbnails per row and column on the grid screen
+gridItems             = []         # pictures on the grid screen
+gridPage              = 0          # page shown on the grid screen
+gridDrawn             = -1         # thumbnails generated when the grid was drawn
+destinations          = []         # storage destinations from config.ini (storage.Destination)
+dropboxDestination    = None       # dropbox destination for storeMode 2 (storage.Destination)
+warmCapture           = False      # camera stays at the still resolution, viewfinder resized
+shutterLag            = {}         # (warm, sizeMode) -> [captures, seconds in total, last seconds]
+meter                 = None       # exposure and white balance lock for timelapses (metering.Meter)
+stackFrames           = 0          # frames combined into one picture, 0 single frame pictures
+lastStack             = None       # statistics of the last stacked exposure
+idleMonitor           = None       # idle mode without touch (idle.IdleMonitor)
+idleTimelapseOnly     = True       # go idle during a timelapse only
+histogramOverlay      = None       # live histogram on the viewfinder (histogram.HistogramOverlay)
+memoryMonitor         = None       # memory samples and budgets (memory.MemoryMonitor)
+viewfinderBuffer      = None       # viewfinder frames are captured into rgb (memory.FrameBuffer)
+rawDeveloper          = None       # raw pictures developed in the background (raw.RawDeveloper)
+jobScheduler          = None       # several timelapse jobs from [JOB:<name>] sections (jobs.Scheduler)
+jobWorker             = None       # scales, saves and sends the job pictures (jobs.JobWorker)
 
 # To use Dropbox uploader, must have previously run the dropbox_uploader.sh
 # script to set up the app key and such.  If this was done as the normal pi
@@ -396,6 +679,10 @@ logger = configuration.init_log('WEBCAM')
 logger = logging.getLogger('WEBCAM')  
 logger.info('logger initialized')
 
+#read config.ini
+configuration.general_configuration()
+config = configuration.get_CONFIG()
+
 sizeData = [ # Camera parameters for different size settings
   # Full res      Viewfinder  Crop window
   [(2592, 1944), (320, 240), (0.0   , 0.0   , 1.0   , 1.0   ), (648, 486)], # Large
@@ -436,12 +723,14 @@ icons = [] # This list gets populated at startup
 
 buttons = [
   # Screen mode 0 is photo playback
-  [Button((  0,188,320, 52), bg='done' , cb=doneCallback),
+  [Button(( 80,188,160, 52), bg='done' , cb=doneCallback),
    Button((  0,  0, 80, 52), bg='prev' , cb=imageCallback, value=-1),
    Button((240,  0, 80, 52), bg='next' , cb=imageCallback, value= 1),
    Button(( 88, 70,157,102)), # 'Working' label (when enabled)
    Button((148,129, 22, 22)), # Spinner (when enabled)
-   Button((121,  0, 78, 52), bg='trash', cb=imageCallback, value= 0)],
+   Button((121,  0, 78, 52), bg='trash', cb=imageCallback, value= 0),
+   Button((  0, 52,320,136), cb=playCallback), # Tap picture: play sequence
+   Button((240,188, 80, 52), bg='grid' , cb=gridOpenCallback)],
   
   # Screen mode 1 is delete confirmation
   [Button((  0,35,320, 33), bg='delete'),
@@ -545,8 +834,17 @@ buttons = [
    Button((  0,  0, 80, 52), bg='prev'   , cb=settingCallback, value=-1),
    Button((240,  0, 80, 52), bg='next'   , cb=settingCallback, value= 1),
    Button((110, 60,100,120), bg='quit-ok', cb=quitCallback),
-   Button((  0, 10,320, 35), bg='quit')]
+   Button((  0, 10,320, 35), bg='quit')],
+
+  # Screen mode 12 is the thumbnail grid, one button per thumbnail is
+  # added at startup once the grid size is known
+  [Button(( 80,188,160, 52), bg='done', cb=gridCallback, value= 0),
+   Button((  0,188, 80, 52), bg='prev', cb=gridCallback, value=-1),
+   Button((240,188, 80, 52), bg='next', cb=gridCallback, value= 1),
+   Button(( 88, 43,157,102)), # 'Working' label (when enabled)
+   Button((148,102, 22, 22))] # Spinner (when enabled)
 ]
+lastSettingMode = 11 # Settings screens are 4 to 11, prev/next cycle through them
 
 
 # Assorted utility functions -----------------------------------------------
@@ -564,6 +862,7 @@ def setIsoMode(n):
   buttons[7][5].setBg('iso-' + str(isoData[isoMode][0]))
   buttons[7][7].rect = ((isoData[isoMode][1] - 10,) +  buttons[7][7].rect[1:])
   
+@tracing.traced('saveSettings', 'settings')
 def saveSettings():
   global v, webcamMode, webcamImageOnly, webcamModeAnnotation, dropboxAccessToken
   try:
@@ -639,16 +938,19 @@ def imgRange(path):
 def spinner():
   global busy, screenMode, screenModePrior
   
+  if isIdle(): return # screen is off
   buttons[screenMode][3].setBg('working')
   buttons[screenMode][3].draw(screen)
-  pygame.display.update()
+  with tracing.span('display.update', 'ui'):
+    pygame.display.update()
   
   busy = True
   n    = 0
   while busy is True:
     buttons[screenMode][4].setBg('work-' + str(n))
     buttons[screenMode][4].draw(screen)
-    pygame.display.update()
+    with tracing.span('display.update', 'ui'):
+      pygame.display.update()
     n = (n + 1) % 5
     time.sleep(0.15)
     
@@ -656,8 +958,13 @@ def spinner():
   buttons[screenMode][4].setBg(None)
   screenModePrior = -1 # Force refresh
   
-def takePicture():
-  global busy, gid, loadIdx, saveIdx, scaled, sizeMode, storeMode, storeModePrior, uid, webcamMode, webcamModeAnnotation, webcamImageOnly, dropboxAccessToken, logger
+@tracing.traced('takePicture')
+def takePicture(timelapse=False):
+  global busy, gid, loadIdx, saveIdx, scaled, sizeMode, storeMode, storeModePrior, uid, webcamMode, webcamModeAnnotation, webcamImageOnly, dropboxAccessToken, logger, motionSeen, lastPicture
+
+  if burstCapture: # camera is busy at the burst resolution
+    logger.warning('no picture taken while a burst is running')
+    return None
   
   if not os.path.isdir(pathData[storeMode]):
     try:
@@ -685,11 +992,13 @@ def takePicture():
     except OSError as e:
       # errno = 2 if can't create folder
       #print errno.errorcode[e.errno]
-      logger.error('unexpected error ['+ str(traceback.format_exc()) + ']')  
+      logger.error('unexpected error', exc_info=True)  
       return
     
   # If this is the first time accessing this directory,
   # scan for the max image index, start at next pos.
+  motionSeen = False
+
   if storeMode != storeModePrior:
     if webcamMode and webcamImageOnly:
       #only want webcam image, always has the same index
@@ -701,6 +1010,11 @@ def takePicture():
       else:
         saveIdx = r[1] + 1
         if saveIdx > 9999: saveIdx = 0
+      if config.getboolean('SEGMENTS', 'enabled', fallback=False):
+        #timelapse pictures in segments are numbered on from the index
+        last = segmentWriter(pathData[storeMode] + '/segments').last
+        if last is not None and (r is None or last >= r[1]):
+          saveIdx = (last + 1) % 10000
     storeModePrior = storeMode
       
   # Scan for next available image slot
@@ -715,69 +1029,58 @@ def takePicture():
       if saveIdx > 9999: saveIdx = 0
 
     
-  t = threading.Thread(target=spinner)
+  t = threading.Thread(target=spinner, name='SPINNER')
   t.start()
   
-  scaled = None
-  camera.resolution = sizeData[sizeMode][0]
-  camera.crop       = sizeData[sizeMode][2]
+  scaled    = None
+  saved     = None
+  segmented = False
   if webcamMode and webcamModeAnnotation:
     camera.annotate_background = True
     camera.annotate_text       = dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
   try:
-    if webcamMode and webcamImageOnly:
-      camera.capture(filename, use_video_port=False, format='jpeg', thumbnail=None, resize=sizeData[sizeMode][3])
+    #capture into memory, the api serves the latest picture from there
+    capture = io.BytesIO()
+    captureQuality = None
+    if webcamMode and webcamImageOnly and storeMode == 2 and uploadBudget:
+      #picture is uploaded as is, let the camera encode it to fit the budget
+      captureQuality = uploadBudget.captureQuality(sizeData[sizeMode][3]) or uploadBudget.minQuality
+      captureStill(capture, resize=sizeData[sizeMode][3], quality=captureQuality)
+    elif webcamMode and webcamImageOnly:
+      captureStill(capture, resize=sizeData[sizeMode][3])
     else:
-      camera.capture(filename, use_video_port=False, format='jpeg', thumbnail=None)
-    # Set image file ownership to pi user, mode to 644
-    # os.chown(filename, uid, gid) # Not working, why?
-    os.chmod(filename, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
-    img    = pygame.image.load(filename)
-    scaled = pygame.transform.scale(img, sizeData[sizeMode][1])
-    if storeMode == 2: # Dropbox
-      #get the dropbox client, if a valid dropbox access token was load in loadSettings
-      #if dropboxAccessToken is not None:
-      try:
-        dropboxClient = dropbox.client.DropboxClient(dropboxAccessToken)
-      except:
-        logger.error('unexpected error ['+ str(traceback.format_exc()) + ']')  
-        dropboxClient = None
-      if dropboxClient is not None:
-        if webcamMode and not webcamImageOnly:
-          #since I pay for data I want to upload a small image even if I 
-          #want to keep a large resolution image file locally
-          webcamImage = pygame.transform.scale(img, sizeData[sizeMode][3]) 
-          pygame.image.save(webcamImage, pathData[storeMode]+'/webcam/IMG_0001.JPG')
-          #cmd = uploader + ' -f ' + upconfig + ' upload ' + pathData[storeMode]+'/webcam/IMG_0001.JPG' + ' Photos/webcam/IMG_0001.JPG'
-          f=open(pathData[storeMode]+'/webcam/IMG_0001.JPG', 'rb')
-          try:
-            response = dropboxClient.put_file('Photos/webcam/IMG_0001.JPG', f, overwrite=True)
-            logger.info('1: uploaded image')  
-          except:
-            logger.error('1: unexpected error ['+ str(traceback.format_exc()) + ']')  
-        elif webcamMode and webcamImageOnly:
-          #cmd = uploader + ' -f ' + upconfig + ' upload ' + filename + ' Photos/webcam/' + os.path.basename(filename)
-          f=open(filename, 'rb')
-          try:
-            response = dropboxClient.put_file('Photos/webcam/' + os.path.basename(filename), f, overwrite=True)
-            logger.info('2: uploaded image')
-          except:
-            logger.error('2: unexpected error ['+ str(traceback.format_exc()) + ']')  
-        else:
-          f=open(filename, 'rb')
-          #cmd = uploader + ' -f ' + upconfig + ' upload ' + filename + ' Photos/' + os.path.basename(filename)
-          try:
-            response = dropboxClient.put_file('Photos/' + os.path.basename(filename), f, overwrite=True)
-            logger.info('3: uploaded image')
-          except:
-            logger.error('3: unexpected error ['+ str(traceback.format_exc()) + ']')  
+      captureStill(capture)
+    data, rawBlock = raw.split(capture.getvalue()) if rawDeveloper else (capture.getvalue(), None)
+    if timelapse and not (webcamMode and webcamImageOnly) and config.getboolean('SEGMENTS', 'enabled', fallback=False):
+      #timelapse frames are appended to segment files instead of a file each
+      segmentWriter(pathData[storeMode] + '/segments').add(data, saveIdx)
+      saveIdx   = (saveIdx + 1) % 10000
+      segmented = True
+    else:
+      with tracing.span('write', 'disk', bytes=len(data)):
+        with open(filename, 'wb') as f:
+          f.write(data)
+      thumbStore(os.path.dirname(filename)).request(filename) # grid screen
+      # Set image file ownership to pi user, mode to 644
+      # os.chown(filename, uid, gid) # Not working, why?
+      with tracing.span('chmod', 'disk'):
+        os.chmod(filename, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
+    if rawBlock: # developed next to the picture, in the background
+      rawDeveloper.submit(rawBlock, os.path.splitext(filename)[0] + rawDeveloper.extension(),
+                          sizeData[sizeMode][2], [float(g) for g in camera.awb_gains])
+    saved       = filename
+    lastPicture = data
+    if controlApi: controlApi.latest.set(data, os.path.basename(filename))
+    with tracing.span('decode'):
+      img    = pygame.image.load(io.BytesIO(data), 'capture.jpg')
+    with tracing.span('scale'):
+      scaled = pygame.transform.scale(img, sizeData[sizeMode][1])
+    distributePicture(filename, data, img, captureQuality)
   except:
     #catch any error and log it
-    logger.error('unexpected error ['+ str(traceback.format_exc()) + ']')  
+    logger.error('unexpected error', exc_info=True)  
   finally:
     # Add error handling/indicator (disk full, etc.)
-    camera.resolution = sizeData[sizeMode][1]
-    camera.crop       = (0.0, 0.0, 1.0, 1.0)
     #sure spinner thread is joined.
     busy = False
     t.join()    
@@ -787,7 +1090,7 @@ def takePicture():
     camera.annotate_background = False
     camera.annotate_text       = '' 
   
-  if scaled:
+  if scaled and not isIdle():
     if scaled.get_height() < 240: # Letterbox
       screen.fill(0)
       screen.blit(scaled,
@@ -795,16 +1098,260 @@ def takePicture():
           (240 - scaled.get_height()) / 2))
       pygame.display.update()
       time.sleep(2.5)
-      loadIdx = saveIdx
+      if not segmented: loadIdx = saveIdx # segment pictures are not played back
+
+  return saved # file name of the new picture (name only for segments), None if it failed
       
+# Resolution and crop for the current size mode. Warm capture keeps the
+# camera at the still resolution and crop, the viewfinder and the stream
+# are resized on the video port, so a still needs no reconfiguration.
+def configureCamera():
+  if warmCapture:
+    camera.resolution = sizeData[sizeMode][0]
+    camera.crop       = sizeData[sizeMode][2]
+  else:
+    camera.resolution = sizeData[sizeMode][1]
+    camera.crop       = (0.0, 0.0, 1.0, 1.0)
+
+# Jpeg still at the full resolution of the size mode into stream. Without
+# warm capture the camera is switched to the still resolution and back
+# around the capture. The time taken (shutter lag) is kept per size mode.
+@tracing.traced('capture', 'camera')
+def captureStill(stream, **options):
+  start = time.time()
+  if warmCapture:
+    shoot(stream, **options)
+  else:
+    #the mjpeg encoder must be stopped while the resolution changes
+    if streamer: streamer.pause()
+    camera.resolution = sizeData[sizeMode][0]
+    camera.crop       = sizeData[sizeMode][2]
+    try:
+      shoot(stream, **options)
+    finally:
+      configureCamera()
+      if streamer: streamer.resume()
+  lag = time.time() - start
+  s   = shutterLag.setdefault((warmCapture, sizeMode), [0, 0.0, 0.0])
+  s[0] += 1
+  s[1] += lag
+  s[2]  = lag
+  return lag
+
+# The capture itself: a single still, or with [STACK] enabled a stacked
+# exposure of stackFrames (or frames) frames averaged into one jpeg. With
+# [RAW] enabled full size stills carry the raw Bayer data after the jpeg.
+def shoot(stream, resize=None, quality=None, frames=None):
+  global lastStack
+  frames  = stackFrames if frames is None else frames
+  options = {}
+  if resize:  options['resize']  = resize
+  if quality: options['quality'] = quality # picamera's default when not given
+  if rawDeveloper and not resize: options['bayer'] = True
+  if frames > 1:
+    stacker   = stack.Stacker(config.get(       'STACK', 'mode',      fallback='mean'),
+                              config.getboolean('STACK', 'align',     fallback=False),
+                              config.getint(    'STACK', 'max_shift', fallback=16))
+    lastStack = stack.captureStack(camera, stream, frames, stacker,
+                                   videoPort = config.getboolean('STACK', 'video_port', fallback=True),
+                                   resize    = resize,
+                                   quality   = quality or config.getint('STACK', 'quality', fallback=85))
+  else:
+    camera.capture(stream, use_video_port=False, format='jpeg', thumbnail=None, **options)
+
+# Pictures of the timelapse jobs due, one exposure shared by the jobs of
+# each group, saved in the folder of every job and sent to its storage
+# destinations.
+def takeJobPictures(exposures):
+  global lastPicture
+  for exposure in exposures:
+    start   = time.time()
+    capture = io.BytesIO()
+    try:
+      with tracing.span('job', jobs=','.join(j.name for j in exposure.jobs)):
+        captureStill(capture, **exposure.options())
+    except Exception:
+      logger.error('job exposure failed', exc_info=True)
+      for job in exposure.jobs:
+        jobScheduler.skip(job, time.time())
+      continue
+    data, rawBlock = raw.split(capture.getvalue()) if rawDeveloper else (capture.getvalue(), None)
+    jobScheduler.exposures += 1
+    #scaled, saved and sent by the job worker, the camera is free again
+    jobWorker.submit(exposure, data, (rawBlock, [float(g) for g in camera.awb_gains]) if rawBlock else None)
+    for i, job in enumerate(exposure.jobs):
+      if i: jobScheduler.shared += 1
+      jobScheduler.taken(job, start, time.time())
+    lastPicture = data
+    if controlApi: controlApi.latest.set(data, exposure.jobs[0].name + '.jpg')
+    if meter: meter.frameTaken()
+
+def storeJobPicture(job, jpeg, rawGains): # On the job worker: save, send and develop the raw data
+  name = saveJobPicture(job, jpeg)
+  distributeJobPicture(job, name, jpeg)
+  if rawGains:
+    rawDeveloper.submit(rawGains[0], os.path.join(job.target, os.path.splitext(name)[0] + rawDeveloper.extension()),
+                        sizeData[sizeMode][2], rawGains[1])
+
+def saveJobPicture(job, data): # Next IMG_XXXX.JPG in the folder of a job
+  if job.index is None:
+    if job.save and not os.path.isdir(job.target):
+      os.makedirs(job.target)
+      os.chown(job.target, uid, gid)
+    r = imgRange(job.target) if job.save else None
+    job.index = r[1] + 1 if r else 1
+  while True: # next free name, never overwrite a picture
+    name      = 'IMG_' + '%04d' % (job.index % 10000) + '.JPG'
+    filename  = os.path.join(job.target, name)
+    job.index = (job.index + 1) % 10000
+    if not (job.save and os.path.isfile(filename)): break
+  if job.save:
+    with open(filename, 'wb') as f:
+      f.write(data)
+    os.chmod(filename, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
+    thumbStore(job.target).request(filename) # grid screen
+  return name
+
+# Hand a new picture to the storage destinations from config.ini and, in
+# storage mode Dropbox, to Dropbox. Uploads run in the background.
+def distributePicture(filename, data, img, captureQuality):
+  global dropboxDestination
+  targets = list(destinations)
+  if storeMode == 2: # Dropbox
+    if dropboxDestination is None:
+      dropboxDestination = storage.Destination('dropbox', storage.DropboxBackend(dropboxAccessToken))
+    #since I pay for data I only upload the small webcam image in webcam mode
+    dropboxDestination.kinds = set(['webcam'] if webcamMode else ['picture'])
+    targets.append(dropboxDestination)
+  if not targets:
+    return
+  frames = [] # kind, remote name, jpeg, decoded picture, jpeg quality
+  if webcamMode and not webcamImageOnly:
+    webcamImage = pygame.transform.scale(img, sizeData[sizeMode][3])
+    frames.append(('webcam', 'webcam/IMG_0001.JPG', None, webcamImage, None))
+  elif webcamMode:
+    frames.append(('webcam', 'webcam/' + os.path.basename(filename), data, img, captureQuality))
+  if not (webcamMode and webcamImageOnly):
+    frames.append(('picture', os.path.basename(filename), data, img, None))
+  for kind, remote, jpeg, surface, quality in frames:
+    wanted  = [d for d in targets if d.accepts(kind)]
+    copy    = pathData[storeMode] + '/' + remote if remote == 'webcam/IMG_0001.JPG' and storeMode == 2 else None
+    prepare = None # no budget, metered destinations get jpeg as well
+    if uploadBudget and any(d.metered for d in wanted):
+      #fit the upload into the byte budget on the upload worker
+      prepare = budgetPreparer(None if jpeg else surface, quality, copy)
+    if jpeg is None and any(not d.metered or prepare is None for d in wanted):
+      jpeg = budget.encodeJpeg(surface, 85)
+    if copy and prepare is None:
+      #local copy of the webcam image as it is uploaded
+      with open(copy, 'wb') as f:
+        f.write(jpeg)
+    storage.submit(wanted, kind, remote, jpeg, prepare,
+                   uploadBudget.record if uploadBudget else None)
+
+# The upload of a picture fitted into the byte budget, run by the worker of
+# a metered destination: the quality search re-encodes the picture several
+# times and must not hold up the main loop. surface is the picture when it
+# has no jpeg yet, copy a file to keep the upload in.
+def budgetPreparer(surface=None, quality=None, copy=None):
+  def prepare(data):
+    upload = uploadBudget.prepare(data, surface, quality) # None: budget exhausted
+    if copy and upload is not None:
+      with open(copy, 'wb') as f:
+        f.write(upload)
+    return upload
+  return prepare
+
+def distributeJobPicture(job, name, jpeg): # To the destinations of a job, within the upload budget
+  wanted = [d for d in destinations if d.name in job.destinations]
+  if not wanted:
+    return
+  storage.submit(wanted, None, job.name + '/' + name, jpeg,
+                 budgetPreparer(quality=job.quality) if uploadBudget else None,
+                 uploadBudget.record if uploadBudget else None)
+
+def segmentWriter(path): # Segments of a storage path, made on first use
+  if path not in segmentWriters:
+    segmentWriters[path] = newSegmentWriter(path)
+  return segmentWriters[path]
+
+def newSegmentWriter(path): # Segments with the [SEGMENTS] settings, closed by the caller
+  return segments.SegmentWriter(path,
+    maxBytes = config.getint(    'SEGMENTS', 'max_mb',      fallback=256) * 1024 * 1024,
+    maxAge   = config.getint(    'SEGMENTS', 'max_minutes', fallback=60) * 60,
+    sync     = config.getboolean('SEGMENTS', 'sync',        fallback=False))
+
+def thumbStore(path): # Thumbnail store of a storage path, made on first use
+  if path not in thumbStores:
+    thumbStores[path] = thumbs.ThumbnailStore(path)
+  return thumbStores[path]
+
+def gridStale(): # New thumbnails since the grid was drawn
+  return screenMode == 12 and thumbStore(pathData[storeMode]).generated != gridDrawn
+
+def drawGrid(): # Thumbnails of the current page, placeholders while being made
+  global gridDrawn
+  store     = thumbStore(pathData[storeMode])
+  gridDrawn = store.generated
+  w, h      = 320 // gridSize, 188 // gridSize
+  perPage   = gridSize * gridSize
+  first     = gridPage * perPage
+  for i, f in enumerate(gridItems[first:first + perPage]):
+    x, y = (i % gridSize) * w, (i // gridSize) * h
+    t    = store.get(f)
+    if t is None:
+      screen.fill((40, 40, 40), (x + 2, y + 2, w - 4, h - 4))
+      continue
+    if t.get_width() > w - 4 or t.get_height() > h - 4:
+      t = pygame.transform.smoothscale(t, thumbs.fit(t.get_size(), (w - 4, h - 4)))
+    screen.blit(t, (x + (w - t.get_width()) // 2, y + (h - t.get_height()) // 2))
+  # next page in the background, so paging on is quick
+  for f in gridItems[first + perPage:first + 2 * perPage]:
+    if store.lookup(f)[1] is False:
+      store.request(f)
+
+def isIdle(): # Screen blanked, nobody looking
+  return idleMonitor is not None and idleMonitor.idle
+
+def previewNeeded(): # Viewfinder frames are used even while idle
+  return bool(motionDetector or (adaptiveInterval and adaptiveInterval.source == 'preview') or
+              (meter and timelapseStarted))
+
+def stopDestinations(): # Let the uploads in progress finish
+  for d in destinations + [dropboxDestination]:
+    if d: d.stop()
+    if d and hasattr(d.backend, 'close'): d.backend.close() # fleet: send what is left
+
+# Bytes held by the subsystems the memory monitor watches. Only the
+# thumbnail cache can give its surfaces up, they are loaded again as needed.
+def thumbCacheBytes():
+  return sum(memory.surfaceBytes(t) for store in list(thumbStores.values()) for t in list(store.cache.values()))
+
+def shedThumbCache():
+  for store in thumbStores.values():
+    store.cache.clear()
+
+def pictureBytes(): # picture on screen, last jpeg and the one the api serves
+  latest = controlApi.latest.data if controlApi else None
+  return memory.surfaceBytes(scaled) + len(lastPicture or b'') + (len(latest) if latest is not lastPicture else 0)
+
+def playbackBytes(): # frames decoded ahead
+  return sum(memory.surfaceBytes(f[1]) for f in list(player.ring) if f) if player else 0
+
+def shedPlayback(): # the frames decoded ahead go with the player
+  if player: stopPlayback()
+
+def uploadBytes(): # pictures waiting in the upload, video and job queues
+  return sum(d.queuedBytes() for d in destinations + [dropboxDestination, timelapseVideo, jobWorker] if d)
+
 def showNextImage(direction):
   global busy, loadIdx
   
-  t = threading.Thread(target=spinner)
+  t = threading.Thread(target=spinner, name='SPINNER')
   t.start()
   
   n = loadIdx
-  while True:
+  for i in range(10000): # at most once around, the folder may be empty
     n += direction
     if(n > 9999): n = 0
     elif(n < 0):  n = 9999
@@ -818,11 +1365,11 @@ def showNextImage(direction):
 def showImage(n):
   global busy, loadIdx, scaled, screenMode, screenModePrior, sizeMode, storeMode
   
-  t = threading.Thread(target=spinner)
+  t = threading.Thread(target=spinner, name='SPINNER')
   t.start()
   
-  img      = pygame.image.load(pathData[storeMode] + '/IMG_' + '%04d' % n + '.JPG')
-  scaled   = pygame.transform.scale(img, sizeData[sizeMode][1])
+  #the decoder scales down itself, no full resolution surface
+  scaled   = playback.loadScaled(pathData[storeMode] + '/IMG_' + '%04d' % n + '.JPG', sizeData[sizeMode][1])
   loadIdx  = n
   
   busy = False
@@ -847,8 +1394,33 @@ uid = int(s) if s else os.getuid()
 s = os.getenv("SUDO_GID")
 gid = int(s) if s else os.getgid()
 
+# Timeline of captures, display updates, timer fires and uploads, written
+# as Chrome trace json on kill -USR2 <pid>, at exit or from /trace.json
+if config.getboolean('TRACE', 'enabled', fallback=False):
+  tracing.enable(config.getint('TRACE', 'events', fallback=20000))
+  traceFolder = config.get('TRACE', 'folder', fallback='./log')
+  tracing.dumpOnSignal(traceFolder)
+  if config.getboolean('TRACE', 'dump_at_exit', fallback=False):
+    atexit.register(tracing.dump, os.path.join(traceFolder, 'trace-exit.json'))
+
+# Raw pictures, the worker processes are started before the camera and
+# the other threads so they do not inherit them
+if config.getboolean('RAW', 'enabled', fallback=False):
+  try:
+    rawDeveloper = raw.RawDeveloper(
+      workers   = config.getint('RAW', 'workers',    fallback=0) or None,
+      maxQueued = config.getint('RAW', 'max_queued', fallback=4),
+      form      = config.get(   'RAW', 'format',     fallback='dng'),
+      quality   = config.getint('RAW', 'quality',    fallback=90),
+      spool     = config.get(   'RAW', 'spool',      fallback='') or None,
+      nice      = config.getint('RAW', 'nice',       fallback=10))
+    atexit.register(rawDeveloper.close)
+  except Exception:
+    logger.error('raw pictures disabled', exc_info=True)
+
 # Buffers for viewfinder data
 rgb = bytearray(320 * 240 * 3)
+viewfinderBuffer = memory.FrameBuffer(rgb)
 
 # Init pygame and screen
 pygame.init()
@@ -859,9 +1431,114 @@ screen = pygame.display.set_mode((0,0), pygame.FULLSCREEN)
 # Init camera and set up default values
 camera            = picamera.PiCamera()
 atexit.register(camera.close)
-camera.resolution = sizeData[sizeMode][1]
-#camera.crop       = sizeData[sizeMode][2]
-camera.crop       = (0.0, 0.0, 1.0, 1.0)
+warmCapture       = config.getboolean('CAPTURE', 'warm', fallback=False)
+if warmCapture:
+  #the video port runs at the still resolution, keep the frame rate the sensor allows
+  camera.framerate = config.getint('CAPTURE', 'framerate', fallback=15)
+configureCamera()
+
+# Live mjpeg stream, recorded from its own splitter port so it can run
+# alongside the viewfinder (splitter port 0) and timelapse stills
+if config.getboolean('MJPEG', 'enabled', fallback=False):
+  streamer = mjpeg.Streamer(camera,
+                             port    = config.getint('MJPEG', 'port',    fallback=8000),
+                             resize  = (config.getint('MJPEG', 'width',  fallback=640),
+                                        config.getint('MJPEG', 'height', fallback=480)),
+                             quality = config.getint('MJPEG', 'quality', fallback=20))
+  streamer.start()
+  atexit.register(streamer.stop)
+
+# Http control api
+if config.getboolean('API', 'enabled', fallback=False):
+  controlApi = api.ControlApi(config.getint('API', 'port', fallback=8080),
+                              { 'timelapse': apiTimelapse,
+                                'settings' : apiSettings,
+                                'capture'  : takePicture },
+                              apiStatus)
+  controlApi.start()
+  atexit.register(controlApi.stop)
+
+# Motion detection on the viewfinder frames
+if config.getboolean('MOTION', 'enabled', fallback=False):
+  try:
+    motionDetector = motion.MotionDetector(
+      sensitivity = config.getint(  'MOTION', 'sensitivity', fallback=20),
+      threshold   = config.getfloat('MOTION', 'threshold',   fallback=0.02),
+      cooldown    = config.getfloat('MOTION', 'cooldown',    fallback=10),
+      mask        = motion.parseMask(config.get('MOTION', 'mask', fallback='')),
+      step        = config.getint(  'MOTION', 'step',        fallback=4))
+    motionGate = config.getboolean('MOTION', 'gate_timelapse', fallback=False)
+  except Exception:
+    logger.error('motion detection disabled', exc_info=True)
+
+# Brightness adaptive timelapse interval
+if config.getboolean('ADAPTIVE', 'enabled', fallback=False):
+  try:
+    adaptiveInterval = adaptive.AdaptiveInterval(
+      minInterval = config.getfloat('ADAPTIVE', 'min_interval', fallback=10),
+      maxInterval = config.getfloat('ADAPTIVE', 'max_interval', fallback=600),
+      dark        = config.getfloat('ADAPTIVE', 'dark',         fallback=20),
+      bright      = config.getfloat('ADAPTIVE', 'bright',       fallback=100),
+      source      = config.get(     'ADAPTIVE', 'source',       fallback='preview'))
+  except Exception:
+    logger.error('adaptive timelapse interval disabled', exc_info=True)
+
+# Exposure and white balance lock for timelapse pictures
+if config.getboolean('METERING', 'enabled', fallback=False):
+  meter = metering.Meter(camera,
+                         refresh   = config.getfloat(  'METERING', 'refresh',   fallback=600),
+                         drift     = config.getfloat(  'METERING', 'drift',     fallback=0.5),
+                         settle    = config.getfloat(  'METERING', 'settle',    fallback=2),
+                         tolerance = config.getfloat(  'METERING', 'tolerance', fallback=0.05),
+                         awb       = config.getboolean('METERING', 'awb',       fallback=True))
+
+# Stacked exposure, several frames averaged into every picture
+if config.getboolean('STACK', 'enabled', fallback=False):
+  if stack.numpy is None:
+    logger.error('stacked exposure disabled, numpy is not installed')
+  else:
+    stackFrames = config.getint('STACK', 'frames', fallback=8)
+
+# Live histogram on the viewfinder
+if config.getboolean('HISTOGRAM', 'enabled', fallback=False):
+  try:
+    histogramOverlay = histogram.HistogramOverlay(
+      mode  = config.get(     'HISTOGRAM', 'mode',  fallback='luma'),
+      every = config.getint(  'HISTOGRAM', 'every', fallback=5),
+      step  = config.getint(  'HISTOGRAM', 'step',  fallback=4),
+      clip  = config.getfloat('HISTOGRAM', 'clip',  fallback=0.02))
+  except Exception:
+    logger.error('histogram overlay disabled', exc_info=True)
+
+# Idle mode, viewfinder and screen off without touch
+if config.getfloat('IDLE', 'minutes', fallback=0) > 0:
+  idleMonitor = idle.IdleMonitor(timeout   = config.getfloat('IDLE', 'minutes',  fallback=0) * 60,
+                                 interval  = config.getfloat('IDLE', 'interval', fallback=1.0),
+                                 backlight = config.get(     'IDLE', 'backlight', fallback='') or None)
+  idleTimelapseOnly = config.getboolean('IDLE', 'timelapse_only', fallback=True)
+
+# Byte budget for uploads
+if config.getboolean('BUDGET', 'enabled', fallback=False):
+  uploadBudget = budget.UploadBudget(
+    target     = config.getint(  'BUDGET', 'target',      fallback=50000),
+    daily      = config.getint(  'BUDGET', 'daily',       fallback=0),
+    minQuality = config.getint(  'BUDGET', 'min_quality', fallback=20),
+    maxQuality = config.getint(  'BUDGET', 'max_quality', fallback=90),
+    reserve    = config.getfloat('BUDGET', 'reserve',     fallback=0.2))
+
+# Memory samples, budgets and shedding of the caches
+if config.getboolean('MEMORY', 'enabled', fallback=False):
+  memoryMonitor = memory.MemoryMonitor(
+    interval = config.getfloat(  'MEMORY', 'interval',   fallback=60),
+    budget   = config.getint(    'MEMORY', 'budget_mb',  fallback=0) * memory.MB or None,
+    trace    = config.getboolean('MEMORY', 'tracemalloc',fallback=False),
+    frames   = config.getint(    'MEMORY', 'frames',     fallback=1),
+    top      = config.getint(    'MEMORY', 'top',        fallback=10))
+  memoryMonitor.register('thumbs',   thumbCacheBytes, shedThumbCache,
+                         budget = config.getint('MEMORY', 'thumbs_mb', fallback=0) * memory.MB or None)
+  memoryMonitor.register('picture',  pictureBytes)
+  memoryMonitor.register('playback', playbackBytes, shedPlayback)
+  memoryMonitor.register('uploads',  uploadBytes)
 
 # Load all icons at startup.
 for file in os.listdir(iconPath):
@@ -888,6 +1565,25 @@ if dropboxAccessToken is None or dropboxAccessToken == 'None':
   dropboxAccessToken = 'YOUR_ACCESS_TOKEN'
   saveSettings()
 
+# Storage destinations from config.ini, pictures are sent to all of them
+destinations = storage.fromConfig(config, dropboxAccessToken)
+atexit.register(stopDestinations)
+atexit.register(stopTimelapseVideo, True)
+
+# Timelapse jobs, the timelapse button starts them instead of the single
+# timelapse when config.ini has [JOB:<name>] sections
+timelapseJobs = jobs.fromConfig(config)
+if timelapseJobs:
+  jobScheduler = jobs.Scheduler(timelapseJobs, config.getfloat('JOBS', 'coalesce', fallback=2.0))
+  jobWorker    = jobs.JobWorker(storeJobPicture, config.getint('JOBS', 'queue', fallback=4))
+  atexit.register(jobWorker.stop)
+
+# Thumbnail grid, one button per thumbnail
+gridSize = min(4, max(2, config.getint('GRID', 'size', fallback=3)))
+for i in range(gridSize * gridSize):
+  buttons[12].append(Button(((i % gridSize) * (320 // gridSize), (i // gridSize) * (188 // gridSize),
+                             320 // gridSize, 188 // gridSize), cb=gridCallback, value=10 + i))
+
 
 
 # Main loop ----------------------------------------------------------------
@@ -896,8 +1592,15 @@ while(True):
   
   # Process touchscreen input
   while True:
+    if controlApi: controlApi.process() # actions requested over http
+    if memoryMonitor: memoryMonitor.poll()
+    if jobScheduler and jobScheduler.ready(time.time()): break # a job picture is due
+    if burstCapture and not burstCapture.running(): break # burst done, finish it
     for event in pygame.event.get():
       if(event.type is MOUSEBUTTONDOWN):
+        if idleMonitor and idleMonitor.touch():
+          screenModePrior = -1 # redraw the screen
+          continue             # the first tap only wakes the screen
         pos = pygame.mouse.get_pos()
         for b in buttons[screenMode]:
           if b.selected(pos): break
@@ -905,30 +1608,87 @@ while(True):
     # and refresh the display to show the live preview.  In other modes
     # (image playback, etc.), stop and refresh the screen only when
     # screenMode changes.
-    if screenMode >= 3 or screenMode != screenModePrior: break
+    if idleMonitor and idleMonitor.check(timelapseStarted or not idleTimelapseOnly):
+      # idle: a pass once per interval or when a picture is due
+      if doTimelapsePicture or doMotionPicture or idleMonitor.due(): break
+      time.sleep(0.05)
+    elif screenMode == 12: # Thumbnail grid, refresh when thumbnails are made
+      if screenMode != screenModePrior or gridStale(): break
+    elif screenMode >= 3 or screenMode != screenModePrior or player: break
           
           
           
+  if doTimelapsePicture and timelapseStarted and motionGate and not motionSeen:
+    doTimelapsePicture = False # nothing changed since the last picture, skip
+  if timelapseStarted and adaptiveInterval:
+    adaptTimelapseInterval()
+  if timelapseStarted and meter and (screenMode < 3 or screenMode == 12 or (isIdle() and not previewNeeded())):
+    meter.update() # no viewfinder frames, the lock is renewed on schedule only
+  if burstCapture:
+    if timelapseStarted: timelapsePicturesTaken = burstCapture.captured
+    if not burstCapture.running():
+      if timelapseStarted: timelapseCallback(1) # burst complete, toggle timelapse to off
+      finishBurst()
+  if jobScheduler and timelapseStarted:
+    exposures = jobScheduler.due(time.time())
+    if exposures:
+      takeJobPictures(exposures)
+      timelapsePicturesTaken = jobScheduler.pictures()
+      if jobScheduler.finished():
+        timelapseCallback(1) # all jobs complete, toggle timelapse to off
   if doTimelapsePicture and timelapseStarted : # taking a timelapse picture
-    takePicture()
+    filename = takePicture(True)
+    if meter: meter.frameTaken()
+    if timelapseVideo and filename:
+      timelapseVideo.submit(os.path.basename(filename), lastPicture)
+    if timelapseSchedule:
+      timelapseSchedule.record(filename, timelapseTimerThread.interval, adaptiveInterval.level)
     doTimelapsePicture = False
     timelapsePicturesTaken +=1
     if timelapsePicturesTaken >= v['images']:
       timelapseCallback(1) #toggle timelapse to off
       # Refresh display
+  elif doMotionPicture: # motion detected in the viewfinder
+    doMotionPicture = False
+    if not motionGate: # a gating detector only sets motionSeen
+      takePicture()
+      motionDetector.reset() # viewfinder restarts, exposure may have changed
+  elif screenMode == 12: # Thumbnail grid, drawn below
+    img = None
+  elif isIdle() and not previewNeeded():
+    img = None # no viewfinder while idle
   elif screenMode >= 3: # Viewfinder or settings modes
-    stream = io.BytesIO() # Capture into in-memory stream
-    camera.capture(stream, use_video_port=True, format='rgb')
-    stream.seek(0)
-    stream.readinto(rgb)  # stream -> RGB buffer
-    stream.close()
+    viewfinderBuffer.rewind() # capture straight into the RGB buffer
+    with tracing.span('viewfinder', 'camera'):
+      camera.capture(viewfinderBuffer, use_video_port=True, format='rgb',
+                     resize=sizeData[sizeMode][1] if burstCapture or warmCapture else None)
     img = pygame.image.frombuffer(rgb[0:
     (sizeData[sizeMode][1][0] * sizeData[sizeMode][1][1] * 3)],
     sizeData[sizeMode][1], 'RGB')
+    if adaptiveInterval and timelapseStarted:
+      adaptiveInterval.feedPreview(rgb, sizeData[sizeMode][1])
+    if meter and timelapseStarted:
+      meter.update(rgb=rgb, size=sizeData[sizeMode][1])
+    if histogramOverlay and screenMode == 3:
+      histogramOverlay.update(rgb, sizeData[sizeMode][1])
+    if motionDetector and motionDetector.update(rgb, sizeData[sizeMode][1]):
+      motionSeen      = True
+      doMotionPicture = True
+  elif screenMode == 0 and player: # Sequence playback
+    player.wait()
+    img = player.frame() or scaled
+    if player.finished(): stopPlayback()
   elif screenMode < 2: # Playback mode or delete confirmation
     img = scaled       # Show last-loaded image
   else:                # 'No Photos' mode
     img = None         # You get nothing, good day sir
+
+  if isIdle():
+    if screenModePrior != -2: # blank the screen once
+      screen.fill(0)
+      pygame.display.update()
+      screenModePrior = -2
+    continue
         
   if img is None or img.get_height() < 240: # Letterbox, clear background
     screen.fill(0)
@@ -936,6 +1696,8 @@ while(True):
     screen.blit(img,
       ((320 - img.get_width() ) / 2,
        (240 - img.get_height()) / 2))
+  if screenMode == 12:
+    drawGrid()
     
   # Overlay buttons on display and update
   for i,b in enumerate(buttons[screenMode]):
@@ -956,11 +1718,25 @@ while(True):
     myfont = pygame.font.SysFont('Arial', 50)
     label = myfont.render(numberstring, 1, (255,255,255))
     screen.blit(label, (10,2))
+  if player and screenMode == 0:
+    myfont = pygame.font.SysFont('Arial', 20)
+    label = myfont.render('%.1f/%d fps  %d dropped' % (player.achievedFps(), player.fps, player.dropped), 1, (255,255,255))
+    screen.blit(label, (10,160))
+  if histogramOverlay and screenMode == 3:
+    histogramOverlay.draw(screen, (188, 4))
   if timelapseStarted and screenMode == 3:
     myfont = pygame.font.SysFont('Arial', 30)
-    label = myfont.render(str(timelapsePicturesTaken) + '/' + str(v['images']), 1, (255,255,255))
+    if jobScheduler:
+      label = myfont.render(str(timelapsePicturesTaken) + ' / ' + str(len(jobScheduler.jobs)) + ' jobs', 1, (255,255,255))
+    else:
+      label = myfont.render(str(timelapsePicturesTaken) + '/' + str(v['images']), 1, (255,255,255))
     screen.blit(label, (10,2))
+    if burstCapture:
+      stats = burstCapture.stats()
+      label = pygame.font.SysFont('Arial', 20).render('%.1f fps  %d dropped  %d queued' % (stats['fps'], stats['dropped'], stats['queued']), 1, (255,255,255))
+      screen.blit(label, (10,36))
   
-  pygame.display.update()
+  with tracing.span('display.update', 'ui'):
+    pygame.display.update()
       
   screenModePrior = screenMode
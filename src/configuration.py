@@ -26,12 +26,22 @@ in the main program, after wich they may only be read.
 
 
 import os,sys
+import atexit
 import collections
 import logging, logging.handlers
+import threading
 import configparser
+try:
+  import queue
+except ImportError:
+  import Queue as queue
 
 CONFIG = None       #configuration from config.ini
 LOGGING= None       #logging configuration from ini file
+LISTENER = None     #thread writing the queued log records
+
+QUEUE_SIZE = 1000   #log records waiting for the writer before records are dropped
+BATCH_SIZE = 50     #log records written per flush
 
 MESSAGE   = collections.namedtuple('message', 'sender receiver type subtype content')
 #------------------------------------------------------------------------------#
@@ -76,6 +86,166 @@ def get_LOGGING():
   global LOGGING
   return LOGGING
 #------------------------------------------------------------------------------#
+# QueueHandler: puts log records on a bounded queue for the QueueListener.     #
+#               Never blocks the logging thread, records are dropped and       #
+#               counted when the queue is full.                                #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class QueueHandler(logging.Handler):
+  def __init__(self, q):
+    logging.Handler.__init__(self)
+    self.queue   = q
+    self.dropped = 0
+
+  def emit(self, record):
+    # formatting (message, traceback) is left to the listener thread
+    try:
+      self.queue.put_nowait(record)
+    except queue.Full:
+      self.dropped += 1
+#------------------------------------------------------------------------------#
+# QueueListener: thread taking log records off the queue and handing them to  #
+#                the real handlers, flushing once per batch                    #
+#                                                                              #
+# Parameters: q         queue filled by a QueueHandler                         #
+#             handlers  handlers writing the records                           #
+#             source    the QueueHandler, to report dropped records            #
+#             batchSize records written per flush at most                      #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class QueueListener(threading.Thread):
+  STOP = None # sentinel ending the thread
+
+  def __init__(self, q, handlers, source, batchSize=BATCH_SIZE):
+    threading.Thread.__init__(self, name='log-writer')
+    self.daemon    = True
+    self.queue     = q
+    self.handlers  = handlers
+    self.source    = source
+    self.batchSize = batchSize
+    self.written   = 0
+    self.batches   = 0
+    self.reported  = 0  # dropped records already reported in the log
+
+  def run(self):
+    running = True
+    while running:
+      batch = [self.queue.get()]
+      while len(batch) < self.batchSize:
+        try:
+          batch.append(self.queue.get_nowait())
+        except queue.Empty:
+          break
+      if self.STOP in batch:
+        running = False
+        batch   = [r for r in batch if r is not self.STOP]
+      if self.source.dropped > self.reported:
+        batch.append(self.droppedRecord())
+      for record in batch:
+        for h in self.handlers:
+          if record.levelno >= h.level:
+            h.handle(record)
+      for h in self.handlers:
+        getattr(h, 'commit', h.flush)()
+      self.written += len(batch)
+      self.batches += 1
+
+  def droppedRecord(self):
+    dropped = self.source.dropped
+    record  = logging.LogRecord(self.source.name or 'log', logging.WARNING, __file__, 0,
+                                '%d log records dropped, queue full', (dropped - self.reported,), None, 'run')
+    self.reported = dropped
+    return record
+
+  def stop(self, timeout=5):
+    try:
+      self.queue.put(self.STOP, timeout=timeout)
+    except queue.Full:
+      pass
+    self.join(timeout)
+    for h in self.handlers:
+      h.close()
+
+  def stats(self):
+    return { 'queued' : self.queue.qsize(),
+             'written': self.written,
+             'batches': self.batches,
+             'dropped': self.source.dropped }
+#------------------------------------------------------------------------------#
+# BatchedRotatingFileHandler: rotating file handler leaving the flush to the   #
+#                             QueueListener, once per batch of records         #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class BatchedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+  def flush(self):
+    pass
+
+  def commit(self):
+    logging.handlers.RotatingFileHandler.flush(self)
+#------------------------------------------------------------------------------#
+# ModuleLevelFilter: passes records at or above the level configured for the  #
+#                    logger (or its closest parent) in log.ini                 #
+#                                                                              #
+# Parameters: levels  dict logger name -> level                                #
+#             default level for loggers not in levels                          #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class ModuleLevelFilter(logging.Filter):
+  def __init__(self, levels, default):
+    logging.Filter.__init__(self)
+    self.levels  = levels
+    self.default = default
+    self.cache   = {}
+
+  def level(self, name):
+    if name not in self.cache:
+      n = name
+      while n and n not in self.levels:
+        n = n.rpartition('.')[0]
+      self.cache[name] = self.levels.get(n, self.default)
+    return self.cache[name]
+
+  def filter(self, record):
+    return record.levelno >= self.level(record.name)
+#------------------------------------------------------------------------------#
+# RingBufferHandler: keeps the last records below the configured levels in    #
+#                    memory and writes them to the targets when an error is    #
+#                    logged, so the log shows what led up to it                #
+#                                                                              #
+# Parameters: capacity   records kept                                          #
+#             targets    handlers the records are written to on an error       #
+#             levels     ModuleLevelFilter of the targets, records it passes   #
+#                        are written anyway and not kept                       #
+#             flushLevel level that writes the ring buffer                     #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class RingBufferHandler(logging.Handler):
+  def __init__(self, capacity, targets, levels, flushLevel=logging.ERROR):
+    logging.Handler.__init__(self)
+    self.records    = collections.deque(maxlen=capacity)
+    self.targets    = targets
+    self.levels     = levels
+    self.flushLevel = flushLevel
+
+  def emit(self, record):
+    if record.levelno >= self.flushLevel:
+      for r in self.records:
+        for h in self.targets:
+          h.emit(r)
+      self.records.clear()
+    elif not self.levels.filter(record):
+      self.records.append(record)
+#------------------------------------------------------------------------------#
 # init: Read config.ini file                                                   #
 #                                                                              #
 #------------------------------------------------------------------------------#
@@ -114,6 +284,7 @@ def logging_configuration():
 # 1.00    hta 17.11.2013 Initial version                                       #
 #------------------------------------------------------------------------------#  
 def init_log(LOGGER):
+  global LISTENER
   bLogToFile   =False
   bLogToConsole=False
   
@@ -123,34 +294,70 @@ def init_log(LOGGER):
     bLogToFile = True
   if LOGGING.getboolean(LOGGER,'log_to_console'): 
     bLogToConsole = True
+  level = getattr(logging, LOGGING[LOGGER]['level'], logging.DEBUG)
+
+  # per module levels from sections such as [WEBCAM.storage]
+  levels = {}
+  for section in LOGGING.sections():
+    if section.startswith(LOGGER + '.') and LOGGING.has_option(section, 'level'):
+      levels[section] = getattr(logging, LOGGING[section]['level'], level)
+  levelFilter = ModuleLevelFilter(levels, level)
+
+  ringSize  = LOGGING.getint(LOGGER, 'ring_buffer', fallback=0)
+  ringLevel = getattr(logging, LOGGING.get(LOGGER, 'ring_level', fallback='DEBUG'), logging.DEBUG)
     
   #################
   # setup logging #
   #################
 
-  # create logger
+  # create logger, records below the lowest level are not even created
   logger = logging.getLogger(LOGGER)
-  logger.setLevel(logging.DEBUG)
+  lowest = min([level] + list(levels.values()) + ([ringLevel] if ringSize else []))
+  logger.setLevel(lowest)
+  for name, l in levels.items():
+    logging.getLogger(name).setLevel(min(l, ringLevel) if ringSize else l)
 
   # create formatter
   formatter = logging.Formatter('%(asctime)s - %(name)s - %(module)s.%(funcName)s - %(levelname)s - %(message)s')
+  handlers  = []
   
-  # create console handler and set level as per configuration
+  # create console handler, levels are checked by the filter
   if bLogToConsole == True:
     ch = logging.StreamHandler()
-    ch.setLevel(getattr(logging, LOGGING[LOGGER]['level'], None)) 
+    ch.addFilter(levelFilter)
     # add formatter to ch (console handler)
     ch.setFormatter(formatter)
-    # add ch and rfh (rotating filehandler to logger
-    logger.addHandler(ch)
+    handlers.append(ch)
   
-  # create rotating filehandler and set leval as per configuration
+  # create rotating filehandler, levels are checked by the filter
   # 10 files, each 10 megabytes.
   if bLogToFile == True:
-    rfh = logging.handlers.RotatingFileHandler('./log/'+LOGGER+'.log', 'a', (1024*1024*10), 10)  
-    rfh.setLevel(getattr(logging,  LOGGING[LOGGER]['level'], None))
+    rfh = BatchedRotatingFileHandler('./log/'+LOGGER+'.log', 'a', (1024*1024*10), 10)  
+    rfh.addFilter(levelFilter)
     #add formatter to rotating filehandler
     rfh.setFormatter(formatter)
-    #rfh (rotating filehandler to logger
-    logger.addHandler(rfh)
-  
+    handlers.append(rfh)
+
+  # ring buffer goes first so its records are written before the error
+  if ringSize and handlers:
+    rb = RingBufferHandler(ringSize, list(handlers), levelFilter)
+    rb.setLevel(ringLevel)
+    handlers.insert(0, rb)
+
+  # the logger only queues records, the listener thread does the writing
+  q  = queue.Queue(LOGGING.getint(LOGGER, 'queue_size', fallback=QUEUE_SIZE))
+  qh = QueueHandler(q)
+  qh.name = LOGGER
+  logger.addHandler(qh)
+  LISTENER = QueueListener(q, handlers, qh, LOGGING.getint(LOGGER, 'batch_size', fallback=BATCH_SIZE))
+  LISTENER.start()
+  atexit.register(LISTENER.stop)
+#------------------------------------------------------------------------------#
+# log_stats: counters of the log writer thread                                 #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def log_stats():
+  return LISTENER.stats() if LISTENER else {}
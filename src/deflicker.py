@@ -0,0 +1,273 @@
+#    Copyright 2014 Helios Taraba
+#
+#    This file provides the deflicker for timelapse sequences
+#
+#    deflicker.py is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    deflicker.py is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with deflicker.py.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Deflicker for timelapse sequences. The mean red, green and blue of every
+frame is measured on a small copy (the jpeg decoder scales down by 8) and
+compared with the smoothed means of the frames around it, the difference
+is applied as a gain per channel. Slow changes such as a sunset stay, the
+jumps from frame to frame go.
+
+Inline, as the timelapse video is built, the smoothing looks back over the
+last window frames only. As a batch job over a folder the window is
+centred on the frame, the frames are measured and corrected by a pool of
+processes, and the measurements are cached in a .deflicker.json file next
+to the pictures so another run with a different window only corrects:
+
+  python deflicker.py /home/pi/Photos --window 25
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import io
+import json
+import logging
+import multiprocessing
+import os
+import sys
+try:
+  import numpy
+except ImportError:
+  numpy = None
+try:
+  from PIL import Image
+except ImportError:
+  Image = None
+
+import playback
+
+logger     = logging.getLogger('WEBCAM.deflicker')
+CACHE_FILE = '.deflicker.json'
+STATS_SIZE = (160, 120) # measured on a copy about this size
+#------------------------------------------------------------------------------#
+# frameStats: mean (r, g, b) of a jpeg, file name or file object               #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def frameStats(source):
+  img = Image.open(source)
+  img.draft('RGB', STATS_SIZE) # decoder scales down, 1/8 of the pixels or less
+  pixels = numpy.asarray(img.convert('RGB'), numpy.float32).reshape(-1, 3)
+  return [float(x) for x in pixels.mean(axis=0)]
+#------------------------------------------------------------------------------#
+# gains: per channel gain (r, g, b) moving stats towards target                #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def gains(stats, target, maxGain):
+  g = numpy.asarray(target, numpy.float64) / numpy.maximum(numpy.asarray(stats, numpy.float64), 1.0)
+  return [float(x) for x in numpy.clip(g, 1.0 / maxGain, maxGain)]
+#------------------------------------------------------------------------------#
+# smooth: centred moving geometric mean of n x 3 stats over window frames,     #
+#         shorter at both ends of the sequence                                 #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def smooth(stats, window):
+  logs = numpy.log(numpy.maximum(numpy.asarray(stats, numpy.float64), 1.0))
+  n    = len(logs)
+  half = window // 2
+  sums = numpy.vstack([numpy.zeros((1, 3)), numpy.cumsum(logs, axis=0)])
+  lo   = numpy.clip(numpy.arange(n) - half, 0, n)
+  hi   = numpy.clip(numpy.arange(n) + half + 1, 0, n)
+  return numpy.exp((sums[hi] - sums[lo]) / (hi - lo)[:, None])
+#------------------------------------------------------------------------------#
+# correct: jpeg of source with the gains applied                               #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def correct(source, channelGains, quality=90):
+  img   = Image.open(source).convert('RGB')
+  table = []
+  for g in channelGains: # lookup table per channel, applied by PIL in C
+    table.extend(min(255, int(i * g + 0.5)) for i in range(256))
+  out = io.BytesIO()
+  img.point(table).save(out, 'JPEG', quality=quality)
+  return out.getvalue()
+#------------------------------------------------------------------------------#
+# StatsCache: frame stats of a folder, valid while a picture is unchanged      #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class StatsCache(object):
+  def __init__(self, path):
+    self.filename = os.path.join(path, CACHE_FILE)
+    self.entries  = {}  # picture name -> [mtime, size, r, g, b]
+    self.changed  = False
+    try:
+      with open(self.filename) as f:
+        self.entries = json.load(f)
+    except (IOError, OSError, ValueError):
+      pass
+
+  def key(self, filename):
+    st = os.stat(filename)
+    return [int(st.st_mtime), st.st_size]
+
+  def get(self, filename):
+    e = self.entries.get(os.path.basename(filename))
+    if e and e[:2] == self.key(filename):
+      return e[2:]
+    return None
+
+  def put(self, filename, stats):
+    self.entries[os.path.basename(filename)] = self.key(filename) + list(stats)
+    self.changed = True
+
+  def save(self):
+    if not self.changed:
+      return
+    tmp = self.filename + '.tmp'
+    with open(tmp, 'w') as f:
+      json.dump(self.entries, f, sort_keys=True)
+    os.rename(tmp, self.filename)
+    self.changed = False
+#------------------------------------------------------------------------------#
+# correctFile: worker of the batch job, (source, target, gains, quality)       #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def correctFile(job):
+  source, target, channelGains, quality = job
+  data = correct(source, channelGains, quality)
+  with open(target, 'wb') as f:
+    f.write(data)
+  st = os.stat(source)
+  os.utime(target, (st.st_atime, st.st_mtime))
+  return len(data)
+#------------------------------------------------------------------------------#
+# deflickerFolder: deflicker the IMG_XXXX.JPG pictures of source into target,  #
+#                  returns the number of pictures and how many were measured   #
+#                                                                              #
+# Parameters: source   folder with the pictures                                #
+#             target   folder for the corrected pictures                       #
+#             window   frames smoothed over                                    #
+#             maxGain  largest correction per channel                          #
+#             workers  processes measuring and correcting                      #
+#             quality  jpeg quality of the corrected pictures                  #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def deflickerFolder(source, target, window=15, maxGain=1.5, workers=None, quality=90):
+  if numpy is None or Image is None:
+    raise ImportError('deflicker requires numpy and PIL')
+  files = playback.sequence(source)
+  if not files:
+    return 0, 0
+  if not os.path.isdir(target):
+    os.makedirs(target)
+  cache   = StatsCache(source)
+  missing = [f for f in files if cache.get(f) is None]
+  pool    = multiprocessing.Pool(workers or multiprocessing.cpu_count())
+  try:
+    for f, s in zip(missing, pool.map(frameStats, missing)):
+      cache.put(f, s)
+    cache.save()
+    stats   = [cache.get(f) for f in files]
+    targets = smooth(stats, window)
+    jobs    = [(f, os.path.join(target, os.path.basename(f)), gains(s, t, maxGain), quality)
+               for f, s, t in zip(files, stats, targets)]
+    pool.map(correctFile, jobs)
+  finally:
+    pool.close()
+    pool.join()
+  return len(files), len(missing)
+#------------------------------------------------------------------------------#
+# Deflicker: inline deflicker of frames as they arrive, smoothed over the last #
+#            window frames                                                     #
+#                                                                              #
+# Parameters: window   frames smoothed over                                    #
+#             maxGain  largest correction per channel                          #
+#             quality  jpeg quality of the corrected frames                    #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class Deflicker(object):
+  def __init__(self, window=15, maxGain=1.5, quality=90):
+    if numpy is None or Image is None:
+      raise ImportError('deflicker requires numpy and PIL')
+    self.window  = window
+    self.maxGain = maxGain
+    self.quality = quality
+    self.history = collections.deque(maxlen=window) # log stats of the last frames
+    self.last    = None
+
+  def correct(self, data):
+    """Corrected jpeg of a jpeg frame."""
+    stats = frameStats(io.BytesIO(data))
+    self.history.append(numpy.log(numpy.maximum(stats, 1.0)))
+    target    = numpy.exp(numpy.mean(self.history, axis=0))
+    self.last = gains(stats, target, self.maxGain)
+    return correct(io.BytesIO(data), self.last, self.quality)
+#------------------------------------------------------------------------------#
+# DeflickerBackend: storage backend correcting every frame before handing it   #
+#                   on to another backend, e.g. the timelapse video            #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class DeflickerBackend(object):
+  def __init__(self, backend, deflicker):
+    self.backend   = backend
+    self.deflicker = deflicker
+    self.metered   = backend.metered
+
+  def put(self, remote, data):
+    self.backend.put(remote, self.deflicker.correct(data))
+
+  def close(self):
+    self.backend.close()
+#------------------------------------------------------------------------------#
+# main: deflicker a folder from the command line                               #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='deflicker a timelapse written by cam.py')
+  parser.add_argument('source')
+  parser.add_argument('--target',   help='folder for the corrected pictures (default <source>/deflickered)')
+  parser.add_argument('--window',   type=int,   default=15,  help='frames smoothed over (default 15)')
+  parser.add_argument('--max-gain', type=float, default=1.5, help='largest correction per channel (default 1.5)')
+  parser.add_argument('--workers',  type=int,   help='processes (default one per cpu)')
+  parser.add_argument('--quality',  type=int,   default=90,  help='jpeg quality (default 90)')
+  args = parser.parse_args(argv)
+  target = args.target or os.path.join(args.source, 'deflickered')
+  total, measured = deflickerFolder(args.source, target, args.window, args.max_gain, args.workers, args.quality)
+  print('%d pictures deflickered into %s, %d measured, %d from %s' %
+        (total, target, measured, total - measured, CACHE_FILE))
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
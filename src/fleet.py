@@ -0,0 +1,359 @@
+#    Copyright 2014 Helios Taraba
+#
+#    This file provides the fleet transport to a central collector
+#
+#    fleet.py is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    fleet.py is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with fleet.py.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Fleet transport: every camera keeps one TCP connection to a collector and
+sends its pictures over it in batches, small webcam images are collected
+for up to a second and go together in one batch.
+
+The protocol is a few fixed size binary headers (network byte order):
+
+  camera    -> collector  HELLO 'FLT1', session (Q), id length (H), id
+  collector -> camera     RSUM  'RSUM', last sequence number stored (Q)
+  camera    -> collector  BATCH 'BTCH', frame count (I), then per frame
+                                sequence (Q), time (d), name length (H),
+                                data length (I), name, jpeg
+  collector -> camera     ACK   'ACK ', last sequence number stored (Q)
+
+Every picture gets a sequence number, the camera keeps a picture until the
+collector acknowledged it. After a lost connection the camera reconnects,
+the collector tells in RSUM what it already stored and the camera sends
+the rest again, a picture is not stored twice while the collector runs.
+The session is the time the camera started, sequence numbers count from 1
+per session.
+
+The reference collector stores the pictures of every camera in its own
+folder, with a frames.csv log of all pictures received:
+
+  python fleet.py collect --port 9000 --root /srv/fleet
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import logging
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+try:
+  import socketserver
+except ImportError:
+  import SocketServer as socketserver
+
+logger = logging.getLogger('WEBCAM.fleet')
+HELLO  = struct.Struct('>4sQH')
+REPLY  = struct.Struct('>4sQ')   # RSUM and ACK
+BATCH  = struct.Struct('>4sI')
+FRAME  = struct.Struct('>QdHI')
+MAGIC  = b'FLT1'
+#------------------------------------------------------------------------------#
+# recvAll: exactly n bytes from a socket                                       #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def recvAll(sock, n):
+  chunks = []
+  while n:
+    chunk = sock.recv(min(n, 65536))
+    if not chunk:
+      raise EOFError('connection closed')
+    chunks.append(chunk)
+    n -= len(chunk)
+  return b''.join(chunks)
+#------------------------------------------------------------------------------#
+# readReply: RSUM or ACK, returns the sequence number                          #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def readReply(sock, expected):
+  tag, seq = REPLY.unpack(recvAll(sock, REPLY.size))
+  if tag != expected:
+    raise IOError('fleet protocol error, ' + repr(expected) + ' expected, got ' + repr(tag))
+  return seq
+#------------------------------------------------------------------------------#
+# FleetClient: sends pictures to the collector from a background thread        #
+#                                                                              #
+# Parameters: host, port  collector                                            #
+#             cameraId    name of this camera at the collector                 #
+#             batchBytes  pictures smaller than this wait to be batched        #
+#             batchDelay  longest wait in seconds for a batch to fill          #
+#             maxQueued   pictures kept until acknowledged, more are refused   #
+#             timeout     socket timeout in seconds                            #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class FleetClient(object):
+  MAX_BACKOFF = 30 # seconds between reconnects at most
+
+  def __init__(self, host, port, cameraId, batchBytes=256 * 1024, batchDelay=1.0, maxQueued=256, timeout=30):
+    self.address    = (host, port)
+    self.cameraId   = cameraId.encode('utf-8')
+    self.session    = int(time.time() * 1000)
+    self.batchBytes = batchBytes
+    self.batchDelay = batchDelay
+    self.maxQueued  = maxQueued
+    self.timeout    = timeout
+    self.cond       = threading.Condition()
+    self.pending    = collections.deque() # (seq, time, name, data) not acknowledged yet
+    self.seq        = 0       # last sequence number given out
+    self.sent       = 0       # highest sequence number sent, below it is resent
+    self.sock       = None
+    self.running    = True
+    self.counters   = { 'queued': 0, 'acked': 0, 'bytes': 0, 'batches': 0,
+                        'resent': 0, 'reconnects': 0, 'refused': 0 }
+    self.thread     = threading.Thread(target=self.run, name='FLEET')
+    self.thread.daemon = True
+    self.thread.start()
+
+  def send(self, name, data, when=None):
+    """Queue a picture, raises IOError when too many are waiting."""
+    with self.cond:
+      if len(self.pending) >= self.maxQueued:
+        self.counters['refused'] += 1
+        raise IOError('fleet queue full, collector ' + '%s:%d' % self.address + ' not keeping up')
+      self.seq += 1
+      self.pending.append((self.seq, time.time() if when is None else when, name, data))
+      self.counters['queued'] += 1
+      self.cond.notify()
+
+  def connect(self):
+    sock = socket.create_connection(self.address, self.timeout)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.sendall(HELLO.pack(MAGIC, self.session, len(self.cameraId)) + self.cameraId)
+    stored = readReply(sock, b'RSUM')
+    self.acknowledge(stored)
+    with self.cond:
+      self.counters['resent'] += len([p for p in self.pending if p[0] <= self.sent])
+    logger.info('fleet connected to %s:%d, collector has %d' % (self.address + (stored,)))
+    self.sock = sock
+
+  def acknowledge(self, seq):
+    with self.cond:
+      while self.pending and self.pending[0][0] <= seq:
+        self.pending.popleft()
+        self.counters['acked'] += 1
+
+  def nextBatch(self):
+    """Pictures for the next batch, waits for small pictures to add up."""
+    with self.cond:
+      while self.running and not self.pending:
+        self.cond.wait(1.0)
+      if not self.running:
+        return []
+      first = time.time()
+      while self.running:
+        size = sum(len(p[3]) for p in self.pending)
+        wait = self.batchDelay - (time.time() - first)
+        if size >= self.batchBytes or wait <= 0:
+          break
+        self.cond.wait(wait)
+      batch, size = [], 0
+      for p in self.pending:
+        if batch and size + len(p[3]) > self.batchBytes:
+          break
+        batch.append(p)
+        size += len(p[3])
+      return batch
+
+  def sendBatch(self, batch):
+    parts = [BATCH.pack(b'BTCH', len(batch))]
+    for seq, when, name, data in batch:
+      n = name.encode('utf-8')
+      parts.append(FRAME.pack(seq, when, len(n), len(data)))
+      parts.append(n)
+      parts.append(data)
+    self.sent = max(self.sent, batch[-1][0])
+    self.sock.sendall(b''.join(parts))
+    self.acknowledge(readReply(self.sock, b'ACK '))
+    with self.cond:
+      self.counters['batches'] += 1
+      self.counters['bytes']   += sum(len(p[3]) for p in batch)
+
+  def run(self):
+    failures = 0
+    while self.running:
+      try:
+        if self.sock is None:
+          self.connect()
+          failures = 0
+        batch = self.nextBatch()
+        if batch:
+          self.sendBatch(batch)
+      except (socket.error, EOFError, IOError) as e:
+        self.close()
+        failures += 1
+        with self.cond:
+          self.counters['reconnects'] += 1
+        delay = min(self.MAX_BACKOFF, 2 ** min(failures, 5))
+        logger.warning('fleet connection to %s:%d lost (%s), retry in %ds' % (self.address + (e, delay)))
+        with self.cond:
+          self.cond.wait(delay)
+    self.close()
+
+  def close(self):
+    if self.sock:
+      try:
+        self.sock.close()
+      except socket.error:
+        pass
+      self.sock = None
+
+  def stop(self, timeout=5):
+    """Give the pictures waiting timeout seconds to go out, then stop."""
+    end = time.time() + timeout
+    while self.pending and time.time() < end:
+      time.sleep(0.1)
+    with self.cond:
+      self.running = False
+      self.cond.notify_all()
+    self.thread.join(timeout)
+
+  def stats(self):
+    with self.cond:
+      d = dict(self.counters)
+      d['waiting']   = len(self.pending)
+      d['connected'] = self.sock is not None
+    return d
+#------------------------------------------------------------------------------#
+# FleetBackend: storage backend handing pictures to a FleetClient, the         #
+#               pictures go out in the client's own thread                     #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class FleetBackend(object):
+  metered = True
+
+  def __init__(self, host, port, cameraId=None, batchBytes=256 * 1024, batchDelay=1.0, maxQueued=256):
+    self.client = FleetClient(host, port, cameraId or socket.gethostname(), batchBytes, batchDelay, maxQueued)
+
+  def put(self, remote, data):
+    self.client.send(remote, data)
+
+  def close(self):
+    self.client.stop()
+#------------------------------------------------------------------------------#
+# Collector: stores the pictures of every camera below root/<camera id>        #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class Collector(socketserver.ThreadingTCPServer):
+  allow_reuse_address = True
+  daemon_threads      = True
+
+  def __init__(self, address, root):
+    socketserver.ThreadingTCPServer.__init__(self, address, CollectorHandler)
+    self.root     = root
+    self.lock     = threading.Lock()
+    self.sessions = {} # (camera id, session) -> last sequence number stored
+
+  def folder(self, cameraId):
+    # camera ids are names, never paths
+    safe = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in cameraId).lstrip('.') or '_'
+    path = os.path.join(self.root, safe)
+    if not os.path.isdir(path):
+      os.makedirs(path)
+    return path
+
+  def store(self, folder, seq, when, name, data):
+    filename = os.path.join(folder, os.path.normpath(name).lstrip(os.sep).replace('..', '_'))
+    if not os.path.isdir(os.path.dirname(filename)):
+      os.makedirs(os.path.dirname(filename))
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+      f.write(data)
+    os.rename(tmp, filename)
+    with open(os.path.join(folder, 'frames.csv'), 'a') as f:
+      f.write('%d,%.3f,%s,%d\n' % (seq, when, name, len(data)))
+#------------------------------------------------------------------------------#
+# CollectorHandler: one camera connection                                      #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class CollectorHandler(socketserver.BaseRequestHandler):
+  def handle(self):
+    sock   = self.request
+    server = self.server
+    try:
+      magic, session, n = HELLO.unpack(recvAll(sock, HELLO.size))
+      if magic != MAGIC:
+        return
+      cameraId = recvAll(sock, n).decode('utf-8')
+      key      = (cameraId, session)
+      folder   = server.folder(cameraId)
+      with server.lock:
+        stored = server.sessions.get(key, 0)
+      sock.sendall(REPLY.pack(b'RSUM', stored))
+      while True:
+        tag, count = BATCH.unpack(recvAll(sock, BATCH.size))
+        if tag != b'BTCH':
+          raise IOError('batch expected from ' + cameraId)
+        for i in range(count):
+          seq, when, nameLen, dataLen = FRAME.unpack(recvAll(sock, FRAME.size))
+          name = recvAll(sock, nameLen).decode('utf-8')
+          data = recvAll(sock, dataLen)
+          if seq > stored: # resent after a lost ACK, stored already
+            server.store(folder, seq, when, name, data)
+            stored = seq
+        with server.lock:
+          server.sessions[key] = stored
+        sock.sendall(REPLY.pack(b'ACK ', stored))
+    except EOFError:
+      pass
+    except Exception:
+      logger.error('fleet connection from %s failed' % (self.client_address,), exc_info=True)
+#------------------------------------------------------------------------------#
+# main: run the reference collector                                            #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='fleet collector for cameras running cam.py')
+  sub    = parser.add_subparsers(dest='command')
+  p = sub.add_parser('collect', help='receive pictures and store them below root')
+  p.add_argument('--port', type=int, default=9000)
+  p.add_argument('--root', default='./fleet')
+  args = parser.parse_args(argv)
+  if args.command != 'collect':
+    parser.print_help()
+    return 0
+  logging.basicConfig(level=logging.INFO)
+  server = Collector(('', args.port), args.root)
+  print('fleet collector on port %d, storing below %s' % (args.port, args.root))
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
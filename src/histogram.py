@@ -0,0 +1,119 @@
+#    Copyright 2014 Helios Taraba
+#
+#    This file provides the live histogram overlay of the viewfinder
+#
+#    histogram.py is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    histogram.py is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with histogram.py.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Live histogram on the viewfinder. The histogram is counted with numpy on a
+strided subsample of the viewfinder buffer (every 4th pixel of every 4th
+row), as luminance or as separate red, green and blue curves, and drawn
+into a small half transparent surface together with clipping warnings:
+the share of pixels at the top (clipped highlights) or bottom (crushed
+shadows) of the range. The surface is recomputed every few frames only,
+in between the cached one is drawn again.
+"""
+try:
+  import numpy
+except ImportError:
+  numpy = None
+try:
+  import pygame
+except ImportError:
+  pygame = None
+
+MODES = ('luma', 'rgb')
+#------------------------------------------------------------------------------#
+# histograms: 256 bin histograms of a strided subsample of an rgb buffer,      #
+#             one row for luma, three (r, g, b) for rgb, and the pixel count   #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def histograms(rgb, size, mode='luma', step=4):
+  w, h  = size
+  frame = numpy.frombuffer(rgb, numpy.uint8, w * h * 3).reshape(h, w, 3)
+  sub   = frame[::step, ::step]
+  if mode == 'luma':
+    s    = sub.astype(numpy.uint16)
+    luma = (s[..., 0] * 77 + s[..., 1] * 150 + s[..., 2] * 29) >> 8
+    return numpy.bincount(luma.ravel(), minlength=256)[None, :], luma.size
+  return numpy.vstack([numpy.bincount(sub[..., c].ravel(), minlength=256) for c in range(3)]), sub.shape[0] * sub.shape[1]
+#------------------------------------------------------------------------------#
+# HistogramOverlay: cached histogram surface for the viewfinder               #
+#                                                                              #
+# Parameters: mode      'luma' or 'rgb'                                        #
+#             every     recompute every n-th frame                             #
+#             step      subsample factor in both directions                    #
+#             size      (w, h) of the overlay, w must divide 256               #
+#             clip      share of pixels at either end that shows a warning     #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class HistogramOverlay(object):
+  COLORS = { 'luma': [(230, 230, 230)], 'rgb': [(255, 60, 60), (60, 255, 60), (80, 80, 255)] }
+  HIGH   = 250 # values from here on count as clipped highlights
+  LOW    = 5   # values up to here count as crushed shadows
+
+  def __init__(self, mode='luma', every=5, step=4, size=(128, 64), clip=0.02):
+    if numpy is None:
+      raise ImportError('histogram overlay requires numpy')
+    if mode not in MODES:
+      raise ValueError('histogram mode must be one of ' + ', '.join(MODES))
+    self.mode     = mode
+    self.every    = max(1, every)
+    self.step     = step
+    self.size     = size
+    self.clip     = clip
+    self.frames   = 0
+    self.surface  = None
+    self.font     = None
+    self.clipped  = (0.0, 0.0) # share of shadows, highlights clipped
+
+  def update(self, rgb, size):
+    """Count a viewfinder frame, recompute every n-th one."""
+    if self.frames % self.every == 0:
+      self.render(*histograms(rgb, size, self.mode, self.step))
+    self.frames += 1
+
+  def render(self, hist, count):
+    w, h  = self.size
+    low   = float(hist[:, :self.LOW + 1].sum(axis=1).max()) / count
+    high  = float(hist[:, self.HIGH:].sum(axis=1).max()) / count
+    self.clipped = (low, high)
+    cols  = hist.reshape(len(hist), w, 256 // w).sum(axis=2).astype(numpy.float32)
+    top   = max(1.0, float(cols[:, 1:-1].max())) # the end bins would dwarf the rest
+    ys    = (h - 1) - numpy.minimum(cols / top, 1.0) * (h - 12)
+    if self.surface is None:
+      self.surface = pygame.Surface(self.size, pygame.SRCALPHA)
+      self.font    = pygame.font.SysFont('Arial', 11)
+    s = self.surface
+    s.fill((0, 0, 0, 120))
+    for row, color in zip(ys, self.COLORS[self.mode]):
+      points = list(zip(range(w), [int(y) for y in row]))
+      if self.mode == 'luma':
+        pygame.draw.polygon(s, color, [(0, h - 1)] + points + [(w - 1, h - 1)])
+      else:
+        pygame.draw.lines(s, color, False, points)
+    if low >= self.clip:
+      s.blit(self.font.render('dark %d%%' % round(low * 100), 1, (120, 160, 255)), (2, 0))
+    if high >= self.clip:
+      label = self.font.render('clip %d%%' % round(high * 100), 1, (255, 80, 80))
+      s.blit(label, (w - label.get_width() - 2, 0))
+
+  def draw(self, screen, pos):
+    if self.surface is not None:
+      screen.blit(self.surface, pos)
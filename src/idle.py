@@ -0,0 +1,129 @@
+#    Copyright 2014 Helios Taraba
+#
+#    This file provides the idle mode for unattended timelapses
+#
+#    idle.py is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    idle.py is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with idle.py.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Idle mode: after some minutes without a touch the screen is blanked (and
+the backlight switched off where the kernel offers it), the viewfinder
+stops and the main loop runs only about once a second to take the
+timelapse pictures. The first tap wakes the screen and is not handed on to
+the buttons.
+
+The process CPU time is accounted separately for the active and the idle
+state, stats() reports both as percent of one core.
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger('WEBCAM.idle')
+#------------------------------------------------------------------------------#
+# cpuTime: user and system seconds of this process, all threads                #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def cpuTime():
+  t = os.times()
+  return t[0] + t[1]
+#------------------------------------------------------------------------------#
+# IdleMonitor: decides when the camera is idle and accounts the CPU used       #
+#                                                                              #
+# Parameters: timeout    seconds without a touch before going idle             #
+#             interval   seconds between main loop passes while idle          #
+#             backlight  sysfs brightness file of the display, None to blank  #
+#                        the screen only                                       #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class IdleMonitor(object):
+  def __init__(self, timeout=300, interval=1.0, backlight=None):
+    now            = time.time()
+    self.timeout   = timeout
+    self.interval  = interval
+    self.backlight = backlight if backlight and os.path.exists(backlight) else None
+    self.on        = None     # brightness before switching off
+    self.idle      = False
+    self.last      = now      # last touch
+    self.lastPass  = 0        # last main loop pass while idle
+    self.wakeups   = 0
+    self.lock      = threading.Lock() # stats() runs on the api's threads
+    self.mark      = (now, cpuTime())
+    self.totals    = { 'active': [0.0, 0.0], 'idle': [0.0, 0.0] } # wall, cpu seconds
+
+  def account(self):
+    with self.lock:
+      now, cpu  = time.time(), cpuTime()
+      t         = self.totals['idle' if self.idle else 'active']
+      t[0]     += now - self.mark[0]
+      t[1]     += cpu - self.mark[1]
+      self.mark = (now, cpu)
+
+  def touch(self):
+    """A tap, returns True when it only woke the screen up."""
+    self.last = time.time()
+    if not self.idle:
+      return False
+    self.account()
+    self.idle     = False
+    self.wakeups += 1
+    self.setBacklight(True)
+    logger.info('active')
+    return True
+
+  def check(self, allowed=True):
+    """True while idle, goes idle after timeout without a touch when allowed."""
+    if not self.idle and allowed and self.timeout and time.time() - self.last >= self.timeout:
+      self.account()
+      self.idle = True
+      self.setBacklight(False)
+      logger.info('idle after ' + str(int(time.time() - self.last)) + 's without touch')
+    return self.idle
+
+  def due(self):
+    """While idle: True once per interval, time for a main loop pass."""
+    now = time.time()
+    if now - self.lastPass >= self.interval:
+      self.lastPass = now
+      return True
+    return False
+
+  def setBacklight(self, on):
+    if not self.backlight:
+      return
+    try:
+      if not on:
+        with open(self.backlight) as f:
+          self.on = f.read().strip() or '1'
+      with open(self.backlight, 'w') as f:
+        f.write((self.on or '1') if on else '0')
+    except (IOError, OSError):
+      logger.warning('cannot switch backlight ' + self.backlight, exc_info=True)
+      self.backlight = None
+
+  def stats(self):
+    self.account()
+    with self.lock:
+      cpu = dict((state, round(100.0 * c / w, 1) if w else None) for state, (w, c) in self.totals.items())
+    return { 'idle'         : self.idle,
+             'cpuPercent'   : cpu,
+             'idleSeconds'  : int(self.totals['idle'][0]),
+             'activeSeconds': int(self.totals['active'][0]),
+             'wakeups'      : self.wakeups }
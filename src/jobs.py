@@ -0,0 +1,330 @@
+#    Copyright 2014 Helios Taraba
+#
+#    This file provides several timelapse jobs sharing the camera
+#
+#    jobs.py is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    jobs.py is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with jobs.py.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Timelapse jobs: several timelapses at once on one camera, each from a
+[JOB:<name>] section of config.ini with its own interval, number of
+pictures, size, jpeg quality, stacked frames, folder and storage
+destinations, e.g. a full size picture every 5 minutes for the archive, a
+640x480 one every 30 seconds for the web page and a stacked one every hour.
+
+The Scheduler is polled by the main loop of cam.py, which owns the camera,
+so only one capture runs at a time. Every job keeps the grid of its start
+time: a picture taken late does not shift the following ones, and when a
+job falls behind by whole intervals those pictures are skipped and counted
+as missed. Jobs due within coalesce seconds of each other share one
+exposure (one per number of stacked frames) at the size and quality of
+the largest of them, the other pictures are scaled from it.
+
+Lateness is the time from the scheduled moment to the start of the
+exposure, negative when a job was taken early to share an exposure.
+
+The pictures of an exposure are scaled, saved and sent by a JobWorker
+thread, the main loop only captures, so the next exposure is not held up
+by the jpeg encoding.
+"""
+import io
+import logging
+import os
+import threading
+try:
+  import queue
+except ImportError:
+  import Queue as queue
+try:
+  from PIL import Image
+except ImportError:
+  Image = None
+try:
+  import pygame
+except ImportError:
+  pygame = None
+
+logger = logging.getLogger('WEBCAM.jobs')
+#------------------------------------------------------------------------------#
+# Job: one timelapse of the schedule                                           #
+#                                                                              #
+# Parameters: name          name of the job, default folder name               #
+#             interval      seconds between pictures                           #
+#             images        pictures to take, 0 until stopped                  #
+#             resize        (w, h) of the pictures, None full size             #
+#             quality       jpeg quality, None the camera's default            #
+#             stack         frames stacked per picture, 0 the [STACK] setting  #
+#             folder        folder the pictures are saved in, None a folder    #
+#                           named after the job below the storage folder      #
+#             save          save the pictures in folder, else only send them   #
+#             destinations  names of [STORAGE:<name>] destinations             #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class Job(object):
+  def __init__(self, name, interval, images=0, resize=None, quality=None, stack=0, folder=None, save=True,
+               destinations=()):
+    if interval <= 0:
+      raise ValueError('job ' + name + ': interval must be > 0')
+    self.name         = name
+    self.interval     = float(interval)
+    self.images       = images
+    self.resize       = resize
+    self.quality      = quality
+    self.stack        = stack
+    self.folder       = folder
+    self.target       = folder # folder of this run, set by Scheduler.start
+    self.save         = save
+    self.destinations = list(destinations)
+    self.reset(0)
+
+  def reset(self, now):
+    self.next    = now   # scheduled time of the next picture
+    self.taken   = 0
+    self.missed  = 0
+    self.index   = None  # number of the next IMG_XXXX.JPG in folder
+    self.late    = [0.0, None, None] # seconds late in total, largest, last
+
+  def finished(self):
+    return bool(self.images) and self.taken >= self.images
+
+  def area(self):
+    return self.resize[0] * self.resize[1] if self.resize else float('inf')
+
+  def stats(self, now):
+    total, largest, last = self.late
+    return { 'interval': self.interval,
+             'images'  : self.images,
+             'taken'   : self.taken,
+             'missed'  : self.missed,
+             'nextS'   : None if self.finished() else round(self.next - now, 1),
+             'lateMs'  : { 'avg' : int(total * 1000 / self.taken) if self.taken else None,
+                           'max' : None if largest is None else int(largest * 1000),
+                           'last': None if last is None else int(last * 1000) } }
+#------------------------------------------------------------------------------#
+# Exposure: one capture shared by several jobs                                 #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class Exposure(object):
+  def __init__(self, jobs):
+    self.jobs    = sorted(jobs, key=Job.area, reverse=True)
+    self.resize  = self.jobs[0].resize  # the largest job decides, the others
+    self.quality = self.jobs[0].quality # are scaled from its picture
+    self.stack   = self.jobs[0].stack
+
+  def options(self):
+    """Keyword arguments of cam.py's captureStill."""
+    options = { 'resize': self.resize, 'quality': self.quality }
+    if self.stack:
+      options['frames'] = self.stack
+    return options
+
+  def needsCopy(self, job):
+    return job.resize != self.resize or (job.quality or None) != self.quality
+#------------------------------------------------------------------------------#
+# Scheduler: decides which jobs are due and groups them into exposures         #
+#                                                                              #
+# Parameters: jobs      list of Job                                            #
+#             coalesce  jobs due within this many seconds share an exposure    #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class Scheduler(object):
+  def __init__(self, jobs, coalesce=2.0):
+    self.jobs      = jobs
+    self.coalesce  = coalesce
+    self.running   = False
+    self.exposures = 0
+    self.shared    = 0 # pictures taken from another job's exposure
+
+  def start(self, now, folder):
+    """Start all jobs now, jobs without folder save below folder/<name>."""
+    for job in self.jobs:
+      job.reset(now)
+      job.target = job.folder or os.path.join(folder, job.name)
+    self.exposures = 0
+    self.shared    = 0
+    self.running   = True
+
+  def stop(self):
+    self.running = False
+
+  def ready(self, now):
+    return self.running and any(not j.finished() and j.next <= now for j in self.jobs)
+
+  def due(self, now):
+    """Exposures to take now: jobs due, plus those due within coalesce."""
+    if not self.ready(now):
+      return []
+    jobs   = [j for j in self.jobs if not j.finished() and j.next <= now + self.coalesce]
+    groups = {}
+    for j in jobs:
+      groups.setdefault(j.stack, []).append(j)
+    return [Exposure(groups[k]) for k in sorted(groups)]
+
+  def taken(self, job, start, now):
+    """A picture of job whose exposure started at start, schedule the next."""
+    late = start - job.next
+    job.late[0] += late
+    job.late[1]  = late if job.late[1] is None else max(job.late[1], late)
+    job.late[2]  = late
+    job.taken   += 1
+    job.next    += job.interval
+    while job.next <= now - self.coalesce: # behind by whole intervals, skip them
+      job.next   += job.interval
+      job.missed += 1
+    if late > max(1.0, job.interval / 10):
+      logger.warning('job %s picture %d was %.1fs late' % (job.name, job.taken, late))
+
+  def skip(self, job, now):
+    """The picture of job failed, count it as missed and schedule the next."""
+    while job.next <= now:
+      job.next   += job.interval
+      job.missed += 1
+
+  def finished(self):
+    return all(j.finished() for j in self.jobs)
+
+  def pictures(self):
+    return sum(j.taken for j in self.jobs)
+
+  def stats(self, now):
+    return { 'running'  : self.running,
+             'exposures': self.exposures,
+             'shared'   : self.shared,
+             'jobs'     : dict((j.name, j.stats(now)) for j in self.jobs) }
+#------------------------------------------------------------------------------#
+# JobWorker: makes the pictures of the jobs from their exposures on a thread   #
+#            of its own                                                        #
+#                                                                              #
+# Parameters: store      store(job, jpeg, extra) saves and sends a picture,    #
+#                        extra is handed to the first full size job that saves #
+#             queueSize  exposures waiting before new ones are dropped         #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class JobWorker(object):
+  STOP = None # sentinel for the thread
+
+  def __init__(self, store, queueSize=4):
+    self.store    = store
+    self.queue    = queue.Queue(queueSize)
+    self.lock     = threading.Lock()
+    self.counters = { 'pictures': 0, 'failed': 0, 'dropped': 0 }
+    self.thread   = threading.Thread(target=self.work, name='JOBS')
+    self.thread.daemon = True
+    self.thread.start()
+
+  def submit(self, exposure, data, extra=None):
+    """Queue the pictures of an exposure, returns False when dropped."""
+    try:
+      self.queue.put_nowait((exposure, data, extra))
+      return True
+    except queue.Full:
+      self.count('dropped', len(exposure.jobs))
+      logger.warning('jobs behind, dropped the pictures of ' + ', '.join(j.name for j in exposure.jobs))
+      return False
+
+  def count(self, key, n=1):
+    with self.lock:
+      self.counters[key] += n
+
+  def work(self):
+    while True:
+      item = self.queue.get()
+      if item is self.STOP:
+        return
+      exposure, data, extra = item
+      for job in exposure.jobs:
+        try:
+          jpeg = rescale(data, job.resize, job.quality) if exposure.needsCopy(job) else data
+          if extra is not None and job.save and not job.resize:
+            self.store(job, jpeg, extra)
+            extra = None
+          else:
+            self.store(job, jpeg, None)
+          self.count('pictures')
+        except Exception:
+          self.count('failed')
+          logger.error('job ' + job.name + ' picture failed', exc_info=True)
+
+  def stop(self, timeout=30):
+    """Let the exposures queued be finished, then end the thread."""
+    self.queue.put(self.STOP)
+    self.thread.join(timeout)
+
+  def queuedBytes(self):
+    with self.queue.mutex:
+      return sum(len(item[1]) for item in self.queue.queue if item)
+
+  def stats(self):
+    with self.lock:
+      d = dict(self.counters)
+    d['queued'] = self.queue.qsize()
+    return d
+#------------------------------------------------------------------------------#
+# rescale: jpeg of a jpeg at another size and quality                          #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def rescale(data, size, quality=None):
+  out = io.BytesIO()
+  if Image is not None:
+    img = Image.open(io.BytesIO(data))
+    if size:
+      img.draft('RGB', size) # decoder scales down itself
+      img = img.convert('RGB').resize(size, Image.BILINEAR)
+    img.save(out, 'JPEG', quality=quality or 85)
+  else:
+    img = pygame.image.load(io.BytesIO(data), 'job.jpg')
+    if size:
+      img = pygame.transform.smoothscale(img, size)
+    pygame.image.save(img, out, 'job.jpg')
+  return out.getvalue()
+#------------------------------------------------------------------------------#
+# fromConfig: jobs of the [JOB:<name>] sections of config.ini                  #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def fromConfig(config):
+  jobs = []
+  for section in config.sections():
+    if not section.startswith('JOB:'):
+      continue
+    name = section.split(':', 1)[1]
+    c    = config[section]
+    try:
+      w, h = c.getint('width', 0), c.getint('height', 0)
+      jobs.append(Job(name,
+                      interval     = c.getfloat('interval', 60),
+                      images       = c.getint('images', 0),
+                      resize       = (w, h) if w and h else None,
+                      quality      = c.getint('quality', 0) or None,
+                      stack        = c.getint('stack', 0),
+                      folder       = c.get('folder', '') or None,
+                      save         = c.getboolean('save', True),
+                      destinations = [d.strip() for d in c.get('storage', '').split(',') if d.strip()]))
+    except Exception:
+      logger.error('job ' + name + ' disabled', exc_info=True)
+  return jobs
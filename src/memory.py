@@ -0,0 +1,233 @@
+#    Copyright 2014 Helios Taraba
+#
+#    This file provides the memory instrumentation and budgets of cam.py
+#
+#    memory.py is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    memory.py is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with memory.py.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Memory instrumentation for cameras running for weeks. Every interval the
+resident set size (RSS), the open file descriptors and the bytes held by
+every registered subsystem (thumbnail cache, last picture, upload queues
+...) are sampled and logged. With tracemalloc (python 3 only) a snapshot
+is taken as well, the allocations are summed per module and the lines
+that grew most since the previous snapshot are logged.
+
+A subsystem may have a budget and a shed callable. When it holds more than
+its budget, or the whole process more than the RSS budget, the subsystems
+are asked to shed their entries, largest first, so the caches give way
+before the kernel's OOM killer takes out the camera.
+
+The monitor is polled from the main loop of cam.py, the thread that owns
+the caches, so shedding needs no locks around them.
+"""
+import gc
+import logging
+import os
+import time
+try:
+  import resource
+except ImportError:
+  resource = None
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+
+logger = logging.getLogger('WEBCAM.memory')
+MB     = 1024 * 1024
+#------------------------------------------------------------------------------#
+# rss: resident set size of this process in bytes, None where unknown          #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def rss():
+  try:
+    with open('/proc/self/statm') as f:
+      return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+  except (IOError, OSError, ValueError, IndexError):
+    return None
+#------------------------------------------------------------------------------#
+# peakRss: largest resident set size so far in bytes, None where unknown       #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def peakRss():
+  if resource is None:
+    return None
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # kB on linux
+#------------------------------------------------------------------------------#
+# openFiles: number of open file descriptors, None where unknown               #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def openFiles():
+  try:
+    return len(os.listdir('/proc/self/fd'))
+  except OSError:
+    return None
+#------------------------------------------------------------------------------#
+# surfaceBytes: pixel memory of a pygame surface, 0 for None                   #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def surfaceBytes(surface):
+  if surface is None:
+    return 0
+  return surface.get_pitch() * surface.get_height()
+#------------------------------------------------------------------------------#
+# FrameBuffer: file like output writing into a preallocated buffer, so a       #
+#              camera capture needs no new stream per frame                    #
+#                                                                              #
+# Parameters: buf   bytearray (or other writable buffer) written from the start#
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class FrameBuffer(object):
+  def __init__(self, buf):
+    self.view     = memoryview(buf)
+    self.pos      = 0
+    self.overflow = 0 # bytes that did not fit, e.g. row padding
+
+  def rewind(self):
+    self.pos      = 0
+    self.overflow = 0
+
+  def write(self, data):
+    n    = len(data)
+    room = len(self.view) - self.pos
+    if n > room:
+      self.overflow += n - room
+      n = room
+    if n:
+      self.view[self.pos:self.pos + n] = data[:n] if n < len(data) else data
+      self.pos += n
+    return len(data)
+
+  def flush(self):
+    pass
+#------------------------------------------------------------------------------#
+# MemoryMonitor: periodic memory samples, budgets and shedding                 #
+#                                                                              #
+# Parameters: interval   seconds between samples                               #
+#             budget     RSS in bytes above which all caches shed, None off    #
+#             trace      take tracemalloc snapshots (python 3)                 #
+#             frames     stack frames tracemalloc keeps per allocation         #
+#             top        lines logged from a snapshot comparison               #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class MemoryMonitor(object):
+  def __init__(self, interval=60, budget=None, trace=False, frames=1, top=10):
+    self.interval   = interval
+    self.budget     = budget
+    self.top        = top
+    self.subsystems = [] # [name, size, shed, budget]
+    self.last       = 0
+    self.sample     = {}
+    self.sheds      = {}
+    self.snapshot   = None
+    self.trace      = bool(trace and tracemalloc)
+    if trace and not tracemalloc:
+      logger.info('tracemalloc needs python 3, allocation snapshots off')
+    if self.trace and not tracemalloc.is_tracing():
+      tracemalloc.start(frames)
+
+  def register(self, name, size, shed=None, budget=None):
+    """A subsystem: size() its bytes, shed() drops what it can, budget bytes."""
+    self.subsystems.append([name, size, shed, budget])
+
+  def poll(self):
+    """From the main loop: sample and enforce the budgets once per interval."""
+    now = time.time()
+    if now - self.last < self.interval:
+      return False
+    self.last = now
+    self.check()
+    return True
+
+  def sizes(self):
+    result = {}
+    for name, size, shed, budget in self.subsystems:
+      try:
+        result[name] = int(size())
+      except Exception:
+        logger.warning('memory size of ' + name + ' failed', exc_info=True)
+    return result
+
+  def shed(self, name, reason):
+    for s in self.subsystems:
+      if s[0] == name and s[2]:
+        s[2]()
+        self.sheds[name] = self.sheds.get(name, 0) + 1
+        logger.warning('memory: ' + name + ' shed, ' + reason)
+        return True
+    return False
+
+  def check(self):
+    sizes = self.sizes()
+    for name, size, shed, budget in self.subsystems:
+      if budget and sizes.get(name, 0) > budget:
+        self.shed(name, '%.1f MB over its budget of %.1f MB' % (float(sizes[name]) / MB, float(budget) / MB))
+        sizes[name] = int(size())
+    resident = rss()
+    if self.budget and resident and resident > self.budget:
+      reason = 'process at %.1f MB over the budget of %.1f MB' % (float(resident) / MB, float(self.budget) / MB)
+      for name in sorted(sizes, key=sizes.get, reverse=True):
+        if sizes[name]:
+          self.shed(name, reason)
+      gc.collect()
+      sizes    = self.sizes()
+      resident = rss()
+    self.sample = { 'rss'       : resident,
+                    'peakRss'   : peakRss(),
+                    'openFiles' : openFiles(),
+                    'subsystems': sizes }
+    if self.trace:
+      self.sample['modules'] = self.traceSnapshot()
+    logger.info('memory: rss %s, %s open files, ' % (self.mb(resident), self.sample['openFiles']) +
+                ', '.join('%s %s' % (n, self.mb(sizes[n])) for n in sorted(sizes)))
+
+  def traceSnapshot(self):
+    """Traced bytes per module, logs the lines grown most since last time."""
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+      tracemalloc.Filter(False, tracemalloc.__file__),
+      tracemalloc.Filter(False, '<frozen importlib._bootstrap>')))
+    modules = {}
+    for stat in snapshot.statistics('filename'):
+      name = os.path.splitext(os.path.basename(stat.traceback[0].filename))[0]
+      modules[name] = modules.get(name, 0) + stat.size
+    if self.snapshot is not None:
+      for stat in snapshot.compare_to(self.snapshot, 'lineno')[:self.top]:
+        if stat.size_diff:
+          logger.info('memory: %+.1f kB %s' % (stat.size_diff / 1024.0, stat.traceback[0]))
+    self.snapshot = snapshot
+    top = sorted(modules, key=modules.get, reverse=True)[:self.top]
+    return dict((name, modules[name]) for name in top)
+
+  def mb(self, n):
+    return '?' if n is None else '%.1f MB' % (float(n) / MB)
+
+  def stats(self):
+    return dict(self.sample, budget=self.budget, sheds=dict(self.sheds))
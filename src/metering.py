@@ -0,0 +1,171 @@
+#    Copyright 2014 Helios Taraba
+#
+#    This file provides the exposure and white balance lock for timelapses
+#
+#    metering.py is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    metering.py is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with metering.py.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Exposure and white balance lock for timelapse pictures. While tracking,
+the camera's auto exposure and auto white balance run on the video
+pipeline (viewfinder and stream) and the meter follows the exposure they
+settle on. Once it is stable the exposure time, gains and white balance
+gains are fixed, every timelapse picture is then taken with the same
+values: no convergence per picture and no flicker between pictures.
+
+The lock is renewed on a schedule (refresh seconds) or when the scene
+brightness, measured on the viewfinder frames taken with the locked
+exposure, has drifted by more than drift EV. Tracking runs between
+pictures from the main loop, nothing on the capture path waits for it.
+"""
+import logging
+import math
+import time
+
+import adaptive
+
+logger = logging.getLogger('WEBCAM.metering')
+#------------------------------------------------------------------------------#
+# sampleLuma: mean green value (0..255) of every step-th pixel of an rgb buffer#
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def sampleLuma(rgb, size, step=16):
+  n      = size[0] * size[1] * 3
+  sample = rgb[1:n:3 * step]
+  return float(sum(sample)) / max(1, len(sample))
+#------------------------------------------------------------------------------#
+# Meter: tracks the camera's auto exposure and locks it for a timelapse        #
+#                                                                              #
+# Parameters: camera    picamera.PiCamera                                      #
+#             refresh   seconds after which the lock is renewed, 0 never       #
+#             drift     brightness change in EV that renews the lock           #
+#             settle    shortest time auto exposure runs before a lock         #
+#             tolerance EV change between two readings counted as stable       #
+#             awb       lock the white balance as well                         #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class Meter(object):
+  SAMPLE_PERIOD = 0.25 # seconds between reading the exposure while tracking
+
+  def __init__(self, camera, refresh=600, drift=0.5, settle=2.0, tolerance=0.05, awb=True):
+    self.camera    = camera
+    self.refresh   = refresh
+    self.drift     = drift
+    self.settle    = settle
+    self.tolerance = tolerance
+    self.awb       = awb
+    self.state     = 'idle'    # idle, tracking or locked
+    self.since     = 0         # start of tracking or of the lock
+    self.lastRead  = 0
+    self.ev        = None      # last exposure reading while tracking, the locked one after
+    self.lockLuma  = None      # viewfinder brightness right after the lock
+    self.values    = None      # locked shutter, gains and white balance
+    self.locks     = 0
+    self.reasons   = {}        # why locks were renewed: schedule, drift
+    self.drifted   = 0.0       # EV the scene moved since the lock
+    self.framesLocked   = 0
+    self.framesUnlocked = 0
+
+  def start(self, now=None):
+    """Start tracking, the lock follows once the exposure is stable."""
+    self.track(time.time() if now is None else now)
+
+  def track(self, now):
+    cam = self.camera
+    cam.shutter_speed = 0 # back to the exposure time auto exposure picks
+    cam.exposure_mode = 'auto'
+    if self.awb:
+      cam.awb_mode    = 'auto'
+    self.state    = 'tracking'
+    self.since    = now
+    self.ev       = None
+    self.lockLuma = None
+
+  def lock(self, now):
+    cam = self.camera
+    self.values = { 'shutter'    : cam.exposure_speed,
+                    'analogGain' : float(cam.analog_gain),
+                    'digitalGain': float(cam.digital_gain) }
+    # exposure mode off freezes the gains where auto exposure left them
+    cam.shutter_speed = cam.exposure_speed
+    cam.exposure_mode = 'off'
+    if self.awb:
+      gains = cam.awb_gains
+      cam.awb_mode  = 'off'
+      cam.awb_gains = gains
+      self.values['awbGains'] = [float(g) for g in gains]
+    self.state   = 'locked'
+    self.since   = now
+    self.drifted = 0.0
+    self.locks  += 1
+    logger.info('exposure locked ' + repr(self.values))
+
+  def renew(self, now, reason):
+    self.reasons[reason] = self.reasons.get(reason, 0) + 1
+    logger.info('exposure lock renewed (' + reason + ')')
+    self.track(now)
+
+  def update(self, now=None, rgb=None, size=None):
+    """Call from the main loop, with the viewfinder frame when there is one."""
+    now = time.time() if now is None else now
+    if self.state == 'tracking':
+      if now - self.lastRead < self.SAMPLE_PERIOD:
+        return
+      self.lastRead = now
+      ev = adaptive.exposureValue(self.camera)
+      if self.ev is not None and abs(ev - self.ev) < self.tolerance and now - self.since >= self.settle:
+        self.lock(now)
+      self.ev = ev
+    elif self.state == 'locked':
+      if self.refresh and now - self.since >= self.refresh:
+        self.renew(now, 'schedule')
+      elif rgb is not None:
+        luma = sampleLuma(rgb, size)
+        if self.lockLuma is None:
+          self.lockLuma = luma
+          return
+        self.drifted = math.log((luma + 1.0) / (self.lockLuma + 1.0), 2)
+        if abs(self.drifted) > self.drift:
+          self.renew(now, 'drift')
+
+  def locked(self):
+    return self.state == 'locked'
+
+  def frameTaken(self):
+    """Count a timelapse picture as taken with or without the lock."""
+    if self.state == 'locked':
+      self.framesLocked += 1
+    else:
+      self.framesUnlocked += 1
+
+  def release(self):
+    """Back to auto exposure and white balance."""
+    if self.state != 'idle':
+      self.track(time.time())
+      self.state = 'idle'
+
+  def stats(self):
+    return { 'state'         : self.state,
+             'ev'            : round(self.ev, 2) if self.ev is not None else None,
+             'values'        : self.values,
+             'locks'         : self.locks,
+             'renewed'       : dict(self.reasons),
+             'drift'         : round(self.drifted, 2),
+             'framesLocked'  : self.framesLocked,
+             'framesUnlocked': self.framesUnlocked }
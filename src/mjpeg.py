@@ -0,0 +1,240 @@
+#    Copyright 2014 Helios Taraba
+#
+#    This file provides a motion jpeg live stream of the camera over http
+#
+#    mjpeg.py is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    mjpeg.py is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with mjpeg.py.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Motion jpeg live stream. The camera's hardware mjpeg encoder records from
+a video splitter port into a FrameBuffer, each complete frame is published
+once and every connected viewer picks up the most recent frame when it is
+ready for it. A slow viewer therefore skips frames instead of holding up
+the encoder or the other viewers.
+
+The encoder only runs while somebody is watching. Changing the camera
+resolution is not possible while recording, the Streamer must be paused
+around it (see takePicture in cam.py).
+"""
+import io
+import logging
+import socket
+import threading
+try:
+  import socketserver
+  from http import server as httpserver
+except ImportError:
+  import SocketServer as socketserver
+  import BaseHTTPServer as httpserver
+
+logger   = logging.getLogger('WEBCAM.mjpeg')
+BOUNDARY = 'FRAME'
+PAGE     = """<html><head><title>PiTimelapseCam</title></head>
+<body style="margin:0;background:#000"><img src="/stream.mjpg" style="width:100%"/></body></html>"""
+#------------------------------------------------------------------------------#
+# FrameBuffer: file like output for camera.start_recording. Buffers encoder    #
+#              output until the next jpeg start of image marker, then          #
+#              publishes the complete frame and wakes up the viewers.          #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class FrameBuffer(object):
+  def __init__(self):
+    self.frame     = None   # last complete jpeg frame
+    self.count     = 0      # number of frames published
+    self.buffer    = io.BytesIO()
+    self.condition = threading.Condition()
+
+  def write(self, buf):
+    if buf.startswith(b'\xff\xd8') and self.buffer.tell():
+      self.publish(self.buffer.getvalue())
+      self.buffer.seek(0)
+      self.buffer.truncate()
+    return self.buffer.write(buf)
+
+  def flush(self):
+    pass
+
+  def publish(self, frame):
+    with self.condition:
+      self.frame  = frame
+      self.count += 1
+      self.condition.notify_all()
+
+  def wait(self, last, timeout=None):
+    """Return (count, frame) of the newest frame after frame number last,
+    frames published in between are skipped. Returns (last, None) when
+    nothing arrived within timeout seconds."""
+    with self.condition:
+      if self.count <= last:
+        self.condition.wait(timeout)
+      if self.count <= last:
+        return last, None
+      return self.count, self.frame
+#------------------------------------------------------------------------------#
+# Streamer: owns the mjpeg recording on its own splitter port and the http     #
+#           server feeding the viewers.                                        #
+#                                                                              #
+# Parameters: camera        PiCamera instance                                  #
+#             port          tcp port of the http server                        #
+#             resize        (width, height) of the stream                      #
+#             quality       mjpeg quality 1..100                               #
+#             splitter_port video splitter port used for the recording        #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class Streamer(object):
+  def __init__(self, camera, port=8000, resize=(640, 480), quality=20, splitter_port=2):
+    self.camera        = camera
+    self.port          = port
+    self.resize        = resize
+    self.quality       = quality
+    self.splitter_port = splitter_port
+    self.output        = FrameBuffer()
+    self.viewers       = 0
+    self.paused        = 0
+    self.recording     = False
+    self.lock          = threading.RLock()
+    self.server        = None
+    self.thread        = None
+
+  def start(self):
+    self.server = StreamServer(('', self.port), StreamHandler)
+    self.server.streamer = self
+    self.thread = threading.Thread(target=self.server.serve_forever, name='MJPEG_SERVER')
+    self.thread.daemon = True
+    self.thread.start()
+    logger.info('mjpeg stream on port ' + str(self.port))
+
+  def stop(self):
+    if self.server is not None:
+      self.server.shutdown()
+      self.server.server_close()
+      self.server = None
+    with self.lock:
+      self._stopRecording()
+
+  def pause(self):
+    """Stop the encoder so the camera may be reconfigured, calls nest."""
+    with self.lock:
+      self.paused += 1
+      self._stopRecording()
+
+  def resume(self):
+    with self.lock:
+      self.paused = max(0, self.paused - 1)
+      self._update()
+
+  def addViewer(self):
+    with self.lock:
+      self.viewers += 1
+      self._update()
+
+  def removeViewer(self):
+    with self.lock:
+      self.viewers -= 1
+      self._update()
+
+  def _update(self):
+    if self.viewers > 0 and not self.paused:
+      self._startRecording()
+    elif self.viewers <= 0:
+      self._stopRecording()
+
+  def _startRecording(self):
+    if self.recording:
+      return
+    try:
+      self.camera.start_recording(self.output, format='mjpeg', splitter_port=self.splitter_port,
+                                  resize=self.resize, quality=self.quality)
+      self.recording = True
+    except Exception:
+      logger.error('unexpected error', exc_info=True)
+
+  def _stopRecording(self):
+    if not self.recording:
+      return
+    try:
+      self.camera.stop_recording(splitter_port=self.splitter_port)
+    except Exception:
+      logger.error('unexpected error', exc_info=True)
+    self.recording = False
+#------------------------------------------------------------------------------#
+# StreamServer: threaded http server, one thread per viewer                    #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class StreamServer(socketserver.ThreadingMixIn, httpserver.HTTPServer):
+  allow_reuse_address = True
+  daemon_threads      = True
+#------------------------------------------------------------------------------#
+# StreamHandler: serves the viewer page and the multipart mjpeg stream         #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class StreamHandler(httpserver.BaseHTTPRequestHandler):
+  def do_GET(self):
+    if self.path == '/':
+      content = PAGE.encode('utf-8')
+      self.send_response(200)
+      self.send_header('Content-Type', 'text/html')
+      self.send_header('Content-Length', str(len(content)))
+      self.end_headers()
+      self.wfile.write(content)
+    elif self.path == '/stream.mjpg':
+      self.stream()
+    else:
+      self.send_error(404)
+
+  def stream(self):
+    streamer = self.server.streamer
+    self.send_response(200)
+    self.send_header('Age', '0')
+    self.send_header('Cache-Control', 'no-cache, private')
+    self.send_header('Pragma', 'no-cache')
+    self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=' + BOUNDARY)
+    self.end_headers()
+    streamer.addViewer()
+    sent    = 0
+    dropped = 0
+    last    = streamer.output.count
+    try:
+      while streamer.server is not None:
+        count, frame = streamer.output.wait(last, timeout=5)
+        if frame is None:
+          # encoder paused (still capture) or stopped, keep waiting
+          continue
+        dropped += count - last - 1
+        last     = count
+        self.wfile.write(b'--' + BOUNDARY.encode('ascii') + b'\r\n')
+        self.wfile.write(b'Content-Type: image/jpeg\r\n')
+        self.wfile.write(b'Content-Length: ' + str(len(frame)).encode('ascii') + b'\r\n\r\n')
+        self.wfile.write(frame)
+        self.wfile.write(b'\r\n')
+        sent += 1
+    except (socket.error, IOError):
+      pass
+    finally:
+      streamer.removeViewer()
+      logger.info('mjpeg viewer ' + str(self.client_address[0]) + ' left, ' +
+                  str(sent) + ' frames sent, ' + str(dropped) + ' dropped')
+
+  def log_message(self, format, *args):
+    logger.debug('mjpeg ' + str(self.client_address[0]) + ' ' + (format % args))
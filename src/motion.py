@@ -0,0 +1,122 @@
+#    Copyright 2014 Helios Taraba
+#
+#    This file provides motion detection on the viewfinder frames
+#
+#    motion.py is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    motion.py is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with motion.py.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Motion detection on the low resolution rgb frames the viewfinder grabs
+anyway. Every step-th pixel of every step-th row is converted to luma and
+compared with a slowly adapting background, a frame counts as motion when
+more than threshold of the watched pixels changed by more than sensitivity
+levels. Everything is a vectorized numpy operation on a strided view of the
+viewfinder buffer, at the default step of 4 a 320x240 frame is 80x60 pixels.
+"""
+import time
+try:
+  import numpy
+except ImportError:
+  numpy = None
+#------------------------------------------------------------------------------#
+# parseMask: convert a mask definition from config.ini to a list of            #
+#            rectangles. Rectangles are x,y,w,h in fractions of the frame      #
+#            separated by ';' e.g. "0.0,0.5,1.0,0.5" for the bottom half.      #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def parseMask(text):
+  rects = []
+  for r in (text or '').split(';'):
+    if r.strip():
+      x, y, w, h = [float(n) for n in r.split(',')]
+      rects.append((x, y, w, h))
+  return rects
+#------------------------------------------------------------------------------#
+# MotionDetector: compares viewfinder frames with a running background        #
+#                                                                              #
+# Parameters: sensitivity  luma change (0..255) for a pixel to count as changed#
+#             threshold    fraction of watched pixels that must change         #
+#             cooldown     seconds after a detection during which no new       #
+#                          detection is reported                               #
+#             mask         list of (x,y,w,h) rectangles to watch, all if empty #
+#             step         subsample factor in both directions                 #
+#             alpha        background adaption rate per frame                  #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class MotionDetector(object):
+  WARMUP = 5 # frames to settle the background before detecting
+
+  def __init__(self, sensitivity=20, threshold=0.02, cooldown=10, mask=None, step=4, alpha=0.1):
+    if numpy is None:
+      raise ImportError('motion detection requires numpy')
+    self.sensitivity = sensitivity
+    self.threshold   = threshold
+    self.cooldown    = cooldown
+    self.rects       = mask or []
+    self.step        = step
+    self.alpha       = alpha
+    self.background  = None
+    self.mask        = None
+    self.watched     = 0
+    self.frames      = 0
+    self.last        = 0      # time of the last detection
+    self.changed     = 0.0    # fraction changed in the last frame
+
+  def reset(self):
+    self.background = None
+
+  def luma(self, rgb, size):
+    w, h  = size
+    frame = numpy.frombuffer(rgb, numpy.uint8, w * h * 3).reshape(h, w, 3)
+    sub   = frame[::self.step, ::self.step].astype(numpy.uint16)
+    # integer approximation of 0.299 r + 0.587 g + 0.114 b
+    return (sub[..., 0] * 77 + sub[..., 1] * 150 + sub[..., 2] * 29) >> 8
+
+  def makeMask(self, shape):
+    h, w = shape
+    if not self.rects:
+      return None
+    mask = numpy.zeros(shape, dtype=bool)
+    for x, y, rw, rh in self.rects:
+      mask[int(y * h):int(round((y + rh) * h)), int(x * w):int(round((x + rw) * w))] = True
+    return mask
+
+  def update(self, rgb, size, now=None):
+    """Feed one viewfinder frame (bytearray rgb, size (w,h)), returns True
+    when motion is detected and the cooldown has expired."""
+    now  = time.time() if now is None else now
+    luma = self.luma(rgb, size)
+    if self.background is None or self.background.shape != luma.shape:
+      self.background = luma.astype(numpy.float32)
+      self.mask       = self.makeMask(luma.shape)
+      self.watched    = luma.size if self.mask is None else max(1, numpy.count_nonzero(self.mask))
+      self.frames     = 0
+      return False
+    changed = numpy.abs(luma - self.background) > self.sensitivity
+    if self.mask is not None:
+      changed &= self.mask
+    self.changed = numpy.count_nonzero(changed) / float(self.watched)
+    # background follows slow changes such as clouds and dusk
+    self.background += self.alpha * (luma - self.background)
+    self.frames     += 1
+    if self.frames < self.WARMUP or self.changed < self.threshold:
+      return False
+    if now - self.last < self.cooldown:
+      return False
+    self.last = now
+    return True
@@ -0,0 +1,212 @@
+#    Copyright 2014 Helios Taraba
+#
+#    This file provides the timelapse sequence playback
+#
+#    playback.py is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    playback.py is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with playback.py.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Plays a range of pictures as a sequence at a chosen frame rate. A small
+pool of worker threads decodes and scales the pictures ahead of the
+display into a fixed size ring buffer. Playback follows the clock: when
+decoding falls behind, the workers skip the frames which are already late
+and the display shows the newest frame that is due, the skipped frames are
+counted as dropped.
+
+With PIL the jpeg decoder itself scales down (draft mode decodes at 1/2,
+1/4 or 1/8 of the size), which is many times faster than decoding the full
+picture with pygame and scaling it afterwards.
+"""
+import collections
+import fnmatch
+import logging
+import os
+import threading
+import time
+try:
+  from PIL import Image
+except ImportError:
+  Image = None
+try:
+  import pygame
+except ImportError:
+  pygame = None
+
+logger    = logging.getLogger('WEBCAM.playback')
+FPS_STEPS = [1, 2, 5, 10, 15, 20, 25, 30] # frame rates offered on the touchscreen
+#------------------------------------------------------------------------------#
+# loadScaled: decode a jpeg into a pygame surface of the given size            #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def loadScaled(filename, size):
+  if Image is None:
+    return pygame.transform.scale(pygame.image.load(filename), size)
+  img = Image.open(filename)
+  img.draft('RGB', size) # let the decoder skip what is scaled away anyway
+  img = img.convert('RGB')
+  if img.size != size:
+    img = img.resize(size, Image.BILINEAR)
+  data = img.tobytes() if hasattr(img, 'tobytes') else img.tostring()
+  return pygame.image.fromstring(data, size, 'RGB')
+#------------------------------------------------------------------------------#
+# sequence: file names of the pictures in path from index first to last       #
+#           (IMG_XXXX.JPG as written by cam.py), in order                      #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def sequence(path, first=0, last=9999):
+  names = []
+  for f in os.listdir(path):
+    if fnmatch.fnmatch(f, 'IMG_[0-9][0-9][0-9][0-9].JPG') and first <= int(f[4:8]) <= last:
+      names.append(f)
+  names.sort()
+  return [os.path.join(path, f) for f in names]
+#------------------------------------------------------------------------------#
+# SequencePlayer: decodes a list of pictures ahead of the display             #
+#                                                                              #
+# Parameters: items    pictures to play, handed to loader one by one           #
+#             loader   callable returning the scaled surface for an item       #
+#             fps      frame rate                                              #
+#             ahead    size of the ring buffer, frames decoded in advance      #
+#             workers  decoding threads                                        #
+#             loop     start over after the last item                          #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class SequencePlayer(object):
+  MAX_WAIT = 0.25 # longest sleep in wait(), keeps the touchscreen responsive
+
+  def __init__(self, items, loader, fps=10, ahead=8, workers=2, loop=True):
+    self.items    = list(items)
+    self.loader   = loader
+    self.fps      = float(fps)
+    self.ahead    = max(2, ahead)
+    self.loop     = loop
+    self.cond     = threading.Condition()
+    self.ring     = [None] * self.ahead # (position, surface) per slot
+    self.claim    = 0     # next position a worker decodes
+    self.position = 0     # next position to show
+    self.start    = None  # clock time of position 0, set by the first frame
+    self.current  = None  # (position, surface) on screen
+    self.shown    = 0
+    self.dropped  = 0
+    self.times    = collections.deque(maxlen=30) # when frames were shown
+    self.running  = True
+    self.threads  = []
+    for n in range(max(1, workers)):
+      t = threading.Thread(target=self.work, name='playback-%d' % n)
+      t.daemon = True
+      t.start()
+      self.threads.append(t)
+
+  def item(self, position):
+    return self.items[position % len(self.items)]
+
+  def finished(self):
+    return not self.loop and self.position >= len(self.items)
+
+  def due(self, now):
+    """Position the clock has reached, caller holds the lock."""
+    if self.start is None:
+      return 0
+    return int((now - self.start) * self.fps)
+
+  def work(self):
+    while True:
+      with self.cond:
+        while self.running and (self.claim >= self.position + self.ahead or
+                                (not self.loop and self.claim >= len(self.items))):
+          self.cond.wait(self.MAX_WAIT)
+        if not self.running:
+          return
+        # frames the clock has passed already are not worth decoding
+        self.claim = max(self.claim, self.due(time.time()), self.position)
+        position   = self.claim
+        self.claim += 1
+      try:
+        surface = self.loader(self.item(position))
+      except Exception:
+        logger.warning('cannot decode %s', self.item(position), exc_info=True)
+        surface = None
+      with self.cond:
+        self.ring[position % self.ahead] = (position, surface)
+        self.cond.notify_all()
+
+  def frame(self, now=None):
+    """Surface to show now: the newest decoded frame that is due. Returns
+    the frame already on screen when nothing newer is ready, None before
+    the first frame is decoded."""
+    now = time.time() if now is None else now
+    with self.cond:
+      if self.start is None:
+        slot = self.ring[0]
+        if slot is None or slot[0] != 0:
+          return None
+        self.start = now # clock starts with the first decoded frame
+      due  = self.due(now)
+      best = None
+      for slot in self.ring:
+        if slot and self.position <= slot[0] <= due and (best is None or slot[0] > best[0]):
+          best = slot
+      if best is not None:
+        self.dropped  += best[0] - self.position
+        self.position  = best[0] + 1
+        self.shown    += 1
+        self.times.append(now)
+        if best[1] is not None:
+          self.current = best
+        self.cond.notify_all() # window moved, workers may decode further
+      return self.current[1] if self.current else None
+
+  def wait(self):
+    """Sleep until the next frame is due (at most MAX_WAIT)."""
+    with self.cond:
+      if self.start is None:
+        delay = 0.05
+      else:
+        delay = self.start + self.position / self.fps - time.time()
+    if delay > 0:
+      time.sleep(min(delay, self.MAX_WAIT))
+
+  def setFps(self, fps):
+    with self.cond:
+      now = time.time()
+      if self.start is not None:
+        # keep the position, continue at the new rate
+        self.start = now - self.position / float(fps)
+      self.fps = float(fps)
+      self.times.clear()
+
+  def achievedFps(self):
+    with self.cond:
+      if len(self.times) < 2 or self.times[-1] == self.times[0]:
+        return 0.0
+      return (len(self.times) - 1) / (self.times[-1] - self.times[0])
+
+  def currentItem(self):
+    """Item on screen, None before the first frame."""
+    with self.cond:
+      return self.item(self.current[0]) if self.current else None
+
+  def stop(self):
+    with self.cond:
+      self.running = False
+      self.cond.notify_all()
+    for t in self.threads:
+      t.join(5)
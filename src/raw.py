@@ -0,0 +1,375 @@
+#    Copyright 2014 Helios Taraba
+#
+#    This file provides the raw capture and its development in the background
+#
+#    raw.py is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    raw.py is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with raw.py.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Raw capture: camera.capture(..., bayer=True) appends the raw Bayer data of
+the sensor (10 bit, 4 pixels packed into 5 bytes, rows padded) to the jpeg.
+split() takes it off again, so the jpeg goes on as any other picture and
+only the raw block is handed to the RawDeveloper.
+
+The RawDeveloper develops raw blocks in a pool of worker processes on the
+spare cores, at low priority: either into a DNG (the Bayer data as it is,
+for a raw converter) or into a jpeg (black level, white balance from the
+camera's gains, bilinear demosaic, gamma). submit() never waits for the
+pool: when more than maxQueued raw blocks are waiting, new ones are
+dropped and counted. The raw blocks wait in memory or, with a spool
+folder, on disk.
+
+The Bayer data is cropped to the crop window of the size setting, so the
+developed picture has the framing and resolution of the jpeg.
+"""
+import logging
+import multiprocessing
+import os
+import struct
+import threading
+import time
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+import stack
+
+logger      = logging.getLogger('WEBCAM.raw')
+HEADER_SIZE = 32768 # 'BRCM' header in front of the Bayer data
+BLACK_LEVEL = 64    # of the 10 bit values
+WHITE_LEVEL = 1023
+FORMATS     = ('dng', 'jpeg')
+ORDERS      = { 0: 'RGGB', 1: 'GBRG', 2: 'BGGR', 3: 'GRBG' } # header bayer_order
+SENSORS     = { 6404096 : ('OV5647', 2592, 1944),  # raw block size: sensor
+                10270208: ('IMX219', 3280, 2464) }
+CROSS       = ((-1, 0), (1, 0), (0, -1), (0, 1)) # neighbours averaged by demosaic
+DIAG        = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+VERT        = ((-1, 0), (1, 0))
+HORIZ       = ((0, -1), (0, 1))
+#------------------------------------------------------------------------------#
+# split: (jpeg, raw block) of a capture with bayer=True, raw is None without   #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def split(data):
+  for size in SENSORS:
+    if len(data) > size and data[-size:-size + 4] == b'BRCM':
+      return data[:-size], data[-size:]
+  return data, None
+#------------------------------------------------------------------------------#
+# unpack: Bayer pattern and the 10 bit sensor values (h x w uint16) of a raw   #
+#         block                                                                #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def unpack(block):
+  model, w, h = SENSORS[len(block)]
+  order  = ORDERS.get(bytearray(block[244:245])[0], 'BGGR')
+  stride = ((w * 5 // 4) + 31) // 32 * 32
+  rows   = (h + 15) // 16 * 16
+  data   = numpy.frombuffer(block, numpy.uint8, stride * rows, HEADER_SIZE).reshape(rows, stride)
+  data   = data[:h, :w * 5 // 4].reshape(h, w // 4, 5).astype(numpy.uint16)
+  low    = data[:, :, 4]
+  bayer  = numpy.empty((h, w // 4, 4), numpy.uint16)
+  for i in range(4): # 8 high bits per pixel, the 2 low bits of all four in the fifth byte
+    bayer[:, :, i] = (data[:, :, i] << 2) | ((low >> (2 * i)) & 3)
+  return model, order, bayer.reshape(h, w)
+#------------------------------------------------------------------------------#
+# pack: raw block of h x w 10 bit values as the camera writes it, the reverse  #
+#       of unpack, for tests and benchmarks                                    #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def pack(bayer, order='BGGR'):
+  h, w   = bayer.shape
+  size   = [k for k, v in SENSORS.items() if v[1:] == (w, h)][0]
+  stride = ((w * 5 // 4) + 31) // 32 * 32
+  rows   = (h + 15) // 16 * 16
+  data   = numpy.zeros((rows, stride), numpy.uint8)
+  quads  = bayer.reshape(h, w // 4, 4)
+  body   = numpy.zeros((h, w // 4, 5), numpy.uint8)
+  for i in range(4):
+    body[:, :, i]  = quads[:, :, i] >> 2
+    body[:, :, 4] |= ((quads[:, :, i] & 3) << (2 * i)).astype(numpy.uint8)
+  data[:h, :w * 5 // 4] = body.reshape(h, -1)
+  header = bytearray(HEADER_SIZE)
+  header[:4]  = b'BRCM'
+  header[244] = dict((v, k) for k, v in ORDERS.items())[order]
+  block = bytes(header) + data.tobytes()
+  assert len(block) == size
+  return block
+#------------------------------------------------------------------------------#
+# crop: Bayer data within a crop window (x, y, w, h as fractions), on even     #
+#       pixels so the pattern stays the same                                   #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def crop(bayer, window):
+  h, w   = bayer.shape
+  x0, y0 = int(window[0] * w) & ~1, int(window[1] * h) & ~1
+  cw, ch = int(round(window[2] * w)) & ~1, int(round(window[3] * h)) & ~1
+  return bayer[y0:y0 + ch, x0:x0 + cw]
+#------------------------------------------------------------------------------#
+# demosaic: bilinear demosaic of Bayer data into h x w x 3 uint16, with the    #
+#           black level taken off                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def demosaic(bayer, order):
+  h, w = bayer.shape
+  v    = numpy.maximum(bayer, BLACK_LEVEL) - BLACK_LEVEL
+  p    = numpy.pad(v, 1, 'reflect') # mirrors without the edge, keeps the pattern
+  def near(y0, x0, offsets): # mean of the neighbours of the sites y0::2, x0::2
+    return sum(p[1 + y0 + dy:1 + h + dy:2, 1 + x0 + dx:1 + w + dx:2] for dy, dx in offsets) // len(offsets)
+  sites = dict((order[2 * y + x], (y, x)) for y in (0, 1) for x in (0, 1))
+  del sites['G']
+  out   = numpy.empty((h, w, 3), numpy.uint16)
+  for i, (cy, cx), (oy, ox) in ((0, sites['R'], sites['B']), (2, sites['B'], sites['R'])):
+    c = out[:, :, i]
+    c[cy::2, cx::2]         = v[cy::2, cx::2]
+    c[oy::2, ox::2]         = near(oy, ox, DIAG)
+    c[cy::2, 1 - cx::2]     = near(cy, 1 - cx, HORIZ)   # green sites in a row of this colour
+    c[1 - cy::2, cx::2]     = near(1 - cy, cx, VERT)    # green sites in a column of it
+  g = out[:, :, 1]
+  for y, x in sites.values():
+    g[y::2, x::2]     = near(y, x, CROSS)
+    g[y::2, 1 - x::2] = v[y::2, 1 - x::2]
+  return out
+#------------------------------------------------------------------------------#
+# toJpeg: jpeg of Bayer data, demosaiced, white balanced and gamma corrected   #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def toJpeg(bayer, order, gains, quality=90):
+  rgb = demosaic(bayer, order)
+  top = WHITE_LEVEL - BLACK_LEVEL
+  x   = numpy.arange(top + 1) / float(top)
+  out = numpy.empty(rgb.shape, numpy.uint8)
+  for i, gain in enumerate((gains[0], 1.0, gains[1])): # white balance and gamma in one table
+    lut = (255.0 * numpy.minimum(x * gain, 1.0) ** (1 / 2.2) + 0.5).astype(numpy.uint8)
+    out[:, :, i] = lut[rgb[:, :, i]]
+  return stack.encodeJpeg(out, quality)
+#------------------------------------------------------------------------------#
+# toDng: DNG of Bayer data, uncompressed 16 bit CFA, with the camera's white   #
+#        balance as AsShotNeutral for the raw converter                        #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def toDng(bayer, order, gains, model='Raspberry Pi'):
+  h, w    = bayer.shape
+  image   = numpy.ascontiguousarray(bayer, '<u2').tobytes()
+  r, b    = gains
+  def rational(x):
+    return (int(round(x * 10000)), 10000)
+  neutral = [rational(1.0 / r), (1, 1), rational(1.0 / b)]
+  cfa     = bytearray(b'RGB'.index(c) for c in order.encode('ascii'))
+  text    = lambda s: s.encode('ascii') + b'\0'
+  # tag, type, values; types 1 byte, 2 ascii, 3 short, 4 long, 5 rational, 10 srational
+  tags = [(254,   4, [0]),
+          (256,   4, [w]),
+          (257,   4, [h]),
+          (258,   3, [16]),
+          (259,   3, [1]),
+          (262,   3, [32803]),                 # colour filter array
+          (271,   2, text('Raspberry Pi')),
+          (272,   2, text(model)),
+          (273,   4, [0]),                     # strip offset, set below
+          (274,   3, [1]),
+          (277,   3, [1]),
+          (278,   4, [h]),
+          (279,   4, [len(image)]),
+          (284,   3, [1]),
+          (305,   2, text('cam.py')),
+          (33421, 3, [2, 2]),
+          (33422, 1, list(cfa)),
+          (50706, 1, [1, 4, 0, 0]),
+          (50707, 1, [1, 1, 0, 0]),
+          (50708, 2, text('Raspberry Pi ' + model)),
+          (50714, 4, [BLACK_LEVEL]),
+          (50717, 4, [WHITE_LEVEL]),
+          (50721, 10, [(1, 1), (0, 1), (0, 1), (0, 1), (1, 1), (0, 1), (0, 1), (0, 1), (1, 1)]), # no calibrated matrix
+          (50728, 5, neutral),
+          (50778, 3, [21])]                    # D65
+  sizes   = { 1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 10: 8 }
+  formats = { 1: 'B', 2: 's', 3: 'H', 4: 'I', 5: 'II', 10: 'ii' }
+  def pack(kind, values):
+    if kind == 2:
+      return bytes(values)
+    if kind in (5, 10):
+      return b''.join(struct.pack('<' + formats[kind], *v) for v in values)
+    return struct.pack('<%d%s' % (len(values), formats[kind]), *values)
+  ifdSize = 2 + 12 * len(tags) + 4
+  extra   = 8 + ifdSize # values longer than 4 bytes go after the directory
+  entries, blobs = [], []
+  for tag, kind, values in tags:
+    count = len(values)
+    data  = pack(kind, values)
+    if len(data) <= 4:
+      entries.append(struct.pack('<HHI', tag, kind, count) + data.ljust(4, b'\0'))
+    else:
+      entries.append(struct.pack('<HHII', tag, kind, count, extra))
+      blobs.append(data + (b'\0' if len(data) % 2 else b''))
+      extra += len(blobs[-1])
+  offset  = extra
+  entries = [e if struct.unpack('<H', e[:2])[0] != 273 else struct.pack('<HHII', 273, 4, 1, offset) for e in entries]
+  return b''.join([b'II*\0', struct.pack('<I', 8), struct.pack('<H', len(tags))] + entries +
+                  [struct.pack('<I', 0)] + blobs + [image])
+#------------------------------------------------------------------------------#
+# develop: worker of the pool, develops one job and writes the target file,    #
+#          returns (target, seconds, error message or None)                    #
+#                                                                              #
+# Parameters: job   (raw block, or None and the spool file it is in, target,   #
+#                    format, crop window, gains (r, b), jpeg quality)          #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def develop(job):
+  block, spooled, target, form, window, gains, quality = job
+  start = time.time()
+  try:
+    if spooled:
+      with open(spooled, 'rb') as f:
+        block = f.read()
+      os.remove(spooled)
+    model, order, bayer = unpack(block)
+    if window:
+      bayer = crop(bayer, window)
+    if form == 'dng':
+      data = toDng(bayer, order, gains, model)
+    else:
+      data = toJpeg(bayer, order, gains, quality)
+    tmp = target + '.tmp'
+    with open(tmp, 'wb') as f:
+      f.write(data)
+    os.rename(tmp, target)
+    return target, time.time() - start, None
+  except Exception as e:
+    return target, time.time() - start, repr(e)
+#------------------------------------------------------------------------------#
+# lowPriority: initializer of the worker processes, below the camera and ui    #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def lowPriority(nice):
+  try:
+    os.nice(nice)
+  except OSError:
+    pass
+#------------------------------------------------------------------------------#
+# RawDeveloper: develops raw blocks in a pool of processes, never blocking     #
+#                                                                              #
+# Parameters: workers    processes, default all cores but one                  #
+#             maxQueued  raw blocks waiting or in development, newer dropped   #
+#             form       'dng' or 'jpeg'                                       #
+#             quality    jpeg quality                                          #
+#             spool      folder the raw blocks wait in, None in memory         #
+#             nice       priority of the workers                               #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class RawDeveloper(object):
+  def __init__(self, workers=None, maxQueued=4, form='dng', quality=90, spool=None, nice=10):
+    if numpy is None:
+      raise ImportError('raw development requires numpy')
+    if form not in FORMATS:
+      raise ValueError('raw format must be one of ' + ', '.join(FORMATS))
+    self.workers   = workers or max(1, multiprocessing.cpu_count() - 1)
+    self.maxQueued = maxQueued
+    self.form      = form
+    self.quality   = quality
+    self.spool     = spool
+    self.lock      = threading.Lock() # callbacks run on the pool's result thread
+    self.pending   = 0
+    self.counters  = { 'submitted': 0, 'developed': 0, 'dropped': 0, 'failed': 0, 'seconds': 0.0 }
+    self.last      = None
+    self.pool      = multiprocessing.Pool(self.workers, lowPriority, (nice,))
+
+  def extension(self):
+    return '.DNG' if self.form == 'dng' else '.RAW.JPG'
+
+  def submit(self, block, target, window=None, gains=(1.0, 1.0)):
+    """Queue a raw block for development into target, False when dropped."""
+    with self.lock:
+      if self.pending >= self.maxQueued:
+        self.counters['dropped'] += 1
+        logger.warning('raw development behind, dropped ' + os.path.basename(target))
+        return False
+      self.pending += 1
+      self.counters['submitted'] += 1
+    spooled = None
+    if self.spool:
+      try:
+        if not os.path.isdir(self.spool):
+          os.makedirs(self.spool)
+        spooled = os.path.join(self.spool, os.path.basename(target) + '.bayer')
+        with open(spooled, 'wb') as f:
+          f.write(block)
+        block = None
+      except (IOError, OSError):
+        logger.warning('cannot spool raw to ' + self.spool + ', kept in memory', exc_info=True)
+        spooled = None
+    self.pool.apply_async(develop, ((block, spooled, target, self.form, window, tuple(gains), self.quality),),
+                          callback=self.done)
+    return True
+
+  def done(self, result):
+    target, seconds, error = result
+    with self.lock:
+      self.pending -= 1
+      self.counters['failed' if error else 'developed'] += 1
+      self.counters['seconds'] += seconds
+      self.last = os.path.basename(target)
+    if error:
+      logger.error('raw development of ' + target + ' failed: ' + error)
+    else:
+      logger.info('raw developed ' + target + ' in ' + str(int(seconds * 1000)) + 'ms')
+
+  def wait(self, timeout=None):
+    """Until nothing is pending, False on timeout."""
+    end = time.time() + timeout if timeout else None
+    while self.pending:
+      if end and time.time() > end:
+        return False
+      time.sleep(0.05)
+    return True
+
+  def close(self):
+    """Finish what is queued and stop the workers."""
+    self.pool.close()
+    self.pool.join()
+
+  def stats(self):
+    with self.lock:
+      d = dict(self.counters)
+      d['queued'] = self.pending
+      d['last']   = self.last
+    done = d['developed'] + d['failed']
+    d['avgMs']  = int(d.pop('seconds') * 1000 / done) if done else None
+    d['format'] = self.form
+    d['workers']= self.workers
+    return d
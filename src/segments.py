@@ -0,0 +1,347 @@
+#    Copyright 2014 Helios Taraba
+#
+#    This file provides the append only segment container for pictures
+#
+#    segments.py is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    segments.py is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with segments.py.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Append only container for pictures. Instead of one file per picture, the
+pictures are appended to large segment files, SEG_000001.seg, ..., which
+are rotated by size or age. Every segment has a sidecar index,
+SEG_000001.idx, with one fixed size record per picture (offset, length,
+time, picture number), so listing thousands of pictures reads a few small
+files instead of thousands of directory entries.
+
+Every picture in a segment is preceded by a small header repeating its
+index record, the index of the segment being written when the power failed
+is rebuilt from the segment the next time a writer opens the folder.
+
+Readers map the segments with mmap and hand out slices of the mapping
+without copying. Pictures are exported back to IMG_XXXX.JPG files with
+
+  python segments.py export /home/pi/Photos/segments /tmp/export
+"""
+from __future__ import print_function
+
+import argparse
+import fnmatch
+import io
+import logging
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+
+logger  = logging.getLogger('WEBCAM.segments')
+MAGIC   = b'FRM1'
+HEADER  = struct.Struct('<4sIdI')  # magic, length, time, number before every picture
+RECORD  = struct.Struct('<QIdI')   # offset, length, time, number per index record
+PATTERN = 'SEG_[0-9][0-9][0-9][0-9][0-9][0-9].seg'
+#------------------------------------------------------------------------------#
+# segmentNames: segment files in a folder, oldest first                        #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def segmentNames(path):
+  try:
+    return sorted(f for f in os.listdir(path) if fnmatch.fnmatch(f, PATTERN))
+  except OSError:
+    return []
+#------------------------------------------------------------------------------#
+# view: slice of a mapping without copying                                     #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def view(mm, offset, length):
+  try:
+    return memoryview(mm)[offset:offset + length]
+  except TypeError:
+    return buffer(mm, offset, length) # python 2 mmap only has the old buffer interface
+#------------------------------------------------------------------------------#
+# scan: index records of the complete pictures in a segment, from the headers  #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def scan(filename):
+  records = []
+  with open(filename, 'rb') as f:
+    f.seek(0, 2)
+    size   = f.tell()
+    offset = 0
+    while offset + HEADER.size <= size:
+      f.seek(offset)
+      magic, length, when, number = HEADER.unpack(f.read(HEADER.size))
+      if magic != MAGIC or offset + HEADER.size + length > size:
+        break
+      records.append((offset + HEADER.size, length, when, number))
+      offset += HEADER.size + length
+  return records, offset
+#------------------------------------------------------------------------------#
+# SegmentWriter: appends pictures to the current segment                      #
+#                                                                              #
+# Parameters: path     folder of the segments                                  #
+#             maxBytes segment size at which a new segment is started          #
+#             maxAge   seconds after which a new segment is started            #
+#             sync     fsync after every picture                               #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class SegmentWriter(object):
+  def __init__(self, path, maxBytes=256 * 1024 * 1024, maxAge=3600, sync=True):
+    self.path     = path
+    self.maxBytes = maxBytes
+    self.maxAge   = maxAge
+    self.sync     = sync
+    self.lock     = threading.Lock()
+    self.segment  = None
+    self.index    = None
+    self.last     = None # number of the picture added last
+    if not os.path.isdir(path):
+      os.makedirs(path)
+    names = segmentNames(path)
+    self.number = int(names[-1][4:10]) if names else 0
+    if names:
+      self.resume(os.path.join(path, names[-1]))
+    for name in reversed(names):
+      if self.last is not None:
+        break
+      self.last = self.lastNumber(os.path.join(path, name))
+
+  def lastNumber(self, segname):
+    """Number of the last picture in a segment, from its index or, when the
+    index is missing or empty, from the picture headers. None when empty."""
+    try:
+      with open(segname[:-4] + '.idx', 'rb') as f:
+        f.seek(0, 2)
+        if f.tell() >= RECORD.size:
+          f.seek(f.tell() // RECORD.size * RECORD.size - RECORD.size)
+          return RECORD.unpack(f.read(RECORD.size))[3]
+    except (IOError, OSError):
+      pass
+    try:
+      records, end = scan(segname)
+    except (IOError, OSError, struct.error):
+      logger.warning('cannot read ' + segname, exc_info=True)
+      return None
+    return records[-1][3] if records else None
+
+  def names(self, number):
+    base = os.path.join(self.path, 'SEG_%06d' % number)
+    return base + '.seg', base + '.idx'
+
+  def resume(self, segname):
+    """Continue the last segment, dropping a picture cut short and
+    rebuilding its index from the picture headers."""
+    records, end = scan(segname)
+    idxname      = segname[:-4] + '.idx'
+    with open(idxname, 'wb') as f:
+      for r in records:
+        f.write(RECORD.pack(*r))
+    self.segment = open(segname, 'r+b')
+    self.segment.truncate(end)
+    self.segment.seek(end)
+    self.index   = open(idxname, 'ab')
+    self.started = records[0][2] if records else time.time()
+
+  def rotate(self):
+    self.close()
+    self.number += 1
+    segname, idxname = self.names(self.number)
+    self.segment = open(segname, 'wb')
+    self.index   = open(idxname, 'wb')
+    self.started = time.time()
+    logger.info('new segment ' + segname)
+
+  def add(self, data, number=0, when=None):
+    """Append a picture, returns (segment number, offset of the picture)."""
+    when = time.time() if when is None else when
+    with self.lock:
+      if (self.segment is None or
+          (self.segment.tell() and self.segment.tell() + HEADER.size + len(data) > self.maxBytes) or
+          when - self.started > self.maxAge):
+        self.rotate()
+      offset = self.segment.tell()
+      self.segment.write(HEADER.pack(MAGIC, len(data), when, number))
+      self.segment.write(data)
+      self.flush(self.segment)
+      # index after the picture, an index record never points past the data
+      self.index.write(RECORD.pack(offset + HEADER.size, len(data), when, number))
+      self.flush(self.index)
+      self.last = number
+      return self.number, offset + HEADER.size
+
+  def flush(self, f):
+    f.flush()
+    if self.sync:
+      os.fsync(f.fileno())
+
+  def close(self):
+    for f in (self.segment, self.index):
+      if f: f.close()
+    self.segment = self.index = None
+#------------------------------------------------------------------------------#
+# SegmentReader: all pictures of a folder of segments, pictures are slices of  #
+#                mmap'ed segments                                              #
+#                                                                              #
+# Parameters: path  folder of the segments                                     #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class SegmentReader(object):
+  def __init__(self, path):
+    self.path     = path
+    self.lock     = threading.Lock()
+    self.segments = {}  # segment name -> [bytes of the index read, file, mmap]
+    self.entries  = []  # (segment name, offset, length, time, number)
+    self.refresh()
+
+  def refresh(self):
+    """Pick up pictures written since the last refresh."""
+    with self.lock:
+      for name in segmentNames(self.path):
+        seg = self.segments.setdefault(name, [0, None, None])
+        try:
+          with open(os.path.join(self.path, name[:-4] + '.idx'), 'rb') as f:
+            f.seek(seg[0])
+            data = f.read()
+        except IOError:
+          continue
+        data    = data[:len(data) - len(data) % RECORD.size] # record being written
+        seg[0] += len(data)
+        for i in range(0, len(data), RECORD.size):
+          self.entries.append((name,) + RECORD.unpack(data[i:i + RECORD.size]))
+    return len(self.entries)
+
+  def __len__(self):
+    return len(self.entries)
+
+  def mapping(self, name, end):
+    seg = self.segments[name]
+    if seg[2] is None or len(seg[2]) < end:
+      # (re)map, the segment may have grown since it was mapped
+      if seg[1] is None:
+        seg[1] = open(os.path.join(self.path, name), 'rb')
+      seg[2] = mmap.mmap(seg[1].fileno(), 0, access=mmap.ACCESS_READ)
+    return seg[2]
+
+  def frame(self, i):
+    """Picture i without copying (memoryview, buffer on python 2)."""
+    name, offset, length, when, number = self.entries[i]
+    with self.lock:
+      mm = self.mapping(name, offset + length)
+    return view(mm, offset, length)
+
+  def open(self, i):
+    """Picture i as a file object for pygame and PIL."""
+    return io.BytesIO(bytes(self.frame(i)))
+
+  def info(self, i):
+    """(time, number) of picture i."""
+    return self.entries[i][3:5]
+
+  def close(self):
+    with self.lock:
+      for seg in self.segments.values():
+        if seg[1]: seg[1].close()
+        seg[1] = seg[2] = None # mappings close once the last slice is gone
+#------------------------------------------------------------------------------#
+# SegmentBackend: storage backend appending the pictures to segments, use     #
+#                 with a single worker so pictures stay in order               #
+#                                                                              #
+# Parameters: see SegmentWriter                                                #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class SegmentBackend(object):
+  metered = False
+
+  def __init__(self, path, maxBytes=256 * 1024 * 1024, maxAge=3600, sync=True):
+    self.writer = SegmentWriter(path, maxBytes, maxAge, sync)
+
+  def put(self, remote, data):
+    m = re.search(r'(\d+)\.JPG$', remote, re.IGNORECASE)
+    self.writer.add(data, int(m.group(1)) if m else 0)
+#------------------------------------------------------------------------------#
+# export: write the pictures of a folder of segments as IMG_XXXX.JPG files,    #
+#         returns the number of files written                                  #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def export(source, target, first=0, last=9999):
+  reader = SegmentReader(source)
+  if not os.path.isdir(target):
+    os.makedirs(target)
+  written = 0
+  for i in range(len(reader)):
+    when, number = reader.info(i)
+    if not first <= number <= last:
+      continue
+    filename = os.path.join(target, 'IMG_' + '%04d' % number + '.JPG')
+    if os.path.exists(filename): # numbers wrap at 9999, keep both pictures
+      filename = os.path.join(target, 'IMG_' + '%04d' % number + '_' + str(i) + '.JPG')
+    with open(filename, 'wb') as f:
+      f.write(reader.frame(i))
+    os.utime(filename, (when, when))
+    written += 1
+  reader.close()
+  return written
+#------------------------------------------------------------------------------#
+# main: export or describe segments from the command line                      #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='picture segments written by cam.py')
+  sub    = parser.add_subparsers(dest='command')
+  p = sub.add_parser('export', help='write the pictures as IMG_XXXX.JPG files')
+  p.add_argument('source')
+  p.add_argument('target')
+  p.add_argument('--first', type=int, default=0,    help='lowest picture number')
+  p.add_argument('--last',  type=int, default=9999, help='highest picture number')
+  p = sub.add_parser('info', help='pictures and bytes per segment')
+  p.add_argument('source')
+  args = parser.parse_args(argv)
+  if args.command == 'export':
+    print('%d pictures written' % export(args.source, args.target, args.first, args.last))
+  elif args.command == 'info':
+    reader = SegmentReader(args.source)
+    for name in sorted(reader.segments):
+      e = [x for x in reader.entries if x[0] == name]
+      if e:
+        print('%s: %d pictures, %d bytes, %s .. %s' % (name, len(e), sum(x[2] for x in e),
+              time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(e[0][3])),
+              time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(e[-1][3]))))
+    reader.close()
+  else:
+    parser.print_help()
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,447 @@
+#    Copyright 2014 Helios Taraba
+#
+#    This file provides the storage backends pictures are sent to
+#
+#    storage.py is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    storage.py is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with storage.py.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Storage backends and concurrent fan-out of pictures to several destinations.
+
+A backend knows how to store one picture (put), a Destination wraps a
+backend with its own bounded queue and worker threads. Submitting never
+blocks: when a destination's queue is full the picture is dropped for that
+destination only (and counted), so a slow or unreachable destination never
+holds up the capture or the other destinations.
+
+Destinations are configured in config.ini, one section per destination:
+
+  [STORAGE:nas]
+  type=http                   local, boot, dropbox, http, segments or fleet
+  url=http://nas/webdav/cam   http: base url, pictures are PUT below it
+  kinds=picture,webcam        pictures this destination wants
+  workers=2
+  queue=8
+
+For testing, python storage.py serve --port 8081 --root /tmp/standin runs
+a stand-in http server which stores PUT requests below root, and
+python fleet.py collect --port 9000 --root /tmp/fleet a fleet collector.
+"""
+import base64
+import io
+import logging
+import os
+import stat
+import threading
+import time
+try:
+  import queue
+except ImportError:
+  import Queue as queue
+import segments
+import fleet
+import tracing
+try:
+  import http.client as httplib
+  from urllib.parse import urlparse, quote
+except ImportError:
+  import httplib
+  from urlparse import urlparse
+  from urllib import quote
+try:
+  import dropbox
+except ImportError:
+  dropbox = None
+
+logger = logging.getLogger('WEBCAM.storage')
+KINDS  = ('picture', 'webcam') # full size pictures, small webcam images
+#------------------------------------------------------------------------------#
+# LocalFolderBackend: stores pictures in a local folder. Pictures are written  #
+#                     to a temporary name first and renamed, a reader never   #
+#                     sees a half written file.                                #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class LocalFolderBackend(object):
+  metered = False
+
+  def __init__(self, path):
+    self.path = path
+
+  def put(self, remote, data):
+    filename = os.path.join(self.path, remote)
+    folder   = os.path.dirname(filename)
+    if not os.path.isdir(folder):
+      os.makedirs(folder)
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+      f.write(data)
+      self.sync(f)
+    os.rename(tmp, filename)
+    self.chmod(filename)
+
+  def sync(self, f):
+    pass
+
+  def chmod(self, filename):
+    os.chmod(filename, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
+#------------------------------------------------------------------------------#
+# BootPartitionBackend: local folder on the FAT boot partition, no unix        #
+#                       permissions there, flushed to the card right away as   #
+#                       people pull the card out of a running camera           #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class BootPartitionBackend(LocalFolderBackend):
+  def sync(self, f):
+    f.flush()
+    os.fsync(f.fileno())
+
+  def chmod(self, filename):
+    pass
+#------------------------------------------------------------------------------#
+# DropboxBackend: uploads to dropbox, one client for all uploads               #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class DropboxBackend(object):
+  metered = True
+
+  def __init__(self, token, folder='Photos'):
+    if dropbox is None:
+      raise ImportError('dropbox backend requires the dropbox library')
+    self.token  = token
+    self.folder = folder
+    self.client = None
+
+  def put(self, remote, data):
+    if self.client is None:
+      self.client = dropbox.client.DropboxClient(self.token)
+    try:
+      self.client.put_file(self.folder + '/' + remote, io.BytesIO(data), overwrite=True)
+    except Exception:
+      self.client = None # start over with a fresh client next time
+      raise
+#------------------------------------------------------------------------------#
+# HttpBackend: PUTs pictures below a base url, works with WebDAV servers and   #
+#              S3 compatible buckets that accept unsigned PUT. Every worker    #
+#              keeps its own persistent connection.                            #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class HttpBackend(object):
+  metered = True
+
+  def __init__(self, url, username=None, password=None, timeout=30):
+    self.url     = urlparse(url)
+    self.timeout = timeout
+    self.headers = {}
+    if username:
+      token = base64.b64encode((username + ':' + (password or '')).encode('utf-8'))
+      self.headers['Authorization'] = 'Basic ' + token.decode('ascii')
+    self.local = threading.local()
+
+  def connection(self):
+    c = getattr(self.local, 'connection', None)
+    if c is None:
+      if self.url.scheme == 'https':
+        c = httplib.HTTPSConnection(self.url.netloc, timeout=self.timeout)
+      else:
+        c = httplib.HTTPConnection(self.url.netloc, timeout=self.timeout)
+      self.local.connection = c
+    return c
+
+  def put(self, remote, data):
+    path    = self.url.path.rstrip('/') + '/' + quote(remote)
+    headers = dict(self.headers)
+    headers['Content-Type']   = 'image/jpeg'
+    headers['Content-Length'] = str(len(data))
+    c = self.connection()
+    try:
+      c.request('PUT', path, data, headers)
+      response = c.getresponse()
+      response.read()
+    except Exception:
+      c.close()
+      self.local.connection = None
+      raise
+    if response.status // 100 != 2:
+      raise IOError('PUT ' + path + ' failed: ' + str(response.status) + ' ' + str(response.reason))
+#------------------------------------------------------------------------------#
+# Destination: a backend with its own bounded queue and worker threads         #
+#                                                                              #
+# Parameters: name       name used in logs and statistics                      #
+#             backend    one of the backends above                             #
+#             kinds      kinds of pictures this destination accepts            #
+#             workers    number of worker threads                              #
+#             queueSize  pictures waiting before new ones are dropped          #
+#             retries    attempts after a failed put                           #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class Destination(object):
+  def __init__(self, name, backend, kinds=KINDS, workers=1, queueSize=8, retries=2):
+    self.name     = name
+    self.backend  = backend
+    self.kinds    = set(kinds)
+    self.metered  = backend.metered
+    self.retries  = retries
+    self.queue    = queue.Queue(queueSize)
+    self.stopping = threading.Event()
+    self.lock     = threading.Lock()
+    self.counters = { 'sent': 0, 'bytes': 0, 'failed': 0, 'dropped': 0, 'retried': 0, 'skipped': 0 }
+    self.threads  = []
+    for i in range(workers):
+      t = threading.Thread(target=self.work, name='STORAGE_' + name.upper() + '_' + str(i))
+      t.daemon = True
+      t.start()
+      self.threads.append(t)
+
+  def accepts(self, kind):
+    return kind in self.kinds
+
+  def submit(self, remote, data, onSent=None, prepare=None):
+    """Queue a picture, returns False when it was dropped. prepare(data) runs
+    on the worker before the picture is stored and returns the bytes to
+    store, None to skip it."""
+    try:
+      self.queue.put_nowait((remote, data, onSent, prepare))
+      return True
+    except queue.Full:
+      self.count('dropped')
+      logger.warning('storage ' + self.name + ' busy, dropped ' + remote)
+      return False
+
+  def count(self, key, n=1):
+    with self.lock:
+      self.counters[key] += n
+
+  def work(self):
+    while not self.stopping.is_set():
+      try:
+        remote, data, onSent, prepare = self.queue.get(timeout=1)
+      except queue.Empty:
+        continue
+      if prepare:
+        try:
+          with tracing.span('prepare', 'storage', destination=self.name):
+            data = prepare(data)
+        except Exception:
+          logger.error('storage ' + self.name + ' failed to prepare ' + remote, exc_info=True)
+          self.count('failed')
+          continue
+        if data is None:
+          self.count('skipped')
+          continue
+      for attempt in range(self.retries + 1):
+        try:
+          with tracing.span('upload', 'storage', destination=self.name, bytes=len(data)):
+            self.backend.put(remote, data)
+          self.count('sent')
+          self.count('bytes', len(data))
+          if onSent: onSent(len(data))
+          logger.info('storage ' + self.name + ' stored ' + remote + ' ' + str(len(data)) + ' bytes')
+          break
+        except Exception:
+          logger.error('storage ' + self.name + ' failed to store ' + remote, exc_info=True)
+          if attempt == self.retries or self.stopping.wait(2 ** attempt):
+            self.count('failed')
+            break
+          self.count('retried')
+
+  def stop(self, timeout=5, join=30):
+    """Give the workers timeout seconds to empty the queue, then stop them
+    and wait up to join seconds for the pictures being stored, so the
+    backend can be closed afterwards. Pictures left queued count as dropped."""
+    end = time.time() + timeout
+    while not self.queue.empty() and time.time() < end:
+      time.sleep(0.1)
+    self.stopping.set()
+    for t in self.threads:
+      t.join(join)
+      if t.is_alive():
+        logger.warning('storage ' + self.name + ': ' + t.name + ' still storing a picture')
+    left = 0
+    while True:
+      try:
+        self.queue.get_nowait()
+        left += 1
+      except queue.Empty:
+        break
+    if left:
+      self.count('dropped', left)
+      logger.warning('storage ' + self.name + ' stopped, dropped ' + str(left) + ' queued pictures')
+
+  def queuedBytes(self):
+    with self.queue.mutex:
+      return sum(len(item[1] or b'') for item in self.queue.queue)
+
+  def stats(self):
+    with self.lock:
+      d = dict(self.counters)
+    d['queued'] = self.queue.qsize()
+    return d
+#------------------------------------------------------------------------------#
+# submit: hand a picture to every destination accepting its kind, kind None    #
+#         to all of them. For metered destinations prepare(data) makes the    #
+#         bytes to send on the worker of the first one to get there, once per  #
+#         picture, None skips the picture.                                     #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def submit(destinations, kind, remote, data, prepare=None, onMeteredSent=None):
+  prepare = Once(prepare) if prepare else None
+  for d in destinations:
+    if kind is not None and not d.accepts(kind):
+      continue
+    if d.metered:
+      d.submit(remote, data, onMeteredSent, prepare)
+    else:
+      d.submit(remote, data)
+#------------------------------------------------------------------------------#
+# Once: calls func on the first call only, later calls get the same result     #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class Once(object):
+  def __init__(self, func):
+    self.func   = func
+    self.lock   = threading.Lock()
+    self.done   = False
+    self.result = None
+
+  def __call__(self, *args):
+    with self.lock:
+      if not self.done:
+        self.result = self.func(*args)
+        self.done   = True
+      return self.result
+#------------------------------------------------------------------------------#
+# fromConfig: create the destinations from the STORAGE:<name> sections        #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def fromConfig(config, dropboxToken=None):
+  destinations = []
+  for section in config.sections():
+    if not section.startswith('STORAGE:'):
+      continue
+    name = section.split(':', 1)[1]
+    c    = config[section]
+    try:
+      kind = c.get('type', 'local')
+      if kind == 'local':
+        backend = LocalFolderBackend(c.get('path'))
+      elif kind == 'boot':
+        backend = BootPartitionBackend(c.get('path', '/boot/DCIM/CANON999'))
+      elif kind == 'dropbox':
+        backend = DropboxBackend(c.get('token', dropboxToken), c.get('folder', 'Photos'))
+      elif kind == 'http':
+        backend = HttpBackend(c.get('url'), c.get('username'), c.get('password'), c.getint('timeout', 30))
+      elif kind == 'fleet':
+        backend = fleet.FleetBackend(c.get('host'), c.getint('port', 9000), c.get('camera_id'),
+                                     c.getint('batch_kb', 256) * 1024, c.getfloat('batch_delay', 1.0),
+                                     c.getint('max_queued', 256))
+      elif kind == 'segments':
+        backend = segments.SegmentBackend(c.get('path'), c.getint('max_mb', 256) * 1024 * 1024,
+                                          c.getint('max_minutes', 60) * 60, c.getboolean('sync', False))
+      else:
+        raise ValueError('unknown storage type ' + kind)
+      kinds = [k.strip() for k in c.get('kinds', ','.join(KINDS)).split(',') if k.strip()]
+      destinations.append(Destination(name, backend, kinds,
+                                      workers   = 1 if kind in ('segments', 'fleet') else c.getint('workers', 1),
+                                      queueSize = c.getint('queue', 8),
+                                      retries   = c.getint('retries', 2)))
+    except Exception:
+      logger.error('storage ' + name + ' disabled', exc_info=True)
+  return destinations
+#------------------------------------------------------------------------------#
+# serve: run a minimal http server storing PUT requests below a folder, a      #
+#        local stand in for a WebDAV server or bucket when testing             #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def serve(port, root, delay=0.0):
+  try:
+    from http import server as httpserver
+  except ImportError:
+    import BaseHTTPServer as httpserver
+  import mjpeg
+
+  class StandInHandler(httpserver.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def target(self):
+      path = os.path.normpath(self.path.lstrip('/'))
+      if path.startswith('..'):
+        return None
+      return os.path.join(root, path)
+
+    def do_PUT(self):
+      length   = int(self.headers.get('Content-Length', 0))
+      data     = self.rfile.read(length)
+      filename = self.target()
+      if filename is None:
+        self.reply(403)
+        return
+      time.sleep(delay) # pretend to be a slow destination
+      if not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+      with open(filename, 'wb') as f:
+        f.write(data)
+      self.reply(201)
+
+    def do_GET(self):
+      filename = self.target()
+      if filename is None or not os.path.isfile(filename):
+        self.reply(404)
+        return
+      with open(filename, 'rb') as f:
+        self.reply(200, f.read())
+
+    def reply(self, code, body=b''):
+      self.send_response(code)
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+  server = mjpeg.StreamServer(('', port), StandInHandler)
+  print('stand-in storage on port ' + str(port) + ', storing below ' + root)
+  server.serve_forever()
+
+if __name__ == '__main__':
+  import argparse
+  parser = argparse.ArgumentParser(description='storage backend tools')
+  sub    = parser.add_subparsers(dest='command')
+  s      = sub.add_parser('serve', help='run a stand-in http storage server')
+  s.add_argument('--port',  type=int,   default=8081)
+  s.add_argument('--root',  default='./standin')
+  s.add_argument('--delay', type=float, default=0.0, help='seconds to wait per PUT, simulates a slow destination')
+  args = parser.parse_args()
+  if args.command == 'serve':
+    serve(args.port, args.root, args.delay)
+  else:
+    parser.print_help()
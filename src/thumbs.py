@@ -0,0 +1,197 @@
+#    Copyright 2014 Helios Taraba
+#
+#    This file provides the thumbnail store for the grid screen
+#
+#    thumbs.py is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    thumbs.py is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with thumbs.py.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Persistent thumbnails for the grid screen. Thumbnails live in a .thumbs
+folder next to the pictures, one small jpeg per picture named after the
+picture, its modification time and its size:
+
+  .thumbs/IMG_0042.JPG.1418031234.2481337.jpg
+
+so a picture that is replaced gets a new thumbnail and a stale one is never
+shown. The folder is listed once per store, after that a lookup is a stat
+of the picture. Missing thumbnails are made by a background thread, either
+right after a picture is taken or the first time the grid shows it; the
+pictures on screen go first. Recently shown thumbnails are kept in memory.
+"""
+import collections
+import logging
+import os
+import threading
+try:
+  from PIL import Image
+except ImportError:
+  Image = None
+try:
+  import pygame
+except ImportError:
+  pygame = None
+
+logger     = logging.getLogger('WEBCAM.thumbs')
+FOLDER     = '.thumbs'
+THUMB_SIZE = (96, 72) # largest thumbnail, the grid scales down further
+#------------------------------------------------------------------------------#
+# fit: largest size with the aspect ratio of size that fits into box           #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def fit(size, box):
+  scale = min(float(box[0]) / size[0], float(box[1]) / size[1])
+  return (max(1, int(size[0] * scale)), max(1, int(size[1] * scale)))
+#------------------------------------------------------------------------------#
+# ThumbnailStore: thumbnails of the pictures in one folder                    #
+#                                                                              #
+# Parameters: path    folder with the pictures                                 #
+#             size    thumbnail size (box, aspect ratio is kept)               #
+#             cache   thumbnails kept in memory                                #
+#             quality jpeg quality of the thumbnails                           #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class ThumbnailStore(object):
+  def __init__(self, path, size=THUMB_SIZE, cache=64, quality=80):
+    self.path      = path
+    self.folder    = os.path.join(path, FOLDER)
+    self.size      = size
+    self.quality   = quality
+    self.cacheSize = cache
+    self.cache     = collections.OrderedDict() # thumb file -> surface
+    self.index     = None   # picture name -> thumb file, read on first use
+    self.cond      = threading.Condition()
+    self.pending   = collections.deque()       # pictures waiting for a thumbnail
+    self.queued    = set()
+    self.generated = 0      # thumbnails made, the grid redraws when it changes
+    self.failed    = 0
+    self.running   = True
+    self.thread    = threading.Thread(target=self.work, name='thumbs')
+    self.thread.daemon = True
+    self.thread.start()
+
+  def readIndex(self):
+    index = {}
+    try:
+      for f in os.listdir(self.folder):
+        parts = f.rsplit('.', 3)
+        if len(parts) == 4 and parts[3] == 'jpg':
+          index[parts[0]] = f
+    except OSError:
+      pass
+    return index
+
+  def key(self, filename):
+    """Thumb file name for the picture as it is now, None if it is gone."""
+    try:
+      st = os.stat(filename)
+    except OSError:
+      return None
+    return '%s.%d.%d.jpg' % (os.path.basename(filename), int(st.st_mtime), st.st_size)
+
+  def lookup(self, filename):
+    """(thumb file, up to date) for a picture."""
+    key = self.key(filename)
+    with self.cond:
+      if self.index is None:
+        self.index = self.readIndex()
+      return key, key is not None and self.index.get(os.path.basename(filename)) == key
+
+  def get(self, filename, urgent=True):
+    """Thumbnail surface of a picture, None while it is being made."""
+    key, ok = self.lookup(filename)
+    if key is None:
+      return None
+    if not ok:
+      self.request(filename, urgent)
+      return None
+    surface = self.cache.pop(key, None)
+    if surface is None:
+      try:
+        surface = pygame.image.load(os.path.join(self.folder, key))
+      except Exception:
+        self.request(filename, urgent) # damaged, make it again
+        return None
+    self.cache[key] = surface
+    while len(self.cache) > self.cacheSize:
+      self.cache.popitem(last=False)
+    return surface
+
+  def request(self, filename, urgent=False):
+    """Queue a picture for a thumbnail, urgent ones go first."""
+    with self.cond:
+      if filename in self.queued:
+        if urgent: # move to the front, it is on screen now
+          self.pending.remove(filename)
+          self.pending.appendleft(filename)
+        return
+      self.queued.add(filename)
+      if urgent:
+        self.pending.appendleft(filename)
+      else:
+        self.pending.append(filename)
+      self.cond.notify()
+
+  def work(self):
+    while True:
+      with self.cond:
+        while self.running and not self.pending:
+          self.cond.wait()
+        if not self.running:
+          return
+        filename = self.pending.popleft()
+        self.queued.discard(filename)
+      try:
+        key, ok = self.lookup(filename)
+        if key is not None and not ok:
+          self.make(filename, key)
+      except Exception:
+        self.failed += 1
+        logger.warning('cannot make thumbnail of %s', filename, exc_info=True)
+
+  def make(self, filename, key):
+    if not os.path.isdir(self.folder):
+      os.makedirs(self.folder)
+    target = os.path.join(self.folder, key)
+    tmp    = os.path.join(self.folder, 'tmp-' + key) # not a valid key, ignored by readIndex
+    if Image is not None:
+      img = Image.open(filename)
+      img.draft('RGB', self.size) # decoder scales down itself
+      img = img.convert('RGB')
+      img = img.resize(fit(img.size, self.size), Image.BILINEAR)
+      img.save(tmp, 'JPEG', quality=self.quality)
+    else:
+      img = pygame.image.load(filename)
+      pygame.image.save(pygame.transform.smoothscale(img, fit(img.get_size(), self.size)), tmp)
+    os.rename(tmp, target)
+    name = os.path.basename(filename)
+    with self.cond:
+      old = self.index.get(name)
+      self.index[name] = key
+      self.generated  += 1
+    if old and old != key:
+      try:
+        os.remove(os.path.join(self.folder, old))
+      except OSError:
+        pass
+
+  def stop(self):
+    with self.cond:
+      self.running = False
+      self.cond.notify_all()
+    self.thread.join(5)
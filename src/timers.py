@@ -22,6 +22,9 @@ Generic timer related classes
 """
 import os,sys
 import threading
+import time
+
+import tracing
 #------------------------------------------------------------------------------#
 # Timer: Timer class based on the standard threading.Timer class. This class   #
 #        differs from the standard in that it splits the waits up into slices  #
@@ -56,7 +59,8 @@ class Timer(threading.Thread):
         self.interval = self.interval-MAX
     self.finished.wait(self.interval)
     if not self.finished.is_set():
-        self.function(*self.args, **self.kwargs)
+        with tracing.span('timer', 'timer'):
+          self.function(*self.args, **self.kwargs)
     self.finished.set()
     
 
@@ -82,7 +86,8 @@ class RepeatingTimer(threading.Thread):
           waitRemainder = waitRemainder-MAX
       self.finished.wait(waitRemainder)
       if not self.finished.is_set():
-          self.function(*self.args, **self.kwargs)
+          with tracing.span('timer', 'timer'):
+            self.function(*self.args, **self.kwargs)
     
 class RRepeatingTimer(object):
   def __init__(self, interval, function, args=None, kwargs=None):
@@ -106,3 +111,51 @@ class RRepeatingTimer(object):
     if self.interval:
       self.function(*self.args, **self.kwargs)
       Timer(self.interval, self.callback).start()   
+#------------------------------------------------------------------------------#
+# AdaptiveRepeatingTimer: repeating timer whose interval may be changed while  #
+#                         it is waiting. The next call is due interval seconds #
+#                         after the previous call, when the new interval has   #
+#                         already passed the function is called right away.    #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class AdaptiveRepeatingTimer(threading.Thread):
+  def __init__(self, interval, function, args=None, kwargs=None):
+    threading.Thread.__init__(self)
+    self.interval  = interval
+    self.function  = function
+    self.args      = args if args is not None else []
+    self.kwargs    = kwargs if kwargs is not None else {}
+    self.finished  = False
+    self.condition = threading.Condition()
+    self.last      = None
+
+  def cancel(self):
+    """Stop the timer if it hasn't finished yet."""
+    with self.condition:
+      self.finished = True
+      self.condition.notify()
+
+  def setInterval(self, interval):
+    """Change the interval, takes effect immediately."""
+    with self.condition:
+      self.interval = interval
+      self.condition.notify()
+
+  def run(self):
+    MAX=1800
+    self.last = time.time()
+    while True:
+      with self.condition:
+        while not self.finished:
+          remaining = self.last + self.interval - time.time()
+          if remaining <= 0:
+            break
+          self.condition.wait(min(remaining, MAX))
+        if self.finished:
+          return
+      late      = time.time() - (self.last + self.interval)
+      self.last = time.time()
+      with tracing.span('timer', 'timer', lateMs=int(late * 1000)):
+        self.function(*self.args, **self.kwargs)
@@ -0,0 +1,217 @@
+#    Copyright 2014 Helios Taraba
+#
+#    This file provides the timeline tracing of cam.py
+#
+#    tracing.py is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    tracing.py is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with tracing.py.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Timeline tracing: spans of the key operations (picture taken, capture,
+decode, display updates, timer fires, uploads ...) on all threads are kept
+in a ring buffer of the last few thousand and written out as Chrome trace
+event json, which https://ui.perfetto.dev or chrome://tracing show as a
+timeline with a row per thread:
+
+  with tracing.span('decode'):
+    img = pygame.image.load(...)
+
+  @tracing.traced('saveSettings')
+  def saveSettings(): ...
+
+The ring buffer takes no lock: every event gets its slot from an
+itertools.count, whose next() is atomic under the GIL, and a slot is a
+single list item assignment. While tracing is off span() hands out one
+shared do nothing context manager, so the calls can stay in place.
+"""
+import functools
+import itertools
+import json
+import logging
+import os
+import signal
+import threading
+import time
+
+logger  = logging.getLogger('WEBCAM.tracing')
+enabled = False
+ring    = None
+#------------------------------------------------------------------------------#
+# Ring: fixed size buffer of the last size events, oldest overwritten          #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class Ring(object):
+  def __init__(self, size=20000):
+    self.size    = size
+    self.slots   = [None] * size
+    self.counter = itertools.count()
+
+  def add(self, event):
+    self.slots[next(self.counter) % self.size] = event
+
+  def events(self):
+    """Snapshot of the events in the buffer, oldest first."""
+    return sorted((e for e in list(self.slots) if e is not None), key=lambda e: e[0])
+#------------------------------------------------------------------------------#
+# Span: context manager recording one span into the ring                       #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+class Span(object):
+  __slots__ = ('name', 'cat', 'args', 'start')
+
+  def __init__(self, name, cat, args):
+    self.name = name
+    self.cat  = cat
+    self.args = args
+
+  def __enter__(self):
+    self.start = time.time()
+    return self
+
+  def __exit__(self, excType, exc, tb):
+    end    = time.time()
+    thread = threading.current_thread()
+    if excType is not None:
+      self.args = dict(self.args or {}, error=excType.__name__)
+    ring.add((self.start, end - self.start, self.name, self.cat, thread.ident, thread.name, self.args))
+    return False
+
+class NoSpan(object):
+  __slots__ = ()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, excType, exc, tb):
+    return False
+
+NOSPAN = NoSpan()
+#------------------------------------------------------------------------------#
+# span: context manager timing the block as name, does nothing while disabled  #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def span(name, cat='cam', **args):
+  if not enabled:
+    return NOSPAN
+  return Span(name, cat, args or None)
+#------------------------------------------------------------------------------#
+# traced: decorator timing every call of a function as a span                  #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def traced(name=None, cat='cam'):
+  def decorate(func):
+    label = name or func.__name__
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+      if not enabled:
+        return func(*args, **kwargs)
+      with Span(label, cat, None):
+        return func(*args, **kwargs)
+    return wrapper
+  return decorate
+#------------------------------------------------------------------------------#
+# instant: a point in time without duration, e.g. a picture found late         #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def instant(name, cat='cam', **args):
+  if enabled:
+    thread = threading.current_thread()
+    ring.add((time.time(), None, name, cat, thread.ident, thread.name, args or None))
+#------------------------------------------------------------------------------#
+# enable: start tracing into a new ring of size events, disable: stop it       #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def enable(size=20000):
+  global enabled, ring
+  ring    = Ring(size)
+  enabled = True
+
+def disable():
+  global enabled
+  enabled = False
+#------------------------------------------------------------------------------#
+# chromeTrace: the events in the ring as a Chrome trace event dictionary       #
+#                                                                              #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def chromeTrace():
+  pid     = os.getpid()
+  events  = []
+  threads = {}
+  for start, duration, name, cat, tid, threadName, args in (ring.events() if ring else []):
+    threads[tid] = threadName
+    e = { 'name': name, 'cat': cat, 'pid': pid, 'tid': tid, 'ts': int(start * 1e6) }
+    if duration is None:
+      e['ph'] = 'i'
+      e['s']  = 't'
+    else:
+      e['ph']  = 'X'
+      e['dur'] = int(duration * 1e6)
+    if args:
+      e['args'] = args
+    events.append(e)
+  for tid, threadName in threads.items():
+    events.append({ 'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': { 'name': threadName } })
+  return { 'traceEvents': events, 'displayTimeUnit': 'ms' }
+#------------------------------------------------------------------------------#
+# dump: write the ring as Chrome trace json to filename, returns the number of #
+#       events written                                                         #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def dump(filename):
+  trace = chromeTrace()
+  tmp   = filename + '.tmp'
+  with open(tmp, 'w') as f:
+    json.dump(trace, f, separators=(',', ':'))
+  os.rename(tmp, filename)
+  count = sum(1 for e in trace['traceEvents'] if e['ph'] != 'M')
+  logger.info('trace of ' + str(count) + ' events written to ' + filename)
+  return count
+#------------------------------------------------------------------------------#
+# dumpOnSignal: dump the ring to folder/trace-<date>-<time>.json whenever the  #
+#               process receives signum (kill -USR2 <pid>)                     #
+#------------------------------------------------------------------------------#
+# version who when       description                                           #
+# 1.00    hta 19.10.2026 Initial version                                       #
+#------------------------------------------------------------------------------#
+def dumpOnSignal(folder, signum=signal.SIGUSR2):
+  def handler(signum, frame):
+    try:
+      if not os.path.isdir(folder):
+        os.makedirs(folder)
+      dump(os.path.join(folder, time.strftime('trace-%Y%m%d-%H%M%S.json')))
+    except Exception:
+      logger.error('trace dump failed', exc_info=True)
+  signal.signal(signum, handler)